@@ -2,22 +2,67 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
-from pprint import pformat
+from collections import namedtuple
 import logging
-
-import boto3
-from botocore.exceptions import ClientError
-from toolz.curried import assoc_in, get_in, keyfilter, merge, pipe, update_in
-from voluptuous import Any, ExactSequence, Schema, ALLOW_EXTRA, REMOVE_EXTRA
-
-from src import cfnresponse
+import os
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError, ParamValidationError
+from toolz.curried import assoc, assoc_in, get_in, groupby, keyfilter, merge, pipe, update_in
+from voluptuous import Any, ExactSequence, Match, Optional, Schema, ALLOW_EXTRA, REMOVE_EXTRA
+
+from src import cfnresponse, logs, metrics, profiling, snapshots, snapstart, throttling
+from src.classify import TieredClassifier
+from src.clients import ClientRegistry, registry
+from src.concurrency import deadline, inner_deadline, run_concurrently
+from src.pagination import paginate
+from src.validation import compiled
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-ct = boto3.client('cloudtrail')
-cur = boto3.client('cur', region_name='us-east-1')  # cur is only in us-east-1
-orgs = boto3.client('organizations')
-s3 = boto3.client('s3')
+logs.configure(logger)
+
+
+# Clients come from world['clients'] when present (an assumed-role session per account, see src.fleet),
+# otherwise from this Lambda's own registry.
+world_clients = get_in(['clients'], default=registry)
+
+
+def ct(world, region_name=None):
+    return world_clients(world).client('cloudtrail', region_name=region_name)
+
+
+def ec2(world):
+    return world_clients(world).client('ec2')
+
+
+def local_region(world):
+    return world_clients(world).session.region_name
+
+
+def cur(world):
+    return world_clients(world).client('cur', region_name='us-east-1')  # cur is only in us-east-1
+
+
+def data_exports(world):
+    return world_clients(world).client('bcm-data-exports', region_name='us-east-1')  # like cur, only in us-east-1
+
+
+def orgs(world):
+    return world_clients(world).client('organizations')
+
+
+def s3(world):
+    return world_clients(world).client('s3')
+
+
+# Preloaded when Lambda initializes ahead of requests, e.g. for a SnapStart snapshot; as the accessors above create them
+PRELOADED_CLIENTS = [('cloudtrail', None), ('ec2', None), ('cur', 'us-east-1'), ('bcm-data-exports', 'us-east-1'),
+                     ('organizations', None), ('s3', None)]
+snapstart.init(registry, PRELOADED_CLIENTS, pools=[cfnresponse.http])
+
 
 DEFAULT_OUTPUT = {
     'AuditCloudTrailBucketPrefix': None,
@@ -39,24 +84,33 @@ DEFAULT_OUTPUT = {
     'IsAccountOutsideOrganization': False,
 }
 
+# The one output that grows with the organization and that no grant is made from: the Notification resource
+# only echoes it to the reactor, so it may be cut to fit the CloudFormation response. The bucket ARNs become IAM
+# grants and are never cut; a response too large without them fails instead.
+TRUNCATABLE_OUTPUTS = frozenset(['VisibleCloudTrailArns'])
+
 
 #####################
 #
 # Boundary Validation
 #
 #####################
-INPUT_SCHEMA = Schema({
+INPUT_SCHEMA = compiled(Schema({
     'event': {
         'RequestType': Any('Create', 'Update', 'Delete'),
         'ResourceProperties': {
-            'AccountId': str
+            'AccountId': str,
+            Optional('ForceRefresh'): Any(bool, 'true', 'false', 'True', 'False'),
+            Optional('SnapshotTtlSeconds'): Any(int, Match(r'^\d+$')),
         },
         'ResponseURL': str,
         'StackId': str
-    }
-}, required=True, extra=REMOVE_EXTRA)
+    },
+    Optional('deadline'): float,
+    Optional('clients'): ClientRegistry,
+}, required=True, extra=REMOVE_EXTRA))
 
-OUTPUT_SCHEMA = Schema({
+OUTPUT_SCHEMA = compiled(Schema({
     'output': {
         'IsAuditAccount': bool,
         'AuditCloudTrailBucketName': Any(None, str),
@@ -67,16 +121,23 @@ OUTPUT_SCHEMA = Schema({
         'MasterPayerBillingBucketName': Any(None, str),
         'MasterPayerBillingBucketArns': str,
     },
-}, required=True, extra=ALLOW_EXTRA)
+}, required=True, extra=ALLOW_EXTRA))
 
 DEFAULT_PAYER_REPORTS = {'is_master_payer': False, 'report_definitions': []}
+DEFAULT_DATA_EXPORTS = {'exports': []}
 NOT_IN_ORGANIZATION_RESPONSE = {}
 
 event_account_id = get_in(['event', 'ResourceProperties', 'AccountId'])
-coeffects_traillist = get_in(['coeffects', 'cloudtrail', 'trailList'], default=[])
+event_request_type = get_in(['event', 'RequestType'])
+event_force_refresh = get_in(['event', 'ResourceProperties', 'ForceRefresh'], default=False)
+event_snapshot_ttl_seconds = get_in(['event', 'ResourceProperties', 'SnapshotTtlSeconds'])
+world_deadline = get_in(['deadline'])
+coeffects_trails_by_arn = get_in(['coeffects', 'cloudtrail', 'trailsByArn'], default={})
 coeffects_buckets = get_in(['coeffects', 's3', 'Buckets'], default=[])
 coeffects_payer_reports = get_in(['coeffects', 'cur'], default=DEFAULT_PAYER_REPORTS)
+coeffects_cur2_exports = get_in(['coeffects', 'data_exports', 'exports'], default=[])
 coeffects_master_account_id = get_in(['coeffects', 'organizations', 'Organization', 'MasterAccountId'])
+discovery_index = get_in(['index'])
 output_is_organization_master = get_in(['output', 'IsOrganizationMasterAccount'])
 output_is_account_outside_organization = get_in(['output', 'IsAccountOutsideOrganization'])
 
@@ -86,56 +147,362 @@ output_is_account_outside_organization = get_in(['output', 'IsAccountOutsideOrga
 # Coeffects, i.e. from the outside world
 #
 #####################
+def snapshot_store():
+    return snapshots.store_from_uri(os.environ.get('SNAPSHOT_STORE', ''))
+
+
+def snapshot_ttl_seconds(world):
+    # An explicit 0 from the event disables reuse, so only a missing TTL falls back to the environment
+    ttl = event_snapshot_ttl_seconds(world)
+    if ttl is None:
+        ttl = os.environ.get('SNAPSHOT_TTL_SECONDS')
+    return int(ttl) if ttl is not None else snapshots.DEFAULT_TTL_SECONDS
+
+
+def cached_coeffects(world):
+    # Trails, buckets and CUR definitions rarely change between stack updates, so an Update may reuse the
+    # coeffects stored by an earlier invocation for this account (unless ForceRefresh is set). Only a
+    # complete fetch, with nothing failed or timed out, is stored.
+    store = snapshot_store()
+    if store is None:
+        return coeffects(world)
+    key = event_account_id(world)
+    if event_request_type(world) == 'Update' and str(event_force_refresh(world)).lower() != 'true':
+        snapshot = snapshots.load(store, key, snapshot_ttl_seconds(world))
+        if snapshot:
+            logger.info('Using discovery snapshot', extra=logs.fields(fetched_at=snapshot['fetched_at']))
+            return merge(world, {'coeffects': snapshot['coeffects'],
+                                 'snapshot': {'hit': True, 'fetched_at': snapshot['fetched_at']}})
+    world = coeffects(world)
+    incomplete = (world['coeffects_timed_out'] or world.get('coeffects_failed') or
+                  get_in(['coeffects', 'cloudtrail', 'regionsTimedOut'], world) or
+                  get_in(['coeffects', 'cloudtrail', 'regionsFailed'], world))
+    if not incomplete:
+        try:
+            snapshots.save(store, key, world['coeffects'])
+        except Exception:
+            logger.warning('Failed to store discovery snapshot', exc_info=True)
+    return assoc(world, 'snapshot', {'hit': False, 'stored': not incomplete})
+
+
+def targeted_bucket_checks(environ=os.environ):
+    """
+    Whether BUCKET_OWNERSHIP_CHECK asks for only the buckets the trails and reports name to be checked
+
+    >>> targeted_bucket_checks({'BUCKET_OWNERSHIP_CHECK': 'targeted'}), targeted_bucket_checks({})
+    (True, False)
+    """
+    return environ.get('BUCKET_OWNERSHIP_CHECK', 'list') == 'targeted'
+
+
 def coeffects(world):
+    if not targeted_bucket_checks(os.environ):
+        return concurrent_coeffects(world,
+                                    coeffects_cloudtrail,
+                                    coeffects_s3,
+                                    coeffects_cur,
+                                    coeffects_data_exports,
+                                    coeffects_organizations)
+    # The candidate buckets come from the trails and the report definitions, so their ownership is only
+    # checked once those are fetched: one more round trip, but O(candidates) calls instead of O(all buckets).
     return pipe(world,
-                coeffects_cloudtrail,
-                coeffects_s3,
-                coeffects_cur,
-                coeffects_organizations)
+                lambda w: concurrent_coeffects(w, coeffects_cloudtrail, coeffects_cur, coeffects_data_exports,
+                                               coeffects_organizations),
+                lambda w: concurrent_coeffects(w, coeffects_candidate_buckets))
+
+
+def concurrent_coeffects(world, *fs):
+    # Coeffects are independent of each other, so they are fetched in parallel against one
+    # shared deadline; a coeffect still running at the deadline is recorded as timed out and,
+    # like a failed one, becomes `{}`.
+    started = time.perf_counter()
+    deadline_at = world_deadline(world) or deadline(None)
+    # The coeffects see the deadline waited on here, to keep their own fan-outs within it (fan_out_deadline)
+    with_deadline = assoc(world, 'deadline', deadline_at)
+    results, timed_out = run_concurrently([(f.name, lambda f=f: f(with_deadline)) for f in fs], deadline_at)
+    waited = metrics.elapsed_ms(started)
+    fetched = {name: get_in(['coeffects', name], w, default={}) for name, w in results.items()}
+    failed = sorted(name for name, w in results.items() if name in w.get('coeffects_failed', []))
+    # A timed-out coeffect ran for at least as long as we waited for it.
+    timings = merge({name: waited for name in timed_out},
+                    *(get_in(['timings', 'coeffects'], w, default={}) for w in results.values()))
+    world = update_in(world, ['coeffects'], lambda x: merge(x or {}, {name: {} for name in timed_out}, fetched))
+    world = update_in(world, ['timings', 'coeffects'], lambda x: merge(x or {}, timings))
+    return merge(world, {'coeffects_timed_out': sorted(world.get('coeffects_timed_out', []) + timed_out),
+                         'coeffects_failed': sorted(world.get('coeffects_failed', []) + failed)})
 
 
 def coeffect(name):
     def d(f):
         def w(world):
             data = {}
+            started = time.perf_counter()
             try:
                 data = f(world)
             except Exception:
                 logger.warning(f'Failed to get {name} information.', exc_info=True)
+                world = update_in(world, ['coeffects_failed'], lambda x: (x or []) + [name])
+            world = metrics.record(world, 'coeffects', name, metrics.elapsed_ms(started))
             return assoc_in(world, ['coeffects', name], data)
+        w.name = name
         return w
     return d
 
 
+def fan_out_deadline(world):
+    """
+    The deadline of the calls a coeffect fans out: early enough for it to return what they found before
+    concurrent_coeffects gives up on the coeffect, and with it on every call that did finish
+    """
+    return inner_deadline(world_deadline(world) or deadline(None))
+
+
+# Bounds the DescribeTrails fan-out; enough to cover every commercial region in two rounds.
+MAX_CLOUDTRAIL_REGION_WORKERS = 10
+
+
+def cloudtrail_regions(world):
+    # CLOUDTRAIL_REGIONS (comma separated) overrides the enabled-region lookup, e.g. for a local stand-in.
+    # The Lambda's own region always goes first so that its view of a trail wins ties.
+    configured = [r.strip() for r in os.environ.get('CLOUDTRAIL_REGIONS', '').split(',') if r.strip()]
+    if configured:
+        regions = configured
+    else:
+        try:
+            describe_regions = throttling.retrying(ec2(world).describe_regions, fan_out_deadline(world))
+            regions = [r['RegionName'] for r in describe_regions().get('Regions', [])]
+        except Exception:
+            logger.warning('Failed to list enabled regions; searching the local region only', exc_info=True)
+            regions = []
+    ordered = list(dict.fromkeys([local_region(world), *regions]))
+    return [r for r in ordered if r] or [None]
+
+
+def describe_trails_in(world, region):
+    """The DescribeTrails response of `region`, or None if it failed"""
+    try:
+        return throttling.retrying(ct(world, region).describe_trails, fan_out_deadline(world))()
+    except Exception:
+        logger.warning(f'Failed to describe trails in {region}', exc_info=True)
+        return None
+
+
+def index_trails(responses):
+    """
+    Merge `(region, DescribeTrails response)` pairs into trails keyed by TrailARN; each trail is tagged with its
+    HomeRegion, and the copy reported by the home region itself is preferred over shadow copies
+
+    >>> shadow = {'TrailARN': 'arn', 'HomeRegion': 'us-east-1', 'Name': 'shadow'}
+    >>> home = {'TrailARN': 'arn', 'HomeRegion': 'us-east-1', 'Name': 'home'}
+    >>> index_trails([('us-west-2', {'trailList': [shadow]}), ('us-east-1', {'trailList': [home]})])['arn']['Name']
+    'home'
+    """
+    index = {}
+    for region, response in responses:
+        for trail in response.get('trailList', []):
+            arn = trail.get('TrailARN')
+            home_region = trail.get('HomeRegion') or region
+            if arn and (arn not in index or region == home_region):
+                index[arn] = merge(trail, {'HomeRegion': home_region})
+    return index
+
+
 @coeffect('cloudtrail')
 def coeffects_cloudtrail(world):
-    response = ct.describe_trails()
-    return keyfilter(lambda x: x in {'trailList'}, response)
+    regions = cloudtrail_regions(world)
+    results, timed_out = run_concurrently([(r, lambda r=r: describe_trails_in(world, r)) for r in regions],
+                                          fan_out_deadline(world),
+                                          max_workers=MAX_CLOUDTRAIL_REGION_WORKERS)
+    # A failed region, like a timed-out one, may hide trails: both are recorded so the result counts as partial
+    failed = [r for r in regions if r in results and results[r] is None]
+    if failed:
+        logger.warning('Failed to describe trails in some regions', extra=logs.fields(regions=failed))
+    return {
+        'trailsByArn': index_trails((r, results[r]) for r in regions if results.get(r) is not None),
+        'regionsTimedOut': timed_out,
+        'regionsFailed': failed,
+    }
+
+
+def coeffects_traillist(world):
+    return list(coeffects_trails_by_arn(world).values())
+
+
+def list_buckets(world):
+    response = throttling.retrying(s3(world).list_buckets, world_deadline(world) or deadline(None))()
+    return keyfilter(lambda x: x in {'Buckets'}, response)
 
 
 @coeffect('s3')
 def coeffects_s3(world):
-    response = s3.list_buckets()
-    return keyfilter(lambda x: x in {'Buckets'}, response)
+    return list_buckets(world)
+
+
+# Bounds the ownership checks of BUCKET_OWNERSHIP_CHECK=targeted; accounts rarely name more candidates than this.
+MAX_BUCKET_CHECK_WORKERS = 10
+# Set once this botocore turned out to predate ListBuckets' Prefix and MaxBuckets (added late 2024), which the
+# requirements do not rule out: from then on, the targeted checks list every bucket instead.
+_prefixed_listing_unsupported = threading.Event()
+
+
+def candidate_bucket_names(world):
+    """Every bucket the discovery asks about: those of the trails and of the CUR report definitions"""
+    trail_buckets = [trail.get('S3BucketName') for trail in coeffects_traillist(world)]
+    report_buckets = [report.get('S3Bucket') for report in coeffects_report_definitions(world)]
+    return sorted({name for name in trail_buckets + report_buckets if isinstance(name, str)})
+
+
+def owns_bucket(world, name):
+    # ListBuckets narrowed to the name needs the same s3:ListAllMyBuckets as the full listing, and only ever
+    # returns this account's buckets; HeadBucket with ExpectedBucketOwner would need s3:ListBucket on each one.
+    # Names are listed in order, so the name itself, when owned, is the first one it prefixes.
+    try:
+        list_prefixed = throttling.retrying(s3(world).list_buckets, fan_out_deadline(world))
+        response = list_prefixed(Prefix=name, MaxBuckets=1)
+        return any(bucket.get('Name') == name for bucket in response.get('Buckets', []))
+    except ParamValidationError:
+        if not _prefixed_listing_unsupported.is_set():
+            _prefixed_listing_unsupported.set()
+            logger.warning('This botocore cannot list buckets by prefix; listing every bucket instead', exc_info=True)
+        return None
+    except Exception:
+        logger.warning(f'Failed to check the ownership of bucket {name}', exc_info=True)
+        return None
+
+
+@coeffect('s3')
+def coeffects_candidate_buckets(world):
+    if _prefixed_listing_unsupported.is_set():
+        return list_buckets(world)
+    names = candidate_bucket_names(world)
+    owned, timed_out = run_concurrently([(name, lambda name=name: owns_bucket(world, name)) for name in names],
+                                        fan_out_deadline(world),
+                                        max_workers=MAX_BUCKET_CHECK_WORKERS)
+    unresolved = timed_out + sorted(name for name, x in owned.items() if x is None)
+    if unresolved:
+        logger.warning('Falling back to listing every bucket', extra=logs.fields(unresolved=unresolved))
+        return list_buckets(world)
+    return {'Buckets': [{'Name': name} for name in names if owned[name]]}
 
 
 @coeffect('cur')
 def coeffects_cur(world):
+    describe = throttling.retrying(cur(world).describe_report_definitions, world_deadline(world) or deadline(None))
+    pages = paginate(describe, 'ReportDefinitions')
     try:
-        return {
-            'report_definitions': cur.describe_report_definitions().get('ReportDefinitions', []),
-        }
-    except ClientError:
+        first_page = next(pages)
+    except ClientError as err:
+        # Still throttled at the deadline says nothing about the reports: the coeffect fails instead
+        if throttling.throttled(err):
+            raise
         logger.warning('Failed to access CUR DescribeReportDefinitions', exc_info=True)
         return DEFAULT_PAYER_REPORTS
+    # Every later page is read here as well, within the coeffect's deadline: a page that fails fails the
+    # coeffect instead of leaving out the reports on it
+    return {
+        'report_definitions': first_page + [report for page in pages for report in page],
+    }
+
+
+# Bounds the GetExport fan-out over one page of ListExports.
+MAX_EXPORT_WORKERS = 5
+# Errors of a GetExport that the role may not make; any other one, throttling included, fails the coeffect.
+ACCESS_DENIED_CODES = frozenset(['AccessDenied', 'AccessDeniedException'])
+# The Data Exports table of CUR 2.0; the others, like FOCUS or cost optimization recommendations, are no CUR
+CUR2_TABLE = 'COST_AND_USAGE_REPORT'
+
+
+def export_definition(response):
+    """
+    The export of a GetExport response, flattened into the keys of a CUR report definition that the tiers and
+    the bucket lookups read; the values keep the enums of Data Exports, so no legacy tier matches an export
+
+    >>> export = {'ExportArn': 'arn', 'Name': 'cur2', 'DataQuery': {
+    ...     'QueryStatement': 'SELECT line_item_usage_amount FROM COST_AND_USAGE_REPORT',
+    ...     'TableConfigurations': {'COST_AND_USAGE_REPORT': {'TIME_GRANULARITY': 'HOURLY'}}}}
+    >>> d = export_definition({'Export': export, 'ExportStatus': {'StatusCode': 'HEALTHY'}})
+    >>> d['ReportName'], d['Table'], d['TimeUnit'], d['StatusCode']
+    ('cur2', 'COST_AND_USAGE_REPORT', 'HOURLY', 'HEALTHY')
+    """
+    export = response.get('Export', {})
+    query = export.get('DataQuery', {})
+    table = re.search(r'\bFROM\s+(\w+)', query.get('QueryStatement', ''), re.IGNORECASE)
+    table = table.group(1).upper() if table else None
+    properties = query.get('TableConfigurations', {}).get(table, {})
+    destination = get_in(['DestinationConfigurations', 'S3Destination'], export, default={})
+    output = destination.get('S3OutputConfigurations', {})
+    return {
+        'ExportArn': export.get('ExportArn'),
+        'ReportName': export.get('Name'),
+        'Table': table,
+        'TimeUnit': properties.get('TIME_GRANULARITY'),
+        'IncludeResources': properties.get('INCLUDE_RESOURCES'),
+        'Format': output.get('Format'),
+        'Compression': output.get('Compression'),
+        'ReportVersioning': output.get('Overwrite'),
+        'S3Bucket': destination.get('S3Bucket'),
+        'S3Prefix': destination.get('S3Prefix'),
+        'S3Region': destination.get('S3Region'),
+        'StatusCode': response.get('ExportStatus', {}).get('StatusCode'),
+    }
+
+
+def get_export(world, arn):
+    """The definition of the export `arn`; None if it may not be read, an error if it could not be"""
+    try:
+        get = throttling.retrying(data_exports(world).get_export, fan_out_deadline(world))
+        return export_definition(get(ExportArn=arn))
+    except ClientError as err:
+        if throttling.error_code(err) not in ACCESS_DENIED_CODES:
+            raise
+        logger.warning(f'Not allowed to get export {arn}', exc_info=True)
+        return None
+
+
+def get_cur2_exports(world, summaries):
+    # ListExports only names the exports; their queries and destinations take one GetExport each
+    arns = [summary['ExportArn'] for summary in summaries if summary.get('ExportArn')]
+    results, timed_out = run_concurrently([(arn, lambda arn=arn: get_export(world, arn)) for arn in arns],
+                                          fan_out_deadline(world),
+                                          max_workers=MAX_EXPORT_WORKERS)
+    # An export not read may be the CUR 2.0 one: the exports are only known once every one of them is
+    if timed_out:
+        raise TimeoutError(f'Timed out getting exports {timed_out}')
+    return [results[arn] for arn in arns if results.get(arn) and results[arn]['Table'] == CUR2_TABLE]
+
+
+@coeffect('data_exports')
+def coeffects_data_exports(world):
+    list_exports = throttling.retrying(data_exports(world).list_exports, world_deadline(world) or deadline(None))
+    pages = paginate(list_exports, 'Exports')
+    try:
+        first_page = next(pages)
+    except ClientError as err:
+        if throttling.throttled(err):
+            raise
+        logger.warning('Failed to access BCM Data Exports ListExports', exc_info=True)
+        return DEFAULT_DATA_EXPORTS
+    # As for the CUR report definitions, every later page is read here, and one that fails fails the coeffect
+    return {
+        'exports': [export for page in [first_page, *pages] for export in get_cur2_exports(world, page)],
+    }
+
+
+def coeffects_report_definitions(world):
+    """The legacy CUR report definitions, then the CUR 2.0 exports"""
+    return coeffects_payer_reports(world).get('report_definitions', []) + coeffects_cur2_exports(world)
 
 
 @coeffect('organizations')
 def coeffects_organizations(world):
     try:
-        response = orgs.describe_organization()
-        return keyfilter(lambda x: x in {'Organization'}, response)
-    except ClientError:
+        describe = throttling.retrying(orgs(world).describe_organization, world_deadline(world) or deadline(None))
+        return keyfilter(lambda x: x in {'Organization'}, describe())
+    except ClientError as err:
+        # Only this error means the account is outside any organization; any other, like throttling at the
+        # deadline or a missing permission, fails the coeffect rather than passing for it
+        if throttling.error_code(err) != 'AWSOrganizationsNotInUseException':
+            raise
         return NOT_IN_ORGANIZATION_RESPONSE
 
 
@@ -158,33 +525,25 @@ IDEAL_CLOUDTRAIL_CONFIGURATION = MINIMUM_CLOUDTRAIL_CONFIGURATION.extend({
 }, extra=ALLOW_EXTRA, required=True)
 
 
-def safe_check(schema, data):
-    try:
-        return schema(data)
-    except Exception:
-        logger.debug(f'Data {pformat(data)} did not match schema {schema}', exc_info=True)
-        return None
-
-
-def keep_valid(schema, xs):
-    return [
-        y for y in [safe_check(schema, x) for x in xs]
-        if y is not None
-    ]
+_CLOUDTRAIL_TIERS = TieredClassifier([
+    IDEAL_CLOUDTRAIL_CONFIGURATION,
+    MINIMUM_CLOUDTRAIL_CONFIGURATION,
+])
 
 
 def get_first_valid_trail(world):
     trails = coeffects_traillist(world)
-    logger.info(f'Found these CloudTrails: {trails}')
-    valid_trails = keep_valid(IDEAL_CLOUDTRAIL_CONFIGURATION, trails) or keep_valid(MINIMUM_CLOUDTRAIL_CONFIGURATION, trails)
-    logger.info(f'Found these _valid_ CloudTrails: {valid_trails}')
+    logger.info('Found these CloudTrails', extra=logs.verbose(trails=trails))
+    valid_trails = [trail for _, trail in _CLOUDTRAIL_TIERS.rank(trails)]
+    logger.info('Found these _valid_ CloudTrails', extra=logs.verbose(trails=valid_trails))
     return valid_trails[0] if valid_trails else {}
 
 
 def discover_audit_account(world):
-    trail = get_first_valid_trail(world)
+    index = discovery_index(world)
+    trail = index.trail
     trail_bucket = trail.get('S3BucketName')
-    local_buckets = {x['Name'] for x in coeffects_buckets(world)}
+    local_buckets = index.local_buckets
     output = {
         'IsAuditAccount': trail_bucket in local_buckets,
         'RemoteCloudTrailBucket': trail_bucket not in local_buckets,
@@ -201,15 +560,15 @@ def discover_connected_account(world):
     return update_in(world, ['output'], lambda x: merge(x or {}, output))
 
 
-def get_visible_cloudtrail_arns(world):
-    visible_trail_arns = [x.get('TrailARN')
-                          for x in coeffects_traillist(world)]
+def get_visible_cloudtrail_arns(trails_by_arn):
+    visible_trail_arns = list(trails_by_arn)
     return ','.join(visible_trail_arns) if visible_trail_arns else None
 
 
 def discover_cloudtrail_account(world):
-    visible_trails = get_visible_cloudtrail_arns(world)
-    trail = get_first_valid_trail(world)
+    index = discovery_index(world)
+    visible_trails = get_visible_cloudtrail_arns(index.trails_by_arn)
+    trail = index.trail
     trail_topic = trail.get('SnsTopicARN')
     account_id = trail_topic.split(':')[4] if trail_topic else None
     output = {
@@ -266,19 +625,45 @@ MINIMUM_BILLING_REPORT_PARQUET = Schema({
     'RefreshClosedReports': bool,
 }, extra=ALLOW_EXTRA, required=True)
 
+# CUR 2.0 exports of BCM Data Exports, as flattened by export_definition
+IDEAL_DATA_EXPORT_PARQUET = Schema({
+    'ExportArn': str,
+    'StatusCode': 'HEALTHY',
+    'TimeUnit': 'HOURLY',
+    'Format': 'PARQUET',
+    'Compression': 'PARQUET',
+    'IncludeResources': 'TRUE',
+    'S3Bucket': str,
+    'S3Prefix': str,
+    'S3Region': str,
+    'ReportVersioning': 'CREATE_NEW_REPORT',
+}, extra=ALLOW_EXTRA, required=True)
+
+MINIMUM_DATA_EXPORT_PARQUET = Schema({
+    'ExportArn': str,
+    'StatusCode': 'HEALTHY',
+    'TimeUnit': 'HOURLY',
+    'Format': 'PARQUET',
+    'Compression': 'PARQUET',
+    'S3Bucket': str,
+    'S3Prefix': str,
+    'S3Region': str,
+}, extra=ALLOW_EXTRA, required=True)
+
 # All CSV tiers are evaluated before any Parquet tier so that CSV wins unconditionally when both formats exist.
 # Customers whose Parquet CUR was previously undetected had a CSV CUR created for them by this stack — if
 # Parquet were matched on a subsequent stack update, their existing CSV connection could receive duplicate data.
+# For the same reason CUR 2.0 exports come last: they only decide for accounts no legacy report matched, which
+# otherwise had a CSV CUR created for them.
 _CUR_CANDIDATE_TIERS = [
     (IDEAL_BILLING_REPORT_CSV, 'aws'),
     (MINIMUM_BILLING_REPORT_CSV, 'aws'),
     (IDEAL_BILLING_REPORT_PARQUET, 'aws_parquet'),
     (MINIMUM_BILLING_REPORT_PARQUET, 'aws_parquet'),
+    (IDEAL_DATA_EXPORT_PARQUET, 'aws_cur2_parquet'),
+    (MINIMUM_DATA_EXPORT_PARQUET, 'aws_cur2_parquet'),
 ]
-
-
-def get_first_valid_report_definition(valid_report_definitions, default=None):
-    return valid_report_definitions[0] if any(valid_report_definitions) else default
+_CUR_CLASSIFIER = TieredClassifier(schema for schema, _ in _CUR_CANDIDATE_TIERS)
 
 
 def _report_to_bucket_info(report):
@@ -287,21 +672,37 @@ def _report_to_bucket_info(report):
     return bucket_name, bucket_path
 
 
-def get_cur_bucket_if_local(world, report_definitions):
-    logger.info(f'Found these ReportDefinitions: {report_definitions}')
-    local_buckets = {x['Name'] for x in coeffects_buckets(world)}
+def _best_local_tier(report, local_buckets, limit):
+    if report.get('S3Bucket') not in local_buckets:
+        return None
+    return _CUR_CLASSIFIER.tier(report, limit=limit)
+
+
+def get_cur_bucket_if_local(local_buckets, report_definitions):
+    # Keeps the first report of the best tier seen so far; a local report in the top tier cannot be beaten,
+    # so classification stops there.
+    best_tier, best_report = len(_CUR_CANDIDATE_TIERS), None
+    for report in report_definitions:
+        tier = _best_local_tier(report, local_buckets, best_tier)
+        if tier is not None:
+            best_tier, best_report = tier, report
+            if tier == 0:
+                break
+
+    if best_report is None:
+        logger.info('Found no local ReportDefinitions in any CUR tier')
+        return None, None, 'aws'
+    billing_report_format = _CUR_CANDIDATE_TIERS[best_tier][1]
+    logger.info(f'CUR tier {billing_report_format}', extra=logs.fields(report=best_report))
+    bucket_name, bucket_path = _report_to_bucket_info(best_report)
+    return bucket_name, bucket_path, billing_report_format
 
-    for schema, billing_report_format in _CUR_CANDIDATE_TIERS:
-        local_matches = [r for r in keep_valid(schema, report_definitions) if r['S3Bucket'] in local_buckets]
-        logger.info(f'CUR tier {billing_report_format}: {local_matches}')
-        if local_matches:
-            bucket_name, bucket_path = _report_to_bucket_info(get_first_valid_report_definition(local_matches))
-            return bucket_name, bucket_path, billing_report_format
 
-    return None, None, 'aws'
+def group_reports_by_bucket(report_definitions):
+    return groupby(lambda r: r['S3Bucket'], (r for r in report_definitions if isinstance(r.get('S3Bucket'), str)))
 
 
-def get_all_local_cur_bucket_names(world, report_definitions):
+def get_all_local_cur_bucket_names(local_buckets, reports_by_bucket):
     # Schema-agnostic on purpose: we enumerate every locally-owned bucket referenced by
     # any CUR report, regardless of whether the report's schema matches CloudZero's
     # ingest formats (the `_CUR_CANDIDATE_TIERS` filter applied by `get_cur_bucket_if_local`).
@@ -309,9 +710,7 @@ def get_all_local_cur_bucket_names(world, report_definitions):
     # CloudZero to a different report without redeploying this stack. A bucket referenced
     # by a CUR report is by definition a CUR bucket; the schema filter only governs which
     # report CloudZero currently ingests, not which buckets are legitimate CUR storage.
-    local_buckets = {x['Name'] for x in coeffects_buckets(world)}
-    return sorted({r['S3Bucket'] for r in report_definitions
-                   if isinstance(r.get('S3Bucket'), str) and r['S3Bucket'] in local_buckets})
+    return sorted(local_buckets.intersection(reports_by_bucket))
 
 
 def format_bucket_arns(bucket_names):
@@ -326,9 +725,9 @@ def discover_master_payer_account(world):
     is_account_not_in_organization = output_is_account_outside_organization(world)
     is_account_organization_master_account = output_is_organization_master(world)
     is_master_payer = is_account_not_in_organization or is_account_organization_master_account
-    report_definitions = coeffects_payer_reports(world)['report_definitions']
-    bucket_name, bucket_path, billing_report_format = get_cur_bucket_if_local(world, report_definitions)
-    all_local_cur_buckets = get_all_local_cur_bucket_names(world, report_definitions)
+    index = discovery_index(world)
+    bucket_name, bucket_path, billing_report_format = index.cur_bucket
+    all_local_cur_buckets = get_all_local_cur_bucket_names(index.local_buckets, index.reports_by_bucket)
     output = {
         'IsMasterPayerAccount': is_master_payer,
         'MasterPayerBillingBucketName': bucket_name,
@@ -339,17 +738,51 @@ def discover_master_payer_account(world):
     return update_in(world, ['output'], lambda x: merge(x or {}, output))
 
 
+def coeffect_missing(world, name):
+    """Whether the coeffect `name` failed or timed out, leaving `{}` that says nothing about the account"""
+    return name in world.get('coeffects_failed', []) + world.get('coeffects_timed_out', [])
+
+
 def discover_organization_master_account(world):
     account_id = event_account_id(world)
     master_account_id = coeffects_master_account_id(world)
 
-    output = {
-        'IsOrganizationMasterAccount': account_id == master_account_id,
-        'IsAccountOutsideOrganization': master_account_id is None,
-    }
+    if coeffect_missing(world, 'organizations'):
+        # Membership is unknown, not absent: claiming the account is outside any organization would make it
+        # its own master payer
+        logger.warning('Organization membership unknown; reporting the account as neither master nor outside')
+        output = {key: DEFAULT_OUTPUT[key] for key in ('IsOrganizationMasterAccount', 'IsAccountOutsideOrganization')}
+    else:
+        output = {
+            'IsOrganizationMasterAccount': account_id == master_account_id,
+            'IsAccountOutsideOrganization': master_account_id is None,
+        }
     return update_in(world, ['output'], lambda x: merge(x or {}, output))
 
 
+# Everything the discover_* functions derive from the coeffects, computed once per invocation.
+DiscoveryIndex = namedtuple('DiscoveryIndex', [
+    'local_buckets',      # frozenset of bucket names owned by this account
+    'trails_by_arn',      # {TrailARN: trail}
+    'reports_by_bucket',  # {S3Bucket: [report definition, ...]}
+    'trail',              # the selected trail, or {}
+    'cur_bucket',         # (bucket name, bucket path, billing report format) of the selected report
+])
+
+
+def build_discovery_index(world):
+    local_buckets = frozenset(x['Name'] for x in coeffects_buckets(world))
+    report_definitions = coeffects_report_definitions(world)
+    index = DiscoveryIndex(
+        local_buckets=local_buckets,
+        trails_by_arn=coeffects_trails_by_arn(world),
+        cur_bucket=get_cur_bucket_if_local(local_buckets, report_definitions),
+        reports_by_bucket=group_reports_by_bucket(report_definitions),
+        trail=get_first_valid_trail(world),
+    )
+    return assoc(world, 'index', index)
+
+
 def discover_account_types(world):
     return pipe(world,
                 discover_audit_account,
@@ -368,15 +801,23 @@ def handler(event, context, **kwargs):
     status = cfnresponse.SUCCESS
     world = {}
     try:
-        logger.info(f'Processing event {event}')
-        world = pipe({'event': event, 'kwargs': kwargs},
-                     INPUT_SCHEMA,
-                     coeffects,
-                     discover_account_types,
-                     OUTPUT_SCHEMA)
+        logger.info('Processing event', extra=logs.fields(event=logs.event_fields(event)))
+        world = metrics.timed_pipe({'event': event, 'kwargs': kwargs, 'deadline': deadline(context)},
+                                   metrics.named('INPUT_SCHEMA', INPUT_SCHEMA),
+                                   cached_coeffects,
+                                   build_discovery_index,
+                                   discover_account_types,
+                                   metrics.named('OUTPUT_SCHEMA', OUTPUT_SCHEMA))
     except Exception as err:
         logger.exception(err)
+        world = assoc_in(world, ['timings'], metrics.partial_timings(err))
     finally:
+        metrics.emit('discovery', world.get('timings'))
+        logger.info('Timings', extra=logs.fields(timings=world.get('timings')))
+        world = profiling.summarize(world, world_clients(world))
+        if 'aws_calls' in world:
+            logger.info('AWS calls', extra=logs.fields(aws_calls=world['aws_calls']))
         output = world.get('output', DEFAULT_OUTPUT)
-        logger.info(f'Sending output {output}')
-        cfnresponse.send(event, context, status, output, event.get('PhysicalResourceId'))
+        logger.info('Sending output', extra=logs.fields(output=output))
+        cfnresponse.send(event, context, status, output, event.get('PhysicalResourceId'),
+                         truncatable=TRUNCATABLE_OUTPUTS)
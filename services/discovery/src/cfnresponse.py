@@ -5,17 +5,126 @@
 #  This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, express or implied.
 #  See the License for the specific language governing permissions and limitations under the License.
 
-import urllib3
+import logging
+import time
 import json
-http = urllib3.PoolManager()
+
+from src import lazy, retries
+from src.concurrency import DEFAULT_BUDGET_SECONDS
+from src.logs import fields, without_query
+
+urllib3 = lazy.module('urllib3')
+logger = logging.getLogger()
+http = lazy.Deferred(lambda: urllib3.PoolManager())
 SUCCESS = "SUCCESS"
 FAILED = "FAILED"
 
+# CloudFormation rejects custom resource responses larger than this, failing the stack.
+MAX_RESPONSE_BYTES = 4096
+# Data key listing the fields that were shortened to fit MAX_RESPONSE_BYTES.
+TRUNCATED_KEY = 'TruncatedFields'
+# Time kept back from the end of the invocation so the last attempt can finish.
+SEND_MARGIN_SECONDS = 0.5
+
+
+def _size(body):
+    return len(json.dumps(body).encode('utf-8'))
+
+
+def _shrinkable(value, path=()):
+    """
+    `(length, path)` of every list or comma-separated string with more than one element in `value`
+
+    >>> sorted(_shrinkable({'A': 'x,y', 'B': {'C': ['x', 'y', 'z']}, 'D': 'x'}))
+    [(3, ('A',)), (15, ('B', 'C'))]
+    """
+    if isinstance(value, dict):
+        return [found for key, v in value.items() for found in _shrinkable(v, path + (key,))]
+    if isinstance(value, list) and len(value) > 1:
+        return [(len(json.dumps(value)), path)]
+    if isinstance(value, str) and ',' in value:
+        return [(len(value), path)]
+    return []
+
+
+def _get(value, path):
+    for key in path:
+        value = value[key]
+    return value
+
+
+def _set(value, path, new):
+    return {**value, path[0]: _set(value[path[0]], path[1:], new)} if path else new
 
-def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False):
-    responseUrl = event['ResponseURL']
 
-    print(responseUrl)
+def truncate(body, truncatable, limit=MAX_RESPONSE_BYTES):
+    """
+    `body` with the longest of the `truncatable` lists and comma-separated strings in its Data, named by
+    their dotted paths, cut at element boundaries, longest first, until the serialized body fits in `limit`
+    bytes or nothing is left to cut. Every shortened field is named in Data[TRUNCATED_KEY], so what remains
+    is still a well-formed list.
+
+    >>> body = {'Data': {'Arns': ','.join(['arn'] * 20), 'Grants': 'a,b', 'Name': 'x'}}
+    >>> truncate(body, {'Arns'}, limit=90)['Data']
+    {'Arns': 'arn,arn,arn', 'Grants': 'a,b', 'Name': 'x', 'TruncatedFields': 'Arns'}
+    """
+    data = dict(body['Data'] or {})
+    truncated = set()
+    while True:
+        marked = {**data, TRUNCATED_KEY: ','.join(sorted(truncated))} if truncated else data
+        excess = _size({**body, 'Data': marked}) - limit
+        candidates = [(length, path) for length, path in _shrinkable(data) if '.'.join(path) in truncatable]
+        if excess <= 0 or not candidates:
+            return {**body, 'Data': marked}
+        _, path = max(candidates)
+        value = _get(data, path)
+        elements = value if isinstance(value, list) else value.split(',')
+        # Drop enough trailing elements to cover the excess, but always keep one; adding the marker may
+        # leave a new excess, which the next round takes care of.
+        removed, keep = 0, len(elements)
+        while keep > 1 and removed < excess:
+            keep -= 1
+            removed += len(json.dumps(elements[keep])) + 1
+        data = _set(data, path, elements[:keep] if isinstance(value, list) else ','.join(elements[:keep]))
+        truncated.add('.'.join(path))
+
+
+def _largest_fields(data, n=3):
+    return sorted(data, key=lambda key: -_size(data[key]))[:n]
+
+
+def fit(body, limit=MAX_RESPONSE_BYTES, truncatable=(), request_type=None):
+    """
+    `body` unchanged if it fits in `limit` bytes; otherwise with its `truncatable` fields (dotted paths of
+    Data that nothing reads, see `truncate`) cut down. Any other field may become an IAM grant or reach the
+    reactor, so rather than being cut a body that still does not fit is FAILED with the reason, and without
+    Data; except for a Delete, which nothing reads the Data of and which must not fail for it.
+    """
+    size = _size(body)
+    if size <= limit:
+        return body
+    fitted = truncate(body, truncatable, limit)
+    if _size(fitted) <= limit:
+        logger.warning('CloudFormation response is too large; truncated',
+                       extra=fields(size=size, limit=limit, truncated=fitted['Data'][TRUNCATED_KEY]))
+        return fitted
+    if request_type == 'Delete':
+        logger.warning('CloudFormation response is too large; dropping its Data', extra=fields(size=size, limit=limit))
+        return {**body, 'Data': {}}
+    reason = (f'The response Data is {size} bytes, over the {limit} bytes CloudFormation accepts, and its largest '
+              f'fields ({", ".join(_largest_fields(body["Data"]))}) cannot be truncated without changing the stack')
+    logger.error('CloudFormation response is too large; failing it', extra=fields(size=size, limit=limit))
+    return {**body, 'Status': FAILED, 'Reason': reason, 'Data': {}}
+
+
+def _deadline(context):
+    remaining_ms = getattr(context, 'get_remaining_time_in_millis', None)
+    budget = remaining_ms() / 1000.0 - SEND_MARGIN_SECONDS if remaining_ms else DEFAULT_BUDGET_SECONDS
+    return time.monotonic() + max(budget, 0.0)
+
+
+def send(event, context, responseStatus, responseData, physicalResourceId=None, noEcho=False, truncatable=()):
+    responseUrl = event['ResponseURL']
 
     responseBody = {}
     responseBody['Status'] = responseStatus
@@ -27,18 +136,23 @@ def send(event, context, responseStatus, responseData, physicalResourceId=None,
     responseBody['NoEcho'] = noEcho
     responseBody['Data'] = responseData
 
+    responseBody = fit(responseBody, truncatable=truncatable, request_type=event.get('RequestType'))
     json_responseBody = json.dumps(responseBody)
 
-    print("Response body:\n" + json_responseBody)
+    logger.info('Sending CloudFormation response',
+                extra=fields(response_url=without_query(responseUrl), body=responseBody))
 
     headers = {
         'content-type': '',
-        'content-length': str(len(json_responseBody))
+        'content-length': str(len(json_responseBody.encode('utf-8')))
     }
 
     try:
-
-        response = http.request('PUT', responseUrl, body=json_responseBody.encode('utf-8'), headers=headers)
-        print("Status code: " + response.reason)
+        response, attempts = retries.request(http, 'PUT', responseUrl, _deadline(context),
+                                             body=json_responseBody.encode('utf-8'), headers=headers)
+        if response is not None and response.status == 200:
+            logger.info('CloudFormation response sent', extra=fields(status=response.reason, attempts=attempts))
+        else:
+            logger.warning('Failed to send CloudFormation response', extra=fields(attempts=attempts))
     except Exception as e:
-        print("send(..) failed executing requests.put(..): " + str(e))
+        logger.warning("send(..) failed executing requests.put(..): " + str(e))
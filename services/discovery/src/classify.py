@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+from collections.abc import Mapping
+import logging
+
+from voluptuous import ExactSequence, Invalid, Optional, Required, Schema, PREVENT_EXTRA
+
+from src.logs import fields
+
+logger = logging.getLogger()
+
+
+def compile_value(validator):
+    """
+    Compile one value of a voluptuous dict schema into a plain predicate
+
+    >>> compile_value(str)('x'), compile_value(True)(False), compile_value(ExactSequence(['A']))(['A'])
+    (True, False, True)
+    """
+    if isinstance(validator, type):
+        return lambda x: isinstance(x, validator)
+    if isinstance(validator, ExactSequence):
+        checks = [compile_value(v) for v in validator.validators]
+        return lambda x: (isinstance(x, (list, tuple)) and len(x) == len(checks) and
+                          all(check(y) for check, y in zip(checks, x)))
+    if callable(validator):
+        schema = Schema(validator)
+
+        def check(x):
+            try:
+                schema(x)
+                return True
+            except Invalid:
+                return False
+        return check
+    # voluptuous compares scalar literals with `!=`
+    return lambda x: x == validator
+
+
+def compile_schema(schema):
+    """
+    Compile a voluptuous dict schema into a predicate with the same accept/reject behavior
+
+    >>> from voluptuous import ALLOW_EXTRA
+    >>> matches = compile_schema(Schema({'a': str, 'b': True}, required=True, extra=ALLOW_EXTRA))
+    >>> matches({'a': 'x', 'b': True, 'c': 1}), matches({'a': 'x'}), matches({'a': 1, 'b': True})
+    (True, False, False)
+    """
+    checks = []
+    for key, validator in schema.schema.items():
+        required = isinstance(key, Required) or (schema.required and not isinstance(key, Optional))
+        checks.append((getattr(key, 'schema', key), required, compile_value(validator)))
+    known_keys = frozenset(key for key, _, _ in checks)
+    prevent_extra = schema.extra == PREVENT_EXTRA
+
+    def matches(data):
+        if not isinstance(data, Mapping):
+            return False
+        if prevent_extra and not known_keys.issuperset(data):
+            return False
+        for key, required, check in checks:
+            if key in data:
+                if not check(data[key]):
+                    return False
+            elif required:
+                return False
+        return True
+    return matches
+
+
+class TieredClassifier:
+    """
+    Assigns each item the index of the first (best) schema it satisfies, in a single pass over the items
+
+    >>> from voluptuous import ALLOW_EXTRA
+    >>> classifier = TieredClassifier([Schema({'a': 1}, extra=ALLOW_EXTRA), Schema({'a': int}, extra=ALLOW_EXTRA)])
+    >>> classifier.rank([{'a': 2}, {'a': 'x'}, {'a': 1}])
+    [(0, {'a': 1}), (1, {'a': 2})]
+    """
+
+    def __init__(self, schemas):
+        self.schemas = list(schemas)
+        self._predicates = [compile_schema(s) for s in self.schemas]
+
+    def __len__(self):
+        return len(self.schemas)
+
+    def tier(self, item, limit=None):
+        """Index of the best tier `item` satisfies among the first `limit` tiers, or None"""
+        for i, matches in enumerate(self._predicates[:limit]):
+            if matches(item):
+                return i
+        if logger.isEnabledFor(logging.DEBUG):
+            self.explain(item)
+        return None
+
+    def rank(self, items):
+        """`(tier, item)` pairs for every item satisfying some tier, best tier first, input order within a tier"""
+        tiered = ((self.tier(item), i, item) for i, item in enumerate(items))
+        return [(t, item) for t, _, item in sorted((x for x in tiered if x[0] is not None), key=lambda x: x[:2])]
+
+    def explain(self, item):
+        # Diagnostics only; voluptuous gives the reason an item was rejected by each tier
+        for schema in self.schemas:
+            try:
+                schema(item)
+            except Invalid as err:
+                logger.debug('Item did not match schema', extra=fields(item=item, schema=schema, error=err))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import logging
+import threading
+import time
+
+from src import lazy, profiling, throttling
+from src.logs import fields
+
+boto3 = lazy.module('boto3')
+logger = logging.getLogger()
+
+
+class ClientRegistry:
+    """
+    Lazily created boto3 clients and resources sharing one botocore session
+
+    Nothing is built at import time; each client is created on first use and then reused
+    for the life of the Lambda container, i.e. across warm invocations. With a `profiler`,
+    every client and resource reports its calls to it (see src.profiling). Every one of them
+    is also throttle-aware, as src.throttling describes. `reset` starts over with a new
+    session that reuses the service models the previous one loaded.
+
+    >>> registry = ClientRegistry()
+    >>> registry.timings
+    {}
+    """
+
+    def __init__(self, session_factory=None, profiler=None):
+        self._session_factory = session_factory
+        self.profiler = profiler
+        self._session = None
+        self._loader = None
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.timings = {}
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = (self._session_factory or boto3.session.Session)()
+                core = _botocore_session(self._session)
+                if core is not None and self._loader is not None:
+                    core.register_component('data_loader', self._loader)
+            return self._session
+
+    def reset(self):
+        """
+        Forget the session, with its credentials, and every client, with its connection pool
+
+        The botocore data loader, which caches every service model, endpoint ruleset and partition
+        the session loaded, is kept for the next session, so recreating a client reads no files.
+        """
+        with self._lock:
+            core = _botocore_session(self._session)
+            if core is not None:
+                self._loader = core.get_component('data_loader')
+            self._session = None
+            self._cache = {}
+
+    def client(self, service_name, region_name=None):
+        return self._get('client', service_name, region_name)
+
+    def resource(self, service_name, region_name=None):
+        return self._get('resource', service_name, region_name)
+
+    def _get(self, kind, service_name, region_name):
+        key = (kind, service_name, region_name)
+        if key not in self._cache:
+            session = self.session
+            # boto3 sessions are not safe for concurrent client creation
+            with self._lock:
+                if key not in self._cache:
+                    started = time.perf_counter()
+                    created = getattr(session, kind)(service_name, region_name=region_name,
+                                                     config=throttling.client_config())
+                    if self.profiler:
+                        created = self.profiler.attach(created)
+                    self._cache[key] = throttling.limit(created, service_name)
+                    self.timings[key] = time.perf_counter() - started
+                    logger.debug(f'Created {kind} {service_name}',
+                                 extra=fields(region_name=region_name, seconds=self.timings[key]))
+        return self._cache[key]
+
+
+def _botocore_session(session):
+    """The botocore session of a boto3 session; None for anything else, like test doubles"""
+    core = getattr(session, '_session', None)
+    return core if hasattr(core, 'get_component') else None
+
+
+registry = ClientRegistry(profiler=profiling.from_environment())
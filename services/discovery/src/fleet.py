@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Run account discovery across many accounts from the command line, e.g.
+
+    python -m src.fleet --role-name OrganizationAccountAccessRole --organization > fleet.jsonl
+    python -m src.fleet --role-name OrganizationAccountAccessRole 111111111111 222222222222
+
+Each account is discovered with clients from a role assumed in that account, against its own deadline,
+and one JSON line is written per account as soon as it finishes. With PROFILE_AWS_CALLS=true each line
+also profiles the account's AWS calls (see src.profiling).
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import logging
+import sys
+import time
+
+import boto3
+
+from src import app, logs, metrics, profiling
+from src.clients import ClientRegistry, registry
+from src.concurrency import DEFAULT_BUDGET_SECONDS
+from src.pagination import paginate
+
+logger = logging.getLogger()
+
+DEFAULT_WORKERS = 16
+SESSION_NAME = 'cloudzero-fleet-discovery'
+
+
+def organization_account_ids(clients=registry):
+    """IDs of the active accounts in the caller's organization"""
+    pages = paginate(clients.client('organizations').list_accounts, 'Accounts')
+    return [account['Id'] for page in pages for account in page if account.get('Status') == 'ACTIVE']
+
+
+def assumed_role_clients(account_id, role_name, external_id=None, region_name=None, clients=registry):
+    """A ClientRegistry whose session holds credentials for `role_name` in `account_id`"""
+    partition = clients.session.get_partition_for_region(region_name or clients.session.region_name or 'us-east-1')
+    kwargs = {'ExternalId': external_id} if external_id else {}
+    credentials = clients.client('sts').assume_role(RoleArn=f'arn:{partition}:iam::{account_id}:role/{role_name}',
+                                                    RoleSessionName=SESSION_NAME, **kwargs)['Credentials']
+    return ClientRegistry(session_factory=lambda: boto3.session.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken'],
+        region_name=region_name or clients.session.region_name), profiler=profiling.from_environment())
+
+
+def discover(account_id, clients, timeout=DEFAULT_BUDGET_SECONDS):
+    """The discovery pipeline of the Lambda handler, minus the CloudFormation request and snapshots"""
+    event = {
+        'RequestType': 'Create',
+        'ResourceProperties': {'AccountId': account_id},
+        'ResponseURL': '',
+        'StackId': '',
+    }
+    world = metrics.timed_pipe({'event': event, 'deadline': time.monotonic() + timeout, 'clients': clients},
+                               metrics.named('INPUT_SCHEMA', app.INPUT_SCHEMA),
+                               app.coeffects,
+                               app.build_discovery_index,
+                               app.discover_account_types,
+                               metrics.named('OUTPUT_SCHEMA', app.OUTPUT_SCHEMA))
+    return profiling.summarize(world, clients)
+
+
+def audit_account(account_id, connect, timeout=DEFAULT_BUDGET_SECONDS):
+    started = time.monotonic()
+    try:
+        world = discover(account_id, connect(account_id), timeout)
+        record = {
+            'AccountId': account_id,
+            'Status': 'SUCCESS',
+            'Output': world['output'],
+            'CoeffectsTimedOut': world.get('coeffects_timed_out', []),
+            'CoeffectsFailed': world.get('coeffects_failed', []),
+            'Timings': world.get('timings', {}),
+        }
+        if 'aws_calls' in world:
+            record['AwsCalls'] = world['aws_calls']
+    except Exception as err:
+        logger.warning('Discovery failed', extra=logs.fields(account_id=account_id), exc_info=True)
+        record = {'AccountId': account_id, 'Status': 'FAILED', 'Error': f'{type(err).__name__}: {err}'}
+    return {**record, 'Seconds': round(time.monotonic() - started, 3)}
+
+
+def run_fleet(account_ids, connect, workers=DEFAULT_WORKERS, timeout=DEFAULT_BUDGET_SECONDS):
+    """Yield one audit record per account, in completion order"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(audit_account, account_id, connect, timeout)
+                   for account_id in dict.fromkeys(account_ids)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m src.fleet', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('account_ids', nargs='*', metavar='ACCOUNT_ID')
+    parser.add_argument('--organization', action='store_true',
+                        help='also discover every active account in the caller\'s organization')
+    parser.add_argument('--role-name', required=True, help='role to assume in each account')
+    parser.add_argument('--external-id')
+    parser.add_argument('--region', help='region for the assumed-role sessions (default: the caller\'s)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='accounts discovered at once')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_BUDGET_SECONDS,
+                        help='seconds allowed for each account\'s discovery')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args(argv)
+    if not args.account_ids and not args.organization:
+        parser.error('give at least one ACCOUNT_ID or --organization')
+    return args
+
+
+def main(argv=None, out=None):
+    args = parse_args(argv)
+    out = out or sys.stdout
+    logging.basicConfig(stream=sys.stderr)
+    logs.configure(logger).setLevel(args.log_level)
+
+    account_ids = list(args.account_ids) + (organization_account_ids() if args.organization else [])
+
+    def connect(account_id):
+        return assumed_role_clients(account_id, args.role_name, args.external_id, args.region)
+
+    failed = 0
+    for record in run_fleet(account_ids, connect, args.workers, args.timeout):
+        failed += record['Status'] != 'SUCCESS'
+        out.write(json.dumps(record, default=str) + '\n')
+        out.flush()
+    logger.info('Fleet discovery finished', extra=logs.fields(accounts=len(set(account_ids)), failed=failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Opt-in lazy-import mode, for a shorter Lambda init.
+
+Set LAZY_IMPORTS=true and the heavy third-party packages imported through `module` (boto3, urllib3) are
+only executed when one of their attributes is first used, and the objects built from them at import, like
+urllib3's PoolManager, through `Deferred`. An invocation that never creates an AWS client then never pays
+for importing boto3 and botocore; one that does pays for it then instead of during init. Measure either
+mode with tests/performance/coldstart.py.
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+
+
+def enabled(environ=os.environ):
+    """
+    >>> enabled({'LAZY_IMPORTS': 'true'}), enabled({})
+    (True, False)
+    """
+    return environ.get('LAZY_IMPORTS', '').lower() in ('1', 'true', 'yes')
+
+
+def module(name):
+    """
+    The top-level package `name`, imported now or, in lazy-import mode, on first attribute access
+
+    >>> module('json').dumps({})
+    '{}'
+    """
+    if name in sys.modules:
+        # Not through import_module, whose check of a module's __spec__ would load it
+        return sys.modules[name]
+    if not enabled(os.environ):
+        return importlib.import_module(name)
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    lazy = importlib.util.module_from_spec(spec)
+    sys.modules[name] = lazy
+    spec.loader.exec_module(lazy)
+    return lazy
+
+
+class Deferred:
+    """
+    The object `factory()` returns, built on first attribute access and then reused
+
+    Built under a lock, so threads racing to first use it also do not race to import what `factory` uses.
+
+    >>> pool = Deferred(lambda: {'built': True})
+    >>> pool.get('built')
+    True
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._built = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._built is None:
+            with self._lock:
+                if self._built is None:
+                    self._built = self._factory()
+        return self._built
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def reset(self):
+        """Forget the built object, returned if there was one, so that the next use builds a new one"""
+        with self._lock:
+            built, self._built = self._built, None
+        return built
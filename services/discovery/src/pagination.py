@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+
+def paginate(call, items_key, token_key='NextToken', **kwargs):
+    """
+    Yield the `items_key` list of each page of `call`, following `token_key` until it is absent
+
+    >>> responses = {None: {'Items': [1, 2], 'NextToken': 'a'}, 'a': {'Items': [3]}}
+    >>> list(paginate(lambda **kw: responses[kw.get('NextToken')], 'Items'))
+    [[1, 2], [3]]
+    """
+    while True:
+        response = call(**kwargs)
+        yield response.get(items_key, [])
+        token = response.get(token_key)
+        if not token:
+            return
+        kwargs = {**kwargs, token_key: token}
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Opt-in profile of the AWS API calls made through a ClientRegistry.
+
+Set PROFILE_AWS_CALLS=true and every client the registry creates reports, through botocore's event
+system, the latency, retries, throttled attempts, errors and response size of each call. The handlers
+write the per-operation summary into world['aws_calls'] and the logs.
+"""
+
+import math
+import os
+import threading
+import time
+
+from toolz.curried import assoc
+
+from src.throttling import THROTTLING_CODES, events
+
+PERCENTILES = (50, 90, 99)
+_STARTED = 'profile_started'
+_THROTTLED = 'profile_throttled'
+
+
+def enabled(environ=os.environ):
+    """
+    >>> enabled({'PROFILE_AWS_CALLS': 'true'}), enabled({})
+    (True, False)
+    """
+    return environ.get('PROFILE_AWS_CALLS', '').lower() in ('1', 'true', 'yes')
+
+
+def from_environment():
+    return CallProfiler() if enabled() else None
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of `values`
+
+    >>> percentile([5, 1, 4, 2, 3], 50), percentile([5, 1, 4, 2, 3], 99), percentile([], 50)
+    (3, 5, None)
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def _operation(event_name):
+    # e.g. after-call.cloudtrail.DescribeTrails
+    return event_name.split('.', 1)[1]
+
+
+class CallProfiler:
+    """
+    Aggregates the calls of the clients attached to it, per `service.Operation`
+
+    >>> CallProfiler().drain()
+    {}
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        emitter = events(client)
+        if emitter is not None:
+            emitter.register('before-parameter-build', self._before_call)
+            emitter.register('needs-retry', self._needs_retry)
+            emitter.register('after-call', self._after_call)
+            emitter.register('after-call-error', self._after_call_error)
+        return client
+
+    # Some events take the first handler's answer in botocore's place, so these must return None.
+    # Timing starts at before-parameter-build, the first event of a call; a before-call handler, like
+    # botocore's Stubber, can end the chain before ours runs.
+    def _before_call(self, context, **kwargs):
+        context[_STARTED] = time.perf_counter()
+
+    def _needs_retry(self, request_dict, response=None, **kwargs):
+        # Called after every attempt; the final response hides the throttled attempts that were retried
+        if response is not None and response[1].get('Error', {}).get('Code') in THROTTLING_CODES:
+            context = request_dict['context']
+            context[_THROTTLED] = context.get(_THROTTLED, 0) + 1
+
+    def _after_call(self, event_name, http_response, parsed, context, **kwargs):
+        error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+        self.record(_operation(event_name), context,
+                    retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                    size=int(http_response.headers.get('content-length') or 0),
+                    error=error)
+
+    def _after_call_error(self, event_name, exception, context, **kwargs):
+        self.record(_operation(event_name), context,
+                    retries=max(context.get('retries', {}).get('attempt', 1) - 1, 0),
+                    size=0,
+                    error=type(exception).__name__)
+
+    def record(self, operation, context, retries, size, error=None):
+        started = context.get(_STARTED)
+        ms = (time.perf_counter() - started) * 1000 if started is not None else None
+        with self._lock:
+            calls = self._calls.setdefault(operation, {'calls': 0, 'latencies': [], 'retries': 0, 'throttled': 0,
+                                                       'bytes': 0, 'errors': {}})
+            calls['calls'] += 1
+            if ms is not None:
+                calls['latencies'].append(ms)
+            calls['retries'] += retries
+            # needs-retry also sees the final attempt, except when the call never reached an endpoint
+            calls['throttled'] += context.get(_THROTTLED, 0) or int(error in THROTTLING_CODES)
+            calls['bytes'] += size
+            if error:
+                calls['errors'][error] = calls['errors'].get(error, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            calls = {operation: dict(c, latencies=list(c['latencies']), errors=dict(c['errors']))
+                     for operation, c in self._calls.items()}
+        return _summary(calls)
+
+    def drain(self):
+        """The summary so far, starting over; a warm container profiles each invocation separately"""
+        with self._lock:
+            calls, self._calls = self._calls, {}
+        return _summary(calls)
+
+
+def _summary(calls):
+    return {
+        operation: {
+            'calls': c['calls'],
+            'retries': c['retries'],
+            'throttled': c['throttled'],
+            'errors': c['errors'],
+            'bytes': c['bytes'],
+            **{f'p{p}_ms': _round(percentile(c['latencies'], p)) for p in PERCENTILES},
+            'max_ms': _round(max(c['latencies'], default=None)),
+        }
+        for operation, c in sorted(calls.items())
+    }
+
+
+def _round(ms):
+    return None if ms is None else round(ms, 1)
+
+
+def summarize(world, clients):
+    """`world` with the calls profiled by `clients` since the last summary in world['aws_calls']"""
+    profiler = getattr(clients, 'profiler', None)
+    return assoc(world, 'aws_calls', profiler.drain()) if profiler is not None else world
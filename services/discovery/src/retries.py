@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+from collections import namedtuple
+import logging
+import random
+import time
+
+from src import lazy
+from src.concurrency import remaining
+from src.logs import fields, without_query
+
+urllib3 = lazy.module('urllib3')
+logger = logging.getLogger()
+
+CONNECT_TIMEOUT_SECONDS = 3.0
+READ_TIMEOUT_SECONDS = 10.0
+MAX_ATTEMPTS = 5
+BASE_DELAY_SECONDS = 0.25
+MAX_DELAY_SECONDS = 4.0
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# `response` is the last response received, or None if no attempt got one.
+Result = namedtuple('Result', ['response', 'attempts'])
+
+
+def backoff(attempt, base=BASE_DELAY_SECONDS, cap=MAX_DELAY_SECONDS, rand=random.random):
+    """
+    Full-jitter delay before retry number `attempt` (0-based)
+
+    >>> backoff(0, rand=lambda: 1.0), backoff(3, rand=lambda: 1.0), backoff(10, rand=lambda: 0.5)
+    (0.25, 2.0, 2.0)
+    """
+    return rand() * min(cap, base * 2 ** attempt)
+
+
+def request(http, method, url, deadline_at, max_attempts=MAX_ATTEMPTS, connect_timeout=CONNECT_TIMEOUT_SECONDS,
+            read_timeout=READ_TIMEOUT_SECONDS, sleep=time.sleep, **kwargs):
+    """
+    `http.request(method, url, **kwargs)`, retried with jittered exponential backoff on connection errors,
+    timeouts, 429 and 5xx responses, for at most `max_attempts` attempts and never past `deadline_at`.
+
+    Each attempt's connect and read together are bounded by the time left, and a retry is only made if its
+    delay leaves time for it. Returns a `Result` with the last response and a record of every attempt.
+    """
+    attempts = []
+    for attempt in range(max_attempts):
+        left = remaining(deadline_at)
+        if left <= 0:
+            break
+        started = time.monotonic()
+        record = {'attempt': attempt + 1}
+        response = None
+        try:
+            response = http.request(method, url, retries=False,
+                                    timeout=urllib3.Timeout(total=left, connect=min(connect_timeout, left),
+                                                            read=min(read_timeout, left)),
+                                    **kwargs)
+            record['status'] = response.status
+        except urllib3.exceptions.HTTPError as err:
+            record['error'] = f'{type(err).__name__}: {err}'
+        record['seconds'] = round(time.monotonic() - started, 3)
+        attempts.append(record)
+        if response is not None and response.status not in RETRYABLE_STATUSES:
+            return Result(response, attempts)
+        delay = backoff(attempt)
+        if attempt + 1 < max_attempts and delay < remaining(deadline_at):
+            logger.warning(f'{method} attempt {attempt + 1} failed; retrying', extra=fields(url=without_query(url), **record))
+            sleep(delay)
+        else:
+            return Result(response, attempts)
+    return Result(None, attempts)
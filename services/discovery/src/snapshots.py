@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import datetime
+import json
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+
+from src.clients import registry
+
+logger = logging.getLogger()
+
+# Bumped whenever the coeffects change shape, e.g. 2 added data_exports, so older snapshots are refetched
+SNAPSHOT_VERSION = 2
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+class FileStore:
+    """Snapshots as files in a local directory; the stand-in for S3 in tests and local runs"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(key), 'w') as f:
+            f.write(body)
+
+
+class S3Store:
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _key(self, key):
+        return f'{self.prefix}/{key}.json' if self.prefix else f'{key}.json'
+
+    def get(self, key):
+        try:
+            response = registry.client('s3').get_object(Bucket=self.bucket, Key=self._key(key))
+            return response['Body'].read().decode('utf-8')
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') in {'NoSuchKey', '404'}:
+                return None
+            raise
+
+    def put(self, key, body):
+        registry.client('s3').put_object(Bucket=self.bucket, Key=self._key(key), Body=body.encode('utf-8'),
+                                         ContentType='application/json')
+
+
+def store_from_uri(uri):
+    """
+    Snapshot store for `s3://bucket/prefix` or `file:///directory`; None (snapshots disabled) when empty
+
+    >>> store_from_uri('s3://bucket/discovery').prefix
+    'discovery'
+    >>> store_from_uri('') is None
+    True
+    """
+    if not uri:
+        return None
+    parsed = urlparse(uri)
+    if parsed.scheme == 's3':
+        return S3Store(parsed.netloc, parsed.path)
+    if parsed.scheme == 'file':
+        return FileStore(parsed.path)
+    raise ValueError(f'Unsupported snapshot store {uri}')
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialize {type(value)}')
+
+
+def save(store, key, coeffects, now=None):
+    body = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'fetched_at': time.time() if now is None else now,
+        'coeffects': coeffects,
+    }, default=_default)
+    store.put(key, body)
+    return body
+
+
+def load(store, key, ttl_seconds, now=None):
+    """The stored snapshot for `key`, or None if it is missing, unreadable, from another version, or stale"""
+    try:
+        body = store.get(key)
+        snapshot = json.loads(body) if body else None
+    except Exception:
+        logger.warning('Failed to read discovery snapshot', exc_info=True)
+        return None
+    if not snapshot or snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    age = (time.time() if now is None else now) - snapshot.get('fetched_at', 0)
+    if not 0 <= age <= ttl_seconds:
+        return None
+    return snapshot
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+voluptuous schemas compiled into plain Python validation functions.
+
+voluptuous interprets a schema on every call, going through its generic candidate matching, path bookkeeping
+and error collection for every key. `compiled` resolves all of that once, when the schema is defined, into
+closures specialized to each node: an isinstance check for a type, a comparison for a literal, a direct
+pattern match for Match, and a loop over exactly the known keys for a dict. The result accepts and rejects
+the same data as the schema and returns the same validated copy; only the error messages are less detailed,
+since it stops at the first error. Anything it does not specialize is validated by voluptuous itself.
+"""
+
+from voluptuous import (Any, Invalid, Marker, Match, MultipleInvalid, Optional, Remove, Required, Schema,
+                        ALLOW_EXTRA, REMOVE_EXTRA)
+from voluptuous.schema_builder import Undefined, primitive_types
+
+
+class Validator:
+    """
+    A callable validating like `schema`, a voluptuous Schema, compiled once
+
+    >>> validate = Validator(Schema({'a': int, Optional('b'): str}, required=True))
+    >>> validate({'a': 1, 'b': 'x'})
+    {'a': 1, 'b': 'x'}
+    >>> validate({'b': 'x'})
+    Traceback (most recent call last):
+    ...
+    voluptuous.error.MultipleInvalid: required key not provided @ data['a']
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._validate = _compile(schema.schema, schema.required, schema.extra)
+
+    def __call__(self, data):
+        try:
+            return self._validate(data)
+        except MultipleInvalid:
+            raise
+        except Invalid as e:
+            raise MultipleInvalid([e])
+
+    def __repr__(self):
+        return f'Validator({self.schema!r})'
+
+
+def compiled(schema):
+    return Validator(schema)
+
+
+def _invalid(message, path=()):
+    return Invalid(message, list(path))
+
+
+def _within(key, e):
+    """`e`, raised for the value under `key`, with `key` prepended to its path"""
+    return Invalid(e.msg, [key] + (e.path or []))
+
+
+def _compile(node, required, extra):
+    if isinstance(node, Schema):
+        return _compile(node.schema, node.required, node.extra)
+    if isinstance(node, dict):
+        return _compile_dict(node, required, extra)
+    if isinstance(node, list):
+        return _compile_list(node, required, extra)
+    if isinstance(node, Any) and node.msg is None and not getattr(node, 'discriminant', None):
+        # Like voluptuous, the alternatives take `required` from the Any, not from the enclosing schema
+        return _compile_any([_compile(v, node.required, extra) for v in node.validators])
+    if isinstance(node, Match):
+        return _compile_match(node)
+    if isinstance(node, type):
+        return _compile_type(node)
+    if node is None or type(node) in primitive_types:
+        return _compile_literal(node)
+    return _fallback(node, required, extra)
+
+
+def _fallback(node, required, extra):
+    schema = Schema(node, required=required, extra=extra)
+
+    def validate(data):
+        return schema(data)
+    return validate
+
+
+def _compile_type(cls):
+    message = f'expected {cls.__name__}'
+
+    def validate(data):
+        if isinstance(data, cls):
+            return data
+        raise _invalid(message)
+    return validate
+
+
+def _compile_literal(value):
+    def validate(data):
+        if data != value:
+            raise _invalid('not a valid value')
+        return data
+    return validate
+
+
+def _compile_match(match):
+    pattern = match.pattern
+
+    def validate(data):
+        try:
+            matched = pattern.match(data)
+        except TypeError:
+            raise _invalid('expected string or buffer')
+        if not matched:
+            raise _invalid(f'does not match regular expression {pattern.pattern}')
+        return data
+    return validate
+
+
+def _compile_any(alternatives):
+    def validate(data):
+        error = None
+        for alternative in alternatives:
+            try:
+                return alternative(data)
+            except Invalid as e:
+                if error is None or len(e.path) > len(error.path):
+                    error = e
+        raise error or _invalid('no valid value found')
+    return validate
+
+
+def _compile_list(schema, required, extra):
+    if not schema:
+        def validate_empty(data):
+            if not isinstance(data, list):
+                raise _invalid('expected a list')
+            if data:
+                raise _invalid('not a valid value')
+            return data
+        return validate_empty
+
+    alternatives = [_compile(v, required, extra) for v in schema]
+
+    def validate(data):
+        if not isinstance(data, list):
+            raise _invalid('expected a list')
+        out = []
+        for i, value in enumerate(data):
+            error = None
+            for alternative in alternatives:
+                try:
+                    out.append(alternative(value))
+                    break
+                except Invalid as e:
+                    # voluptuous does not try the other alternatives once one failed below the item itself
+                    if e.path:
+                        raise _within(i, e)
+                    error = e
+            else:
+                raise _within(i, error)
+        return type(data)(out)
+    return validate
+
+
+def _specializable(schema):
+    """Whether a dict schema uses only the keys `_compile_dict` handles: literals, and at most one wildcard"""
+    wildcards = 0
+    for key in schema:
+        if isinstance(key, Remove) or (isinstance(key, (Required, Optional)) and
+                                       not isinstance(key.default, Undefined)):
+            return False
+        if isinstance(key, Marker):
+            if type(key).__name__ not in ('Required', 'Optional') or type(key.schema) not in primitive_types:
+                return False
+        elif type(key) not in primitive_types:
+            wildcards += 1
+            if not isinstance(key, type):
+                return False
+    return wildcards <= 1
+
+
+def _compile_dict(schema, required, extra):
+    if not _specializable(schema):
+        return _fallback(schema, required, extra)
+
+    by_key, wildcard = {}, None
+    required_keys = []
+    for key, value in schema.items():
+        validate_value = _compile(value, required, extra)
+        if (required and not isinstance(key, Optional)) or isinstance(key, Required):
+            required_keys.append(key.schema if isinstance(key, Marker) else key)
+        if isinstance(key, Marker):
+            by_key[key.schema] = validate_value
+        elif isinstance(key, type):
+            wildcard = (key, validate_value)
+        else:
+            by_key[key] = validate_value
+    literal_required = [k for k in required_keys if not isinstance(k, type)]
+    wildcard_required = any(isinstance(k, type) for k in required_keys)
+    keep_extra = extra == ALLOW_EXTRA
+    drop_extra = extra == REMOVE_EXTRA
+
+    def validate(data):
+        if not isinstance(data, dict):
+            raise _invalid('expected a dictionary')
+        out = type(data)()
+        wildcard_found = False
+        for key, value in data.items():
+            validate_value = by_key.get(key)
+            if validate_value is None and wildcard is not None and isinstance(key, wildcard[0]):
+                validate_value = wildcard[1]
+                wildcard_found = True
+            if validate_value is None:
+                if keep_extra:
+                    out[key] = value
+                elif not drop_extra:
+                    raise _invalid('extra keys not allowed', [key])
+                continue
+            try:
+                out[key] = validate_value(value)
+            except Invalid as e:
+                raise _within(key, e)
+        for key in literal_required:
+            if key not in data:
+                raise _invalid('required key not provided', [key])
+        if wildcard_required and not wildcard_found:
+            raise _invalid('required key not provided', [wildcard[0]])
+        return out
+    return validate
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Cold start of `src.app.handler`: its import and first invocation, in a fresh interpreter.
+
+    pytest tests/performance/test_coldstart.py --no-cov   # measure both import modes against the budget
+
+`measure` starts a new Python with `-X importtime`, imports the handler and invokes it once against a local
+stub of every endpoint: AWS API calls are denied, the CloudFormation response and any other URL of the event
+under STUB succeed. It returns the wall time of the init (the import) and of the invocation, and the import
+time of every package during each. A cold start is over budget when its init exceeds
+COLD_START_INIT_BUDGET_MS or its init and invocation together COLD_START_BUDGET_MS (both milliseconds).
+"""
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import subprocess
+import sys
+import threading
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+INIT_BUDGET_MS = float(os.environ.get('COLD_START_INIT_BUDGET_MS', '750'))
+BUDGET_MS = float(os.environ.get('COLD_START_BUDGET_MS', '2500'))
+# Stands for the stub's address in the URLs of an event
+STUB = 'http://stub'
+# Prefix of the lines the child writes to stderr between importtime's, and to stdout for its result
+MARKER = 'coldstart:'
+
+CHILD = f'''
+import sys, time
+sys.stderr.write('{MARKER} init\\n')
+started = time.perf_counter()
+import src.app
+imported = time.perf_counter()
+sys.stderr.write('{MARKER} invoke\\n')
+import json
+
+
+class Context:
+    log_stream_name = 'coldstart'
+    aws_request_id = 'coldstart'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+src.app.handler(json.loads(sys.argv[1]), Context())
+invoked = time.perf_counter()
+sys.stderr.write('{MARKER} done\\n')
+print('{MARKER}', (imported - started) * 1000, (invoked - imported) * 1000)
+'''
+
+
+class _Stub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    aws_error = json.dumps({'__type': 'AccessDeniedException', 'message': 'stubbed'}).encode('utf-8')
+
+    def _respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.requests.append((self.command, self.path))
+        aws = not any(self.path.startswith(path) for path in self.server.paths)
+        body = self.aws_error if aws else b'OK'
+        self.send_response(403 if aws else 200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1' if aws else 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_HEAD = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def stub_endpoints(paths):
+    """A local server answering `paths` with 200 and everything else as a denied AWS API call"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Stub)
+    server.paths, server.requests = tuple(paths), []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def environment(endpoint, lazy, extra=None):
+    """This environment without AWS configuration or credentials, all AWS endpoints being `endpoint`"""
+    env = {k: v for k, v in os.environ.items() if not k.startswith('AWS_') and k != 'LAZY_IMPORTS'}
+    return {**env,
+            'AWS_ACCESS_KEY_ID': 'coldstart',
+            'AWS_SECRET_ACCESS_KEY': 'coldstart',
+            'AWS_DEFAULT_REGION': 'us-east-1',
+            'AWS_EC2_METADATA_DISABLED': 'true',
+            'AWS_ENDPOINT_URL': endpoint,
+            'LAZY_IMPORTS': 'true' if lazy else 'false',
+            **(extra or {})}
+
+
+def breakdown(stderr):
+    """
+    `{phase: {package: milliseconds}}` of the `-X importtime` lines in `stderr`, the self time of every
+    module summed by top-level package, for each phase the child marked
+
+    >>> breakdown('coldstart: init\\n'
+    ...           'import time: self [us] | cumulative | imported package\\n'
+    ...           'import time:      1500 |       3500 |   boto3.session\\n'
+    ...           'import time:      2000 |       2000 |     botocore\\n'
+    ...           'coldstart: invoke\\n'
+    ...           'import time:       500 |        500 | urllib3\\n')
+    {'init': {'boto3': 1.5, 'botocore': 2.0}, 'invoke': {'urllib3': 0.5}}
+    """
+    phases, phase = {}, 'startup'
+    for line in stderr.splitlines():
+        if line.startswith(MARKER):
+            phase = line[len(MARKER):].strip()
+            continue
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages = phases.setdefault(phase, {})
+        packages[package] = packages.get(package, 0) + int(self_us) / 1000
+    return {phase: packages for phase, packages in phases.items() if phase in ('init', 'invoke')}
+
+
+def measure(event, lazy=False, paths=('/response',), env=None, timeout=120):
+    """
+    `{'init_ms', 'invoke_ms', 'modules', 'requests'}` of a cold start handling `event`, where `modules` is the
+    `breakdown` of its imports and `requests` the `(method, path)` of every request the stub received
+    """
+    with stub_endpoints(paths) as server:
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD,
+                                    json.dumps(event).replace(STUB, url)],
+                                   cwd=SERVICE_DIR, env=environment(url, lazy, env),
+                                   capture_output=True, text=True, timeout=timeout)
+        requests = list(server.requests)
+    result = [line.split()[1:] for line in completed.stdout.splitlines() if line.startswith(MARKER)]
+    if completed.returncode or not result:
+        raise AssertionError(f'Cold start failed ({completed.returncode}):\n{completed.stderr[-4000:]}')
+    init_ms, invoke_ms = map(float, result[-1])
+    return {'init_ms': init_ms, 'invoke_ms': invoke_ms, 'modules': breakdown(completed.stderr), 'requests': requests}
+
+
+def over_budget(result, init_budget_ms=INIT_BUDGET_MS, budget_ms=BUDGET_MS):
+    """
+    Descriptions of every budget `result` exceeds
+
+    >>> over_budget({'init_ms': 800.0, 'invoke_ms': 100.0}, 750, 2500)
+    ['init 800 ms > budget 750 ms']
+    """
+    found = []
+    if result['init_ms'] > init_budget_ms:
+        found.append(f"init {result['init_ms']:.0f} ms > budget {init_budget_ms:.0f} ms")
+    total = result['init_ms'] + result['invoke_ms']
+    if total > budget_ms:
+        found.append(f'init and first invocation {total:.0f} ms > budget {budget_ms:.0f} ms')
+    return found
+
+
+def report(results, top=8):
+    """The init and invocation times of each of `results`, with their most expensive packages"""
+    lines = [f"{'cold start':<24} {'init ms':>10} {'invoke ms':>10}  slowest imports (ms)"]
+    for key, result in sorted(results.items()):
+        for phase in ('init', 'invoke'):
+            packages = sorted(result['modules'].get(phase, {}).items(), key=lambda x: -x[1])[:top]
+            slowest = ', '.join(f'{package} {ms:.0f}' for package, ms in packages) or '-'
+            times = (f"{result['init_ms']:>10.0f} {result['invoke_ms']:>10.0f}" if phase == 'init'
+                     else ' ' * 21)
+            lines.append(f"{key if phase == 'init' else '':<24} {times}  {phase}: {slowest}")
+    return '\n'.join(lines)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import logging
+
+import pytest
+
+import src.app as app
+from src import metrics
+from tests.performance import benchmark, worlds
+
+# Largest tolerated growth of the per-item cost between 10,000 and 100,000 items; linear code stays near 1,
+# anything quadratic is ~10. Smaller scales are too dominated by fixed costs and allocator free lists to compare.
+MAX_PER_ITEM_GROWTH = 3.0
+
+pytestmark = [pytest.mark.performance, pytest.mark.slow]
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    # Record formatting would dominate the measurements.
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    yield
+    logger.setLevel(level)
+
+
+def discover(world):
+    return app.OUTPUT_SCHEMA(app.discover_account_types(app.build_discovery_index(world)))
+
+
+def build_index(world):
+    return app.build_discovery_index(world)
+
+
+def cur_bucket(world):
+    local_buckets = frozenset(b['Name'] for b in app.coeffects_buckets(world))
+    return app.get_cur_bucket_if_local(local_buckets, app.coeffects_payer_reports(world)['report_definitions'])
+
+
+BENCHMARKS = {
+    'discover_account_types': discover,
+    'build_discovery_index': build_index,
+    'get_cur_bucket_if_local': cur_bucket,
+    'get_first_valid_trail': app.get_first_valid_trail,
+}
+
+
+@pytest.mark.parametrize('name', sorted(BENCHMARKS))
+def test_scales_linearly(benchmarks, name):
+    for n in benchmark.SCALES:
+        benchmarks(name, n, BENCHMARKS[name], worlds.discovery_world(n))
+    for key in ('seconds', 'peak_bytes'):
+        growth = benchmark.per_item_growth(benchmarks.results, name, 10_000, 100_000, key)
+        assert growth <= MAX_PER_ITEM_GROWTH, f'{name} {key} per item grew {growth:.1f}x from 10,000 to 100,000 items'
+
+
+def update_world(world):
+    # What each stage does to the world, without the stage's own work: merge into the output, record a timing,
+    # validate. toolz copies only the dicts on the updated path and voluptuous passes the keys it allows through
+    # as they are, so none of this should depend on the size of the coeffects.
+    world = app.discover_connected_account(world)
+    world = metrics.record(world, 'stages', 'discover_connected_account', 0.0)
+    return app.OUTPUT_SCHEMA(world)
+
+
+def test_world_updates_share_the_coeffects(benchmarks):
+    for n in benchmark.SCALES:
+        benchmarks('world_updates', n, update_world, discover(worlds.discovery_world(n)))
+    smallest, largest = benchmarks.results['world_updates@10'], benchmarks.results['world_updates@100000']
+    # 10,000 times the items; anything copied per item would show as much more than allocator noise
+    for key in ('retained_blocks', 'retained_bytes', 'peak_bytes'):
+        assert largest[key] <= 2 * smallest[key], f'world updates {key} grew from {smallest[key]} to {largest[key]}'
+
+
+def test_synthetic_world_is_discovered_like_a_real_one():
+    world = discover(worlds.discovery_world(10))
+    assert world['output']['CloudTrailTrailArn'].endswith('trail/trail-9')
+    assert world['output']['MasterPayerBillingBucketName'] == 'bucket-9'
+    assert world['output']['BillingReportFormat'] == 'aws'
+    assert world['output']['IsOrganizationMasterAccount'] is True
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import pytest
+
+from tests.performance import coldstart
+
+pytestmark = [pytest.mark.performance, pytest.mark.slow]
+
+CREATE = {
+    'LogicalResourceId': 'Discovery',
+    'PhysicalResourceId': 'physical_id',
+    'RequestId': 'request-id',
+    'RequestType': 'Create',
+    'ResourceProperties': {'AccountId': '123456789012'},
+    'ResponseURL': f'{coldstart.STUB}/response',
+    'StackId': 'stack-id',
+}
+
+
+@pytest.mark.parametrize('lazy', [False, True], ids=['eager', 'lazy'])
+def test_cold_start_is_within_budget(cold_starts, lazy):
+    result = cold_starts('create', CREATE, lazy=lazy)
+    assert ('PUT', '/response') in result['requests']
+    found = coldstart.over_budget(result)
+    assert not found, found
+
+
+def test_lazy_imports_defer_boto3_and_urllib3_to_the_invocation(cold_starts):
+    modules = cold_starts('create', CREATE, lazy=True)['modules']
+    assert not {'boto3', 'urllib3'} & set(modules['init'])
+    assert {'boto3', 'urllib3'} <= set(modules['invoke'])
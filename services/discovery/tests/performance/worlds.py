@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Synthetic discovery worlds with `n` buckets, trails and report definitions.
+
+Every collection is built for the worst case: the only ideal trail and the only top-tier local report
+come last, so nothing can stop early.
+"""
+
+ACCOUNT_ID = '123456789012'
+
+
+def trail(i, ideal=False):
+    return {
+        'Name': f'trail-{i}',
+        'TrailARN': f'arn:aws:cloudtrail:us-east-1:{ACCOUNT_ID}:trail/trail-{i}',
+        'HomeRegion': 'us-east-1',
+        'S3BucketName': f'bucket-{i}',
+        'SnsTopicName': f'topic-{i}',
+        'SnsTopicARN': f'arn:aws:sns:us-east-1:{ACCOUNT_ID}:topic-{i}',
+        'IsMultiRegionTrail': ideal or i % 2 == 0,
+        'IsOrganizationTrail': ideal,
+    }
+
+
+def report_definition(i, ideal=False):
+    return {
+        'ReportName': f'report-{i}',
+        'TimeUnit': 'HOURLY',
+        'Format': 'textORcsv' if ideal else 'Parquet',
+        'Compression': 'GZIP' if ideal else 'Parquet',
+        'AdditionalSchemaElements': ['RESOURCES'],
+        'S3Bucket': f'bucket-{i}' if ideal or i % 2 == 0 else f'remote-bucket-{i}',
+        'S3Prefix': 'cur',
+        'S3Region': 'us-east-1',
+        'ReportVersioning': 'CREATE_NEW_REPORT',
+        'RefreshClosedReports': True,
+    }
+
+
+def buckets(n):
+    return [{'Name': f'bucket-{i}'} for i in range(n)]
+
+
+def trails_by_arn(n):
+    trails = [trail(i) for i in range(n - 1)] + [trail(n - 1, ideal=True)]
+    return {t['TrailARN']: t for t in trails}
+
+
+def report_definitions(n):
+    return [report_definition(i) for i in range(n - 1)] + [report_definition(n - 1, ideal=True)]
+
+
+def discovery_world(n):
+    """The world as it is after the coeffects, ready for `build_discovery_index`"""
+    return {
+        'event': {
+            'RequestType': 'Create',
+            'ResourceProperties': {'AccountId': ACCOUNT_ID},
+            'ResponseURL': 'https://cfn.amazonaws.com/callback',
+            'StackId': 'stack-id',
+        },
+        'coeffects': {
+            'cloudtrail': {'trailsByArn': trails_by_arn(n), 'regionsTimedOut': []},
+            's3': {'Buckets': buckets(n)},
+            'cur': {'report_definitions': report_definitions(n)},
+            'organizations': {'Organization': {'MasterAccountId': ACCOUNT_ID}},
+        },
+    }
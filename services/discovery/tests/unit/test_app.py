@@ -2,16 +2,19 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
+import copy
+import json
 import os
+import time
 from collections import namedtuple
 
 import pytest
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ParamValidationError
 from voluptuous import All, Schema, ALLOW_EXTRA
 from toolz.curried import assoc_in
 
 import src.app as app
-from src import cfnresponse
+from src import cfnresponse, concurrency
 
 
 LOCAL_ACCOUNT_ID = '123456789012'
@@ -264,10 +267,14 @@ def context(mocker):
     context.os = {'environ': os.environ}
     context.prefix = app.__name__
     context.mock_cfnresponse_send = mocker.patch(f'{context.prefix}.cfnresponse.send', autospec=True)
-    context.mock_ct = mocker.patch(f'{context.prefix}.ct', autospec=True)
-    context.mock_cur = mocker.patch(f'{context.prefix}.cur', autospec=True)
-    context.mock_orgs = mocker.patch(f'{context.prefix}.orgs', autospec=True)
-    context.mock_s3 = mocker.patch(f'{context.prefix}.s3', autospec=True)
+    context.mock_ct = mocker.patch(f'{context.prefix}.ct', autospec=True).return_value
+    context.mock_cur = mocker.patch(f'{context.prefix}.cur', autospec=True).return_value
+    context.mock_orgs = mocker.patch(f'{context.prefix}.orgs', autospec=True).return_value
+    context.mock_s3 = mocker.patch(f'{context.prefix}.s3', autospec=True).return_value
+    context.mock_data_exports = mocker.patch(f'{context.prefix}.data_exports', autospec=True).return_value
+    context.mock_data_exports.list_exports.return_value = {'Exports': []}
+    context.mock_ec2 = mocker.patch(f'{context.prefix}.ec2', autospec=True).return_value
+    context.mock_ec2.describe_regions.return_value = {'Regions': []}
     yield context
     os.environ = orig_env
     mocker.stopall()
@@ -533,6 +540,32 @@ def test_handler_only_connected(context, cfn_event, describe_report_definitions_
     assert output == assoc_in(app.DEFAULT_OUTPUT, ['IsResourceOwnerAccount'], True)
 
 
+@pytest.mark.unit
+def test_handler_fits_the_trails_of_an_oversized_organization_in_the_response(
+    context, cfn_event, describe_trails_response_local, list_buckets_response,
+    describe_report_definitions_response_local, describe_organizations_local,
+):
+    [local_trail] = describe_trails_response_local['trailList']
+    member_trails = [dict(local_trail, Name=f'member-{n}', SnsTopicARN=None,
+                          TrailARN=f'arn:aws:cloudtrail:us-east-1:{n:012}:trail/organization-trail')
+                     for n in range(100)]
+    context.mock_ct.describe_trails.return_value = {'trailList': [local_trail, *member_trails]}
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.return_value = list_buckets_response
+    app.handler(cfn_event, None)
+    ((_, _, status, output, _), kwargs) = context.mock_cfnresponse_send.call_args
+    body = {'Status': status, 'Data': output}
+    assert len(json.dumps(body)) > cfnresponse.MAX_RESPONSE_BYTES
+
+    fitted = cfnresponse.fit(body, truncatable=kwargs['truncatable'], request_type='Create')
+    assert fitted['Status'] == cfnresponse.SUCCESS
+    assert fitted['Data']['TruncatedFields'] == 'VisibleCloudTrailArns'
+    assert fitted['Data']['VisibleCloudTrailArns'].startswith(LOCAL_TRAIL_ARN)
+    assert {k: v for k, v in fitted['Data'].items() if k not in ('VisibleCloudTrailArns', 'TruncatedFields')} == {
+        k: v for k, v in output.items() if k != 'VisibleCloudTrailArns'}
+
+
 @pytest.mark.unit
 def test_handler_exception(context):
     ret = app.handler({}, None)
@@ -563,6 +596,146 @@ def test_handler_cur_format_detection(context, cfn_event, describe_trails_respon
     assert output['IsMasterPayerAccount'] is True
 
 
+def cur2_export(name='cur2-export', bucket=LOCAL_BUCKET_NAME, table='COST_AND_USAGE_REPORT', status='HEALTHY',
+                **output):
+    return {
+        'Export': {
+            'ExportArn': f'arn:aws:bcm-data-exports:us-east-1:{LOCAL_ACCOUNT_ID}:export/{name}',
+            'Name': name,
+            'DataQuery': {
+                'QueryStatement': f'SELECT identity_line_item_id, line_item_unblended_cost FROM {table}',
+                'TableConfigurations': {table: {'TIME_GRANULARITY': 'HOURLY', 'INCLUDE_RESOURCES': 'TRUE'}},
+            },
+            'DestinationConfigurations': {
+                'S3Destination': {
+                    'S3Bucket': bucket,
+                    'S3Prefix': 'exports',
+                    'S3Region': 'us-east-1',
+                    'S3OutputConfigurations': {'OutputType': 'CUSTOM', 'Format': 'PARQUET', 'Compression': 'PARQUET',
+                                               'Overwrite': 'CREATE_NEW_REPORT', **output},
+                },
+            },
+            'RefreshCadence': {'Frequency': 'SYNCHRONOUS'},
+        },
+        'ExportStatus': {'StatusCode': status},
+    }
+
+
+def exports(context, *responses):
+    by_arn = {r['Export']['ExportArn']: r for r in responses}
+    context.mock_data_exports.list_exports.return_value = {
+        'Exports': [{'ExportArn': arn, 'ExportName': r['Export']['Name']} for arn, r in by_arn.items()]}
+    context.mock_data_exports.get_export.side_effect = lambda ExportArn: by_arn[ExportArn]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('report_definitions,export,expected_format', [
+    ([], cur2_export(), 'aws_cur2_parquet'),
+    ([], cur2_export(Overwrite='OVERWRITE_REPORT'), 'aws_cur2_parquet'),  # minimum tier
+    ([PARQUET_REPORT], cur2_export(), 'aws_parquet'),
+    ([CSV_REPORT], cur2_export(), 'aws'),
+    ([], cur2_export(Format='TEXT_OR_CSV', Compression='GZIP'), 'aws'),
+    ([], cur2_export(status='UNHEALTHY'), 'aws'),
+    ([], cur2_export(table='FOCUS_1_0_AWS'), 'aws'),
+])
+def test_handler_cur2_export_detection(context, cfn_event, describe_trails_response_local, list_buckets_response,
+                                       describe_organizations_local, report_definitions, export, expected_format):
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = {'ReportDefinitions': report_definitions}
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.return_value = list_buckets_response
+    exports(context, export)
+    app.handler(cfn_event, None)
+    ((_, _, status, output, _), _) = context.mock_cfnresponse_send.call_args
+    assert status == cfnresponse.SUCCESS
+    assert output['BillingReportFormat'] == expected_format
+    if expected_format == 'aws_cur2_parquet':
+        assert output['MasterPayerBillingBucketName'] == LOCAL_BUCKET_NAME
+        assert output['MasterPayerBillingBucketPath'] == 'exports/cur2-export'
+
+
+@pytest.mark.unit
+def test_cur2_export_buckets_are_cur_buckets(context, cfn_event, describe_trails_response_local,
+                                             list_buckets_response_two_local, describe_organizations_local):
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = {'ReportDefinitions': [CSV_REPORT]}
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.return_value = list_buckets_response_two_local
+    exports(context, cur2_export(bucket=SECOND_LOCAL_BUCKET_NAME), cur2_export('focus', table='FOCUS_1_0_AWS'))
+    app.handler(cfn_event, None)
+    ((_, _, status, output, _), _) = context.mock_cfnresponse_send.call_args
+    assert output['MasterPayerBillingBucketName'] == LOCAL_BUCKET_NAME
+    assert output['MasterPayerBillingBucketArns'] == ','.join([
+        f'arn:aws:s3:::{SECOND_LOCAL_BUCKET_NAME}',
+        f'arn:aws:s3:::{SECOND_LOCAL_BUCKET_NAME}/*',
+        f'arn:aws:s3:::{LOCAL_BUCKET_NAME}',
+        f'arn:aws:s3:::{LOCAL_BUCKET_NAME}/*',
+    ])
+
+
+@pytest.mark.unit
+def test_data_exports_access_denied_is_no_exports(context):
+    context.mock_data_exports.list_exports.side_effect = ClientError(
+        {'Error': {'Code': 'AccessDeniedException', 'Message': 'not authorized'}}, 'ListExports')
+    world = app.coeffects_data_exports({})
+    assert world['coeffects']['data_exports'] == app.DEFAULT_DATA_EXPORTS
+    assert 'coeffects_failed' not in world
+
+
+@pytest.mark.unit
+def test_exports_the_role_may_not_get_are_skipped(context):
+    exports(context, cur2_export(), cur2_export('denied'))
+    get_export = context.mock_data_exports.get_export.side_effect
+
+    def get_or_deny(ExportArn):
+        if 'denied' in ExportArn:
+            raise ClientError({'Error': {'Code': 'AccessDeniedException'}}, 'GetExport')
+        return get_export(ExportArn)
+
+    context.mock_data_exports.get_export.side_effect = get_or_deny
+    world = app.coeffects_data_exports({})
+    assert [e['ReportName'] for e in world['coeffects']['data_exports']['exports']] == ['cur2-export']
+    assert 'coeffects_failed' not in world
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('code', ['ThrottlingException', 'InternalServerException'])
+def test_exports_that_could_not_be_got_fail_the_coeffect(context, code):
+    exports(context, cur2_export())
+    context.mock_data_exports.get_export.side_effect = ClientError({'Error': {'Code': code}}, 'GetExport')
+    # Too little time left for `retrying` to wait out the throttling
+    world = app.coeffects_data_exports({'deadline': time.monotonic() + 0.1})
+    assert world['coeffects_failed'] == ['data_exports']
+
+
+@pytest.mark.unit
+def test_exports_that_timed_out_fail_the_coeffect(context, mocker):
+    export = cur2_export()
+    mocker.patch.object(app, 'run_concurrently', return_value=({}, [export['Export']['ExportArn']]))
+    exports(context, export)
+    world = app.coeffects_data_exports({})
+    assert world['coeffects_failed'] == ['data_exports']
+
+
+@pytest.mark.unit
+def test_a_hanging_export_fails_the_coeffect_before_its_round_times_out(context, mocker):
+    exports(context, cur2_export(), cur2_export('hanging'))
+    get_export = context.mock_data_exports.get_export.side_effect
+
+    def get_or_hang(ExportArn):
+        if 'hanging' in ExportArn:
+            time.sleep(2)
+        return get_export(ExportArn)
+
+    context.mock_data_exports.get_export.side_effect = get_or_hang
+    waits = mocker.spy(app, 'run_concurrently')
+    world = app.concurrent_coeffects({'deadline': time.monotonic() + 0.5}, app.coeffects_data_exports)
+    (outer, inner) = [c.args[1] for c in waits.call_args_list]
+    assert inner < outer
+    assert world['coeffects_timed_out'] == []
+    assert world['coeffects_failed'] == ['data_exports']
+
+
 @pytest.fixture()
 def list_buckets_response_two_local():
     return {
@@ -632,3 +805,422 @@ def test_handler_master_payer_excludes_remote_cur_buckets(
     ])
     assert output['MasterPayerBillingBucketArns'] == expected
     assert f'arn:aws:s3:::{REMOTE_BUCKET_NAME}' not in output['MasterPayerBillingBucketArns']
+
+
+def owned_buckets(*names):
+    # ListBuckets as S3 answers it: this account's buckets, in order, narrowed to a Prefix and MaxBuckets
+    def list_buckets(Prefix='', MaxBuckets=None):
+        buckets = [{'Name': name} for name in sorted(names) if name.startswith(Prefix)]
+        return {'Buckets': buckets[:MaxBuckets]}
+    return list_buckets
+
+
+@pytest.mark.unit
+def test_targeted_bucket_checks_only_ask_about_the_candidates(
+    context, monkeypatch, cfn_event, describe_trails_response_remote_bucket,
+    describe_report_definitions_response_two_local_one_remote, describe_organizations_local,
+):
+    monkeypatch.setenv('BUCKET_OWNERSHIP_CHECK', 'targeted')
+    context.mock_ct.describe_trails.return_value = describe_trails_response_remote_bucket
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_two_local_one_remote
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.side_effect = owned_buckets(LOCAL_BUCKET_NAME, SECOND_LOCAL_BUCKET_NAME,
+                                                             f'{REMOTE_BUCKET_NAME}-of-this-account', 'unrelated')
+    world = app.coeffects({'event': cfn_event, 'deadline': concurrency.deadline(None)})
+    assert world['coeffects']['s3'] == {'Buckets': [{'Name': SECOND_LOCAL_BUCKET_NAME}, {'Name': LOCAL_BUCKET_NAME}]}
+    assert world['coeffects_failed'] == []
+    assert sorted(c.kwargs['Prefix'] for c in context.mock_s3.list_buckets.call_args_list) == [
+        SECOND_LOCAL_BUCKET_NAME, LOCAL_BUCKET_NAME, REMOTE_BUCKET_NAME]
+
+
+@pytest.mark.unit
+def test_targeted_bucket_checks_fall_back_to_listing_every_bucket(
+    context, monkeypatch, cfn_event, describe_trails_response_local, list_buckets_response,
+    describe_report_definitions_response_local, describe_organizations_local,
+):
+    def list_buckets(**kwargs):
+        if kwargs:
+            raise ClientError({'Error': {'Code': 'InvalidArgument'}}, 'ListBuckets')
+        return list_buckets_response
+
+    monkeypatch.setenv('BUCKET_OWNERSHIP_CHECK', 'targeted')
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.side_effect = Exception('throttled')
+    context.mock_s3.list_buckets.side_effect = list_buckets
+    app.handler(cfn_event, None)
+    ((_, _, status, output, _), _) = context.mock_cfnresponse_send.call_args
+    assert status == cfnresponse.SUCCESS
+    assert output['IsAuditAccount'] is True
+    assert output['MasterPayerBillingBucketName'] == LOCAL_BUCKET_NAME
+    assert context.mock_s3.list_buckets.call_args_list[-1].kwargs == {}
+
+
+@pytest.mark.unit
+def test_a_hanging_bucket_check_falls_back_to_listing_every_bucket_in_time(context, mocker, list_buckets_response):
+    def list_buckets(**kwargs):
+        if kwargs.get('Prefix') == 'hanging':
+            time.sleep(2)
+        return list_buckets_response
+
+    mocker.patch.object(app, 'candidate_bucket_names', return_value=[LOCAL_BUCKET_NAME, 'hanging'])
+    context.mock_s3.list_buckets.side_effect = list_buckets
+    waits = mocker.spy(app, 'run_concurrently')
+    world = app.concurrent_coeffects({'deadline': time.monotonic() + 0.5}, app.coeffects_candidate_buckets)
+    (outer, inner) = [c.args[1] for c in waits.call_args_list]
+    assert inner < outer
+    assert world['coeffects_timed_out'] == []
+    assert world['coeffects']['s3'] == {'Buckets': list_buckets_response['Buckets']}
+
+
+@pytest.mark.unit
+def test_targeted_bucket_checks_stop_asking_a_botocore_without_prefixed_listing(
+    context, mocker, monkeypatch, cfn_event, describe_trails_response_local, list_buckets_response,
+    describe_report_definitions_response_local, describe_organizations_local,
+):
+    def list_buckets(**kwargs):
+        if kwargs:
+            raise ParamValidationError(report='Unknown parameter in input: "Prefix"')
+        return list_buckets_response
+
+    unsupported = mocker.patch.object(app, '_prefixed_listing_unsupported', app.threading.Event())
+    warning = mocker.spy(app.logger, 'warning')
+    monkeypatch.setenv('BUCKET_OWNERSHIP_CHECK', 'targeted')
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.side_effect = list_buckets
+    for _ in range(2):
+        world = app.coeffects({'event': cfn_event, 'deadline': concurrency.deadline(None)})
+        assert world['coeffects']['s3'] == {'Buckets': list_buckets_response['Buckets']}
+    assert unsupported.is_set()
+    assert context.mock_s3.list_buckets.call_args_list[-1].kwargs == {}
+    assert context.mock_s3.list_buckets.call_args_list[-2].kwargs == {}  # the second run asked for no prefix
+    assert sum('cannot list buckets by prefix' in c.args[0] for c in warning.call_args_list) == 1
+
+
+class LambdaContext:
+    def __init__(self, remaining_millis):
+        self.remaining_millis = remaining_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_millis
+
+
+@pytest.mark.unit
+def test_handler_coeffect_timeout(context, cfn_event, describe_trails_response_local, list_buckets_response, describe_report_definitions_response_local, describe_organizations_local):
+    def slow_describe_organization():
+        time.sleep(2)
+        return describe_organizations_local
+
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.side_effect = slow_describe_organization
+    context.mock_s3.list_buckets.return_value = list_buckets_response
+    lambda_context = LambdaContext(remaining_millis=int((concurrency.RESERVED_SECONDS + 0.5) * 1000))
+    started = time.monotonic()
+    ret = app.handler(cfn_event, lambda_context)
+    assert ret is None
+    assert time.monotonic() - started < 2
+    ((_, _, status, output, _), _) = context.mock_cfnresponse_send.call_args
+    assert status == cfnresponse.SUCCESS
+    assert output['IsAuditAccount'] is True
+    assert output['MasterPayerBillingBucketName'] == LOCAL_BUCKET_NAME
+    assert output['IsOrganizationMasterAccount'] is False
+    assert output['IsAccountOutsideOrganization'] is False
+    assert output['IsMasterPayerAccount'] is False
+
+
+@pytest.mark.unit
+def test_handler_does_not_take_a_failed_organization_lookup_for_no_organization(
+    context, cfn_event, describe_trails_response_local, list_buckets_response,
+    describe_report_definitions_response_local,
+):
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.side_effect = ClientError(
+        {'Error': {'Code': 'AccessDeniedException'}}, 'DescribeOrganization')
+    context.mock_s3.list_buckets.return_value = list_buckets_response
+    app.handler(cfn_event, None)
+    ((_, _, _, output, _), _) = context.mock_cfnresponse_send.call_args
+    assert output['IsAccountOutsideOrganization'] is False
+    assert output['IsOrganizationMasterAccount'] is False
+    assert output['IsMasterPayerAccount'] is False
+
+
+@pytest.mark.unit
+def test_coeffects_run_concurrently(context, cfn_event):
+    def slow(response):
+        def f(*args, **kwargs):
+            time.sleep(0.5)
+            return response
+        return f
+
+    context.mock_ct.describe_trails.side_effect = slow({'trailList': []})
+    context.mock_cur.describe_report_definitions.side_effect = slow({'ReportDefinitions': []})
+    context.mock_orgs.describe_organization.side_effect = slow({})
+    context.mock_s3.list_buckets.side_effect = slow({'Buckets': []})
+    started = time.monotonic()
+    world = app.coeffects({'event': cfn_event, 'deadline': concurrency.deadline(None)})
+    assert time.monotonic() - started < 1.5
+    assert world['coeffects_timed_out'] == []
+    assert set(world['coeffects']) == {'cloudtrail', 's3', 'cur', 'data_exports', 'organizations'}
+
+
+def paged_report_definitions(*pages):
+    def describe_report_definitions(NextToken=None):
+        index = int(NextToken or 0)
+        response = {'ReportDefinitions': pages[index]}
+        if index + 1 < len(pages):
+            response['NextToken'] = str(index + 1)
+        return response
+    return describe_report_definitions
+
+
+@pytest.mark.unit
+def test_handler_master_payer_reads_every_report_definition_page(
+    context, cfn_event, describe_trails_response_local,
+    list_buckets_response_two_local, describe_organizations_local,
+):
+    second_report = dict(CSV_REPORT, ReportName='second-cur', S3Bucket=SECOND_LOCAL_BUCKET_NAME, S3Prefix='cz')
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.side_effect = paged_report_definitions([PARQUET_REPORT], [], [second_report])
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.return_value = list_buckets_response_two_local
+    ret = app.handler(cfn_event, None)
+    assert ret is None
+    ((_, _, status, output, _), _) = context.mock_cfnresponse_send.call_args
+    assert status == cfnresponse.SUCCESS
+    assert context.mock_cur.describe_report_definitions.call_count == 3
+    assert output['MasterPayerBillingBucketName'] == SECOND_LOCAL_BUCKET_NAME
+    assert output['MasterPayerBillingBucketPath'] == 'cz/second-cur'
+    assert output['BillingReportFormat'] == 'aws'
+    assert output['MasterPayerBillingBucketArns'] == ','.join([
+        f'arn:aws:s3:::{SECOND_LOCAL_BUCKET_NAME}',
+        f'arn:aws:s3:::{SECOND_LOCAL_BUCKET_NAME}/*',
+        f'arn:aws:s3:::{LOCAL_BUCKET_NAME}',
+        f'arn:aws:s3:::{LOCAL_BUCKET_NAME}/*',
+    ])
+
+
+@pytest.mark.unit
+def test_coeffects_cur_reads_every_page(context):
+    context.mock_cur.describe_report_definitions.side_effect = paged_report_definitions(
+        [MINIMUM_CSV_REPORT], [CSV_REPORT], [PARQUET_REPORT])
+    world = app.coeffects_cur({})
+    report_definitions = world['coeffects']['cur']['report_definitions']
+    assert report_definitions == [MINIMUM_CSV_REPORT, CSV_REPORT, PARQUET_REPORT]
+    assert context.mock_cur.describe_report_definitions.call_count == 3
+    local_buckets = {LOCAL_BUCKET_NAME}
+    assert app.get_cur_bucket_if_local(local_buckets, report_definitions) == (LOCAL_BUCKET_NAME, 'reports/valid-csv-report', 'aws')
+
+
+@pytest.mark.unit
+def test_a_failed_later_page_fails_the_cur_coeffect(context):
+    describe = paged_report_definitions([CSV_REPORT], [PARQUET_REPORT])
+
+    def describe_report_definitions(NextToken=None):
+        if NextToken:
+            raise ClientError({'Error': {'Code': 'InternalError'}}, 'DescribeReportDefinitions')
+        return describe(NextToken)
+
+    context.mock_cur.describe_report_definitions.side_effect = describe_report_definitions
+    world = app.coeffects_cur({})
+    assert world['coeffects_failed'] == ['cur']
+    assert world['coeffects']['cur'] == {}
+
+
+@pytest.mark.unit
+def test_coeffects_cloudtrail_fans_out_across_regions(context, mocker, describe_trails_response_local, describe_trails_response_remote):
+    home_trail = describe_trails_response_local['trailList'][0]
+    shadow_trail = dict(home_trail, Name='shadow-copy')
+    west_trail = dict(describe_trails_response_remote['trailList'][0], HomeRegion='us-west-2')
+    responses = {
+        'us-east-1': {'trailList': [home_trail]},
+        'us-west-2': {'trailList': [shadow_trail, west_trail]},
+        'eu-west-1': {'trailList': [shadow_trail]},
+    }
+    clients = {region: mocker.Mock(**{'describe_trails.return_value': response}) for region, response in responses.items()}
+    clients['ap-south-1'] = mocker.Mock(**{'describe_trails.side_effect': Exception('region disabled')})
+    mocker.patch.object(app, 'ct', side_effect=lambda world, region_name=None: clients[region_name])
+    context.mock_ec2.describe_regions.return_value = {'Regions': [{'RegionName': r} for r in clients]}
+    mocker.patch.object(app, 'local_region', return_value='eu-west-1')
+
+    world = app.coeffects_cloudtrail({})
+    assert all(c.describe_trails.call_count == 1 for c in clients.values())
+    trails = world['coeffects']['cloudtrail']['trailsByArn']
+    assert list(trails) == [LOCAL_TRAIL_ARN, REMOTE_TRAIL_ARN]
+    assert trails[LOCAL_TRAIL_ARN]['Name'] == home_trail['Name']
+    assert trails[REMOTE_TRAIL_ARN]['HomeRegion'] == 'us-west-2'
+    assert app.get_visible_cloudtrail_arns(trails) == f'{LOCAL_TRAIL_ARN},{REMOTE_TRAIL_ARN}'
+    assert world['coeffects']['cloudtrail']['regionsFailed'] == ['ap-south-1']
+
+
+@pytest.mark.unit
+def test_a_hanging_region_leaves_the_trails_of_the_others(context, mocker, describe_trails_response_local):
+    def hang():
+        time.sleep(2)
+        return describe_trails_response_local
+
+    clients = {'us-east-1': mocker.Mock(**{'describe_trails.return_value': describe_trails_response_local}),
+               'ap-south-1': mocker.Mock(**{'describe_trails.side_effect': hang})}
+    mocker.patch.object(app, 'ct', side_effect=lambda world, region_name=None: clients[region_name])
+    mocker.patch.dict(os.environ, {'CLOUDTRAIL_REGIONS': 'us-east-1,ap-south-1'})
+    mocker.patch.object(app, 'local_region', return_value='us-east-1')
+    waits = mocker.spy(app, 'run_concurrently')
+    # One outer wait, with the deadline the region fan-out nests in
+    world = app.concurrent_coeffects({'deadline': time.monotonic() + 0.5}, app.coeffects_cloudtrail)
+    (outer, inner) = [c.args[1] for c in waits.call_args_list]
+    assert inner < outer
+    assert world['coeffects_timed_out'] == []
+    assert world['coeffects']['cloudtrail']['regionsTimedOut'] == ['ap-south-1']
+    assert list(world['coeffects']['cloudtrail']['trailsByArn']) == [LOCAL_TRAIL_ARN]
+
+
+@pytest.mark.unit
+def test_cloudtrail_regions_can_be_injected(context, mocker):
+    mocker.patch.dict(os.environ, {'CLOUDTRAIL_REGIONS': 'us-east-1, us-west-2'})
+    mocker.patch.object(app, 'local_region', return_value='us-west-2')
+    assert app.cloudtrail_regions({}) == ['us-west-2', 'us-east-1']
+    assert context.mock_ec2.describe_regions.call_count == 0
+
+
+@pytest.mark.unit
+def test_handler_builds_discovery_index_once(context, mocker, cfn_event, describe_trails_response_local, list_buckets_response, describe_report_definitions_response_local, describe_organizations_local):
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.return_value = list_buckets_response
+    spy_trail = mocker.spy(app, 'get_first_valid_trail')
+    spy_cur = mocker.spy(app, 'get_cur_bucket_if_local')
+    app.handler(cfn_event, None)
+    assert spy_trail.call_count == 1
+    assert spy_cur.call_count == 1
+    ((_, _, status, output, _), _) = context.mock_cfnresponse_send.call_args
+    assert output['IsAuditAccount'] is True
+    assert output['MasterPayerBillingBucketName'] == LOCAL_BUCKET_NAME
+
+
+@pytest.fixture()
+def snapshot_dir(tmp_path, mocker):
+    mocker.patch.dict(os.environ, {'SNAPSHOT_STORE': f'file://{tmp_path}'})
+    return tmp_path
+
+
+@pytest.fixture()
+def all_local(context, describe_trails_response_local, list_buckets_response, describe_report_definitions_response_local, describe_organizations_local):
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.return_value = list_buckets_response
+    return context
+
+
+def aws_call_count(context):
+    return sum(m.call_count for m in [context.mock_ct.describe_trails, context.mock_cur.describe_report_definitions,
+                                      context.mock_orgs.describe_organization, context.mock_s3.list_buckets])
+
+
+def sent_output(context):
+    ((_, _, _, output, _), _) = context.mock_cfnresponse_send.call_args
+    return output
+
+
+@pytest.mark.unit
+def test_handler_update_reuses_snapshot(all_local, snapshot_dir, cfn_event):
+    app.handler(cfn_event, None)
+    created = sent_output(all_local)
+    assert aws_call_count(all_local) == 4
+    assert (snapshot_dir / f'{LOCAL_ACCOUNT_ID}.json').exists()
+
+    app.handler(dict(cfn_event, RequestType='Update'), None)
+    assert aws_call_count(all_local) == 4
+    assert sent_output(all_local) == created
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('properties', [
+    {'ForceRefresh': 'true'},
+    {'SnapshotTtlSeconds': '0'},
+])
+def test_handler_update_refreshes_snapshot(all_local, snapshot_dir, cfn_event, properties):
+    app.handler(cfn_event, None)
+    time.sleep(0.01)
+    update = dict(cfn_event, RequestType='Update', ResourceProperties=dict(cfn_event['ResourceProperties'], **properties))
+    app.handler(update, None)
+    assert aws_call_count(all_local) == 8
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('properties,expected', [
+    ({'SnapshotTtlSeconds': 0}, 0),
+    ({'SnapshotTtlSeconds': '0'}, 0),
+    ({}, 3600),
+])
+def test_snapshot_ttl_from_the_event_wins_over_the_environment(mocker, cfn_event, properties, expected):
+    mocker.patch.dict(os.environ, {'SNAPSHOT_TTL_SECONDS': '3600'})
+    event = dict(cfn_event, ResourceProperties=dict(cfn_event['ResourceProperties'], **properties))
+    assert app.snapshot_ttl_seconds({'event': event}) == expected
+
+
+@pytest.mark.unit
+def test_handler_does_not_store_incomplete_snapshot(all_local, snapshot_dir, cfn_event):
+    all_local.mock_orgs.describe_organization.side_effect = Exception('throttled')
+    app.handler(cfn_event, None)
+    assert not (snapshot_dir / f'{LOCAL_ACCOUNT_ID}.json').exists()
+
+
+@pytest.mark.unit
+def test_handler_does_not_store_trails_missing_a_failed_region(all_local, mocker, snapshot_dir, cfn_event):
+    mocker.patch.dict(os.environ, {'CLOUDTRAIL_REGIONS': 'us-east-1,us-west-2'})
+    all_local.mock_ct.describe_trails.side_effect = [all_local.mock_ct.describe_trails.return_value,
+                                                     Exception('region disabled')]
+    app.handler(cfn_event, None)
+    assert not (snapshot_dir / f'{LOCAL_ACCOUNT_ID}.json').exists()
+
+
+@pytest.mark.unit
+def test_handler_emits_stage_and_coeffect_timings(context, cfn_event, capsys, describe_trails_response_local,
+                                                  list_buckets_response, describe_report_definitions_response_local,
+                                                  describe_organizations_local):
+    context.mock_ct.describe_trails.return_value = describe_trails_response_local
+    context.mock_cur.describe_report_definitions.return_value = describe_report_definitions_response_local
+    context.mock_orgs.describe_organization.return_value = describe_organizations_local
+    context.mock_s3.list_buckets.return_value = list_buckets_response
+    app.handler(cfn_event, None)
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+    assert {line['Service'] for line in lines} == {'discovery'}
+    assert {line['Stage'] for line in lines} == {
+        'stages.INPUT_SCHEMA', 'stages.cached_coeffects', 'stages.build_discovery_index',
+        'stages.discover_account_types', 'stages.OUTPUT_SCHEMA', 'stages.total',
+        'coeffects.cloudtrail', 'coeffects.s3', 'coeffects.cur', 'coeffects.data_exports', 'coeffects.organizations',
+    }
+
+
+@pytest.mark.unit
+def test_handler_emits_the_timings_of_a_failed_invocation(context, capsys):
+    app.handler({}, None)
+    stages = {json.loads(line)['Stage'] for line in capsys.readouterr().out.splitlines() if '"_aws"' in line}
+    assert stages == {'stages.INPUT_SCHEMA', 'stages.total'}
+
+
+@pytest.mark.unit
+def test_stages_share_what_they_do_not_change(cfn_event):
+    trail = {'TrailARN': 'arn:aws:cloudtrail:us-east-1:123456789012:trail/t', 'S3BucketName': 'bucket',
+             'IsMultiRegionTrail': True, 'IsOrganizationTrail': False, 'HomeRegion': 'us-east-1'}
+    world = {
+        'event': cfn_event,
+        'coeffects': {
+            'cloudtrail': {'trailsByArn': {trail['TrailARN']: trail}, 'regionsTimedOut': []},
+            's3': {'Buckets': [{'Name': 'bucket'}]},
+            'cur': {'report_definitions': []},
+            'organizations': {},
+        },
+    }
+    before = copy.deepcopy(world)
+    indexed = app.build_discovery_index(world)
+    discovered = app.OUTPUT_SCHEMA(app.discover_account_types(indexed))
+    assert world == before
+    assert discovered['coeffects'] is world['coeffects']
+    assert discovered['event'] is world['event']
+    assert discovered['index'] is indexed['index']
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src import cfnresponse
+
+
+class LambdaContext:
+    log_stream_name = 'log-stream'
+
+    def get_remaining_time_in_millis(self):
+        return 10_000
+
+
+@pytest.fixture()
+def cfn_event():
+    return {
+        'RequestId': 'request-id',
+        'ResponseURL': 'https://cfn.amazonaws.com/callback',
+        'StackId': 'stack-id',
+        'LogicalResourceId': 'DiscoveryResource',
+    }
+
+
+@pytest.fixture()
+def http(mocker):
+    return mocker.patch.object(cfnresponse, 'http')
+
+
+def trail_arns(n):
+    return ','.join(f'arn:aws:cloudtrail:us-east-1:123456789012:trail/trail-{i}' for i in range(n))
+
+
+def sent_body(http):
+    return json.loads(http.request.call_args.kwargs['body'])
+
+
+@pytest.mark.unit
+def test_small_response_is_sent_unchanged(http, cfn_event):
+    http.request.return_value = SimpleNamespace(status=200, reason='OK')
+    cfnresponse.send(cfn_event, LambdaContext(), cfnresponse.SUCCESS, {'VisibleCloudTrailArns': trail_arns(3)})
+    assert sent_body(http)['Data'] == {'VisibleCloudTrailArns': trail_arns(3)}
+    assert http.request.call_count == 1
+
+
+@pytest.mark.unit
+def test_oversized_truncatable_fields_are_truncated_on_element_boundaries(http, cfn_event):
+    http.request.return_value = SimpleNamespace(status=200, reason='OK')
+    data = {'VisibleCloudTrailArns': trail_arns(200), 'IsAuditAccount': True}
+    cfnresponse.send(cfn_event, LambdaContext(), cfnresponse.SUCCESS, data, truncatable={'VisibleCloudTrailArns'})
+    body = http.request.call_args.kwargs['body']
+    assert len(body) <= cfnresponse.MAX_RESPONSE_BYTES
+    assert json.loads(body)['Status'] == cfnresponse.SUCCESS
+    sent = json.loads(body)['Data']
+    assert sent['IsAuditAccount'] is True
+    assert sent['TruncatedFields'] == 'VisibleCloudTrailArns'
+    assert trail_arns(200).startswith(sent['VisibleCloudTrailArns'] + ',')
+    assert all(arn.startswith('arn:aws:cloudtrail:') for arn in sent['VisibleCloudTrailArns'].split(','))
+
+
+@pytest.mark.unit
+def test_nested_lists_are_truncated():
+    body = {'Data': {'data': {'discovery': {'visible_cloudtrail_arns': trail_arns(200).split(',')}}}}
+    fitted = cfnresponse.fit(body, truncatable={'data.discovery.visible_cloudtrail_arns'})
+    assert len(json.dumps(fitted)) <= cfnresponse.MAX_RESPONSE_BYTES
+    assert fitted['Data']['TruncatedFields'] == 'data.discovery.visible_cloudtrail_arns'
+
+
+@pytest.mark.unit
+def test_oversized_fields_that_are_read_fail_the_response_instead_of_being_cut(http, cfn_event):
+    http.request.return_value = SimpleNamespace(status=200, reason='OK')
+    bucket_arns = ','.join(f'arn:aws:s3:::bucket-{i},arn:aws:s3:::bucket-{i}/*' for i in range(100))
+    data = {'MasterPayerBillingBucketArns': bucket_arns, 'VisibleCloudTrailArns': trail_arns(3)}
+    cfnresponse.send(dict(cfn_event, RequestType='Create'), LambdaContext(), cfnresponse.SUCCESS, data)
+    sent = sent_body(http)
+    assert sent['Status'] == cfnresponse.FAILED
+    assert sent['Data'] == {}
+    assert 'MasterPayerBillingBucketArns' in sent['Reason']
+
+
+@pytest.mark.unit
+def test_oversized_deletes_drop_their_data_instead_of_failing(http, cfn_event):
+    http.request.return_value = SimpleNamespace(status=200, reason='OK')
+    data = {'VisibleCloudTrailArns': trail_arns(200)}
+    cfnresponse.send(dict(cfn_event, RequestType='Delete'), LambdaContext(), cfnresponse.SUCCESS, data)
+    sent = sent_body(http)
+    assert (sent['Status'], sent['Data']) == (cfnresponse.SUCCESS, {})
+
+
+@pytest.mark.unit
+def test_failed_sends_are_retried(http, cfn_event, mocker):
+    mocker.patch.object(cfnresponse.retries, 'backoff', return_value=0)
+    http.request.side_effect = [SimpleNamespace(status=503, reason='Slow Down'), SimpleNamespace(status=200, reason='OK')]
+    cfnresponse.send(cfn_event, LambdaContext(), cfnresponse.SUCCESS, {})
+    assert http.request.call_count == 2
+    assert http.request.call_args.kwargs['timeout'].read_timeout <= 10
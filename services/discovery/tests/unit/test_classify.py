@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import itertools
+
+import pytest
+from voluptuous import Invalid, Schema
+
+import src.app as app
+from src.classify import TieredClassifier, compile_schema
+from tests.unit.test_app import CSV_REPORT, MINIMUM_CSV_REPORT, PARQUET_REPORT
+
+
+TRAIL = {
+    'IsMultiRegionTrail': True,
+    'IsOrganizationTrail': True,
+    'S3BucketName': 'bucket',
+    'SnsTopicARN': 'arn:aws:sns:us-east-1:123456789012:topic',
+    'SnsTopicName': 'topic',
+    'TrailARN': 'arn:aws:cloudtrail:us-east-1:123456789012:trail/trail',
+}
+
+REPLACEMENTS = [None, 1, 0, True, False, '', 'HOURLY', 'DAILY', 'Parquet', ['RESOURCES'], ('RESOURCES',), [], {}]
+
+
+def variants(item):
+    yield item
+    yield 'not a dict'
+    for key in item:
+        yield {k: v for k, v in item.items() if k != key}
+        for replacement in REPLACEMENTS:
+            yield {**item, key: replacement}
+    for (a, b) in itertools.combinations(item, 2):
+        yield {k: v for k, v in item.items() if k not in {a, b}}
+
+
+def accepts(schema, item):
+    try:
+        schema(item)
+        return True
+    except Invalid:
+        return False
+
+
+SCHEMAS = [schema for schema, _ in app._CUR_CANDIDATE_TIERS] + [
+    app.IDEAL_CLOUDTRAIL_CONFIGURATION,
+    app.MINIMUM_CLOUDTRAIL_CONFIGURATION,
+    Schema({'a': str, 'b': int}),
+]
+ITEMS = [v for item in [CSV_REPORT, MINIMUM_CSV_REPORT, PARQUET_REPORT, TRAIL, {'a': 'x', 'b': 1}] for v in variants(item)]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('schema', SCHEMAS)
+def test_compiled_schema_agrees_with_voluptuous(schema):
+    matches = compile_schema(schema)
+    for item in ITEMS:
+        assert matches(item) == accepts(schema, item), item
+
+
+@pytest.mark.unit
+def test_rank_matches_tier_by_tier_validation():
+    schemas = [schema for schema, _ in app._CUR_CANDIDATE_TIERS]
+    classifier = TieredClassifier(schemas)
+    expected = [(t, item) for t, schema in enumerate(schemas) for item in ITEMS
+                if accepts(schema, item) and not any(accepts(s, item) for s in schemas[:t])]
+    assert classifier.rank(ITEMS) == expected
+
+
+@pytest.mark.unit
+def test_tier_explains_rejections_at_debug(caplog):
+    classifier = TieredClassifier([app.IDEAL_CLOUDTRAIL_CONFIGURATION, app.MINIMUM_CLOUDTRAIL_CONFIGURATION])
+    with caplog.at_level('DEBUG'):
+        assert classifier.tier({'TrailARN': 'arn'}) is None
+    assert len([r for r in caplog.records if 'did not match schema' in r.getMessage()]) == 2
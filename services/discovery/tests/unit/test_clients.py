@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.clients import ClientRegistry
+
+
+class FakeSession:
+    def __init__(self):
+        self.created = []
+
+    def client(self, service_name, region_name=None, config=None):
+        self.created.append(('client', service_name, region_name))
+        return object()
+
+    def resource(self, service_name, region_name=None, config=None):
+        self.created.append(('resource', service_name, region_name))
+        return object()
+
+
+@pytest.mark.unit
+def test_registry_is_lazy():
+    sessions = []
+    registry = ClientRegistry(session_factory=lambda: sessions.append(FakeSession()) or sessions[-1])
+    assert sessions == []
+    registry.client('s3')
+    assert len(sessions) == 1
+    assert sessions[0].created == [('client', 's3', None)]
+
+
+@pytest.mark.unit
+def test_registry_reuses_clients_and_records_timings():
+    session = FakeSession()
+    registry = ClientRegistry(session_factory=lambda: session)
+    assert registry.client('cur', region_name='us-east-1') is registry.client('cur', region_name='us-east-1')
+    assert registry.client('cur') is not registry.client('cur', region_name='us-east-1')
+    assert registry.resource('cloudformation') is registry.resource('cloudformation')
+    assert session.created == [
+        ('client', 'cur', 'us-east-1'),
+        ('client', 'cur', None),
+        ('resource', 'cloudformation', None),
+    ]
+    assert set(registry.timings) == {
+        ('client', 'cur', 'us-east-1'),
+        ('client', 'cur', None),
+        ('resource', 'cloudformation', None),
+    }
+    assert all(t >= 0 for t in registry.timings.values())
+
+
+@pytest.mark.unit
+def test_registry_creates_each_client_once_under_concurrency():
+    session = FakeSession()
+    registry = ClientRegistry(session_factory=lambda: session)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        clients = list(pool.map(lambda _: registry.client('organizations'), range(32)))
+    assert len({id(c) for c in clients}) == 1
+    assert session.created == [('client', 'organizations', None)]
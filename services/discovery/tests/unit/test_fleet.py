@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import io
+import json
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from src import fleet, profiling
+from src.clients import ClientRegistry
+
+
+MASTER_ACCOUNT_ID = '111111111111'
+MEMBER_ACCOUNT_ID = '222222222222'
+
+
+class FakeSession:
+    region_name = 'us-east-1'
+
+    def __init__(self, account_id, master_account_id=MASTER_ACCOUNT_ID):
+        self.clients = {
+            'cloudtrail': MagicMock(**{'describe_trails.return_value': {'trailList': []}}),
+            'ec2': MagicMock(**{'describe_regions.return_value': {'Regions': []}}),
+            's3': MagicMock(**{'list_buckets.return_value': {'Buckets': [], 'Owner': {}}}),
+            'cur': MagicMock(**{'describe_report_definitions.return_value': {'ReportDefinitions': []}}),
+            'bcm-data-exports': MagicMock(**{'list_exports.return_value': {'Exports': []}}),
+            'organizations': MagicMock(**{'describe_organization.return_value': {
+                'Organization': {'MasterAccountId': master_account_id}}}),
+        }
+
+    def client(self, service_name, region_name=None, config=None):
+        return self.clients[service_name]
+
+
+def connect(account_id):
+    return ClientRegistry(session_factory=lambda: FakeSession(account_id))
+
+
+@pytest.mark.unit
+def test_each_account_is_discovered_with_its_own_clients():
+    records = {r['AccountId']: r for r in fleet.run_fleet([MASTER_ACCOUNT_ID, MEMBER_ACCOUNT_ID], connect)}
+    assert set(records) == {MASTER_ACCOUNT_ID, MEMBER_ACCOUNT_ID}
+    assert all(r['Status'] == 'SUCCESS' for r in records.values())
+    assert records[MASTER_ACCOUNT_ID]['Output']['IsOrganizationMasterAccount'] is True
+    assert records[MEMBER_ACCOUNT_ID]['Output']['IsOrganizationMasterAccount'] is False
+
+
+@pytest.mark.unit
+def test_accounts_run_concurrently_against_their_own_deadline():
+    gate = threading.Barrier(3, timeout=5)
+
+    def slow_connect(account_id):
+        gate.wait()  # only passes once all three accounts are in flight at the same time
+        registry = connect(account_id)
+        if account_id == '3':
+            registry.session.clients['s3'].list_buckets.side_effect = lambda: threading.Event().wait(2) or {'Buckets': []}
+        return registry
+
+    records = {r['AccountId']: r for r in fleet.run_fleet(['1', '2', '3'], slow_connect, workers=3, timeout=0.5)}
+    assert records['3']['Status'] == 'SUCCESS'
+    assert records['3']['CoeffectsTimedOut'] == ['s3']
+    assert records['3']['Seconds'] < 2
+    assert records['1']['CoeffectsTimedOut'] == []
+
+
+@pytest.mark.unit
+def test_records_include_the_aws_call_profile_when_profiling():
+    def profiled_connect(account_id):
+        return ClientRegistry(session_factory=lambda: FakeSession(account_id), profiler=profiling.CallProfiler())
+
+    [profiled] = fleet.run_fleet([MEMBER_ACCOUNT_ID], profiled_connect)
+    [unprofiled] = fleet.run_fleet([MEMBER_ACCOUNT_ID], connect)
+    assert profiled['AwsCalls'] == {}  # the fake clients have no botocore events to report
+    assert 'AwsCalls' not in unprofiled
+
+
+@pytest.mark.unit
+def test_failed_account_is_reported_and_does_not_stop_the_fleet():
+    def connect_or_deny(account_id):
+        if account_id == MEMBER_ACCOUNT_ID:
+            raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'no'}}, 'AssumeRole')
+        return connect(account_id)
+
+    records = {r['AccountId']: r for r in fleet.run_fleet([MASTER_ACCOUNT_ID, MEMBER_ACCOUNT_ID], connect_or_deny)}
+    assert records[MASTER_ACCOUNT_ID]['Status'] == 'SUCCESS'
+    assert records[MEMBER_ACCOUNT_ID]['Status'] == 'FAILED'
+    assert 'AccessDenied' in records[MEMBER_ACCOUNT_ID]['Error']
+
+
+@pytest.mark.unit
+def test_organization_account_ids_follows_pages():
+    orgs = MagicMock()
+    orgs.list_accounts.side_effect = [
+        {'Accounts': [{'Id': '1', 'Status': 'ACTIVE'}, {'Id': '2', 'Status': 'SUSPENDED'}], 'NextToken': 't'},
+        {'Accounts': [{'Id': '3', 'Status': 'ACTIVE'}]},
+    ]
+    registry = MagicMock(**{'client.return_value': orgs})
+    assert fleet.organization_account_ids(registry) == ['1', '3']
+
+
+@pytest.mark.unit
+def test_main_streams_one_json_line_per_account(mocker):
+    mocker.patch.object(fleet, 'assumed_role_clients', side_effect=lambda account_id, *args: connect(account_id))
+    out = io.StringIO()
+    assert fleet.main(['--role-name', 'Auditor', '--log-level', 'INFO', MASTER_ACCOUNT_ID, MEMBER_ACCOUNT_ID, MASTER_ACCOUNT_ID],
+                      out=out) == 0
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(line['AccountId'] for line in lines) == [MASTER_ACCOUNT_ID, MEMBER_ACCOUNT_ID]
+    fleet.assumed_role_clients.assert_any_call(MEMBER_ACCOUNT_ID, 'Auditor', None, None)
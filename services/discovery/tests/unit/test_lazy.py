@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+from concurrent.futures import ThreadPoolExecutor
+import importlib.util
+import sys
+
+import pytest
+
+from src import lazy
+
+
+@pytest.fixture
+def unimported(monkeypatch):
+    # A package nothing here imports, removed again afterwards
+    monkeypatch.delitem(sys.modules, 'colorsys', raising=False)
+    yield 'colorsys'
+    sys.modules.pop('colorsys', None)
+
+
+@pytest.mark.unit
+def test_lazy_module_is_executed_on_first_attribute_access(unimported, monkeypatch):
+    monkeypatch.setenv('LAZY_IMPORTS', 'true')
+    module = lazy.module(unimported)
+    assert isinstance(module, importlib.util._LazyModule)
+    assert lazy.module(unimported) is module
+    assert module.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert not isinstance(module, importlib.util._LazyModule)
+
+
+@pytest.mark.unit
+def test_modules_are_imported_at_once_by_default(unimported, monkeypatch):
+    monkeypatch.delenv('LAZY_IMPORTS', raising=False)
+    assert not isinstance(lazy.module(unimported), importlib.util._LazyModule)
+
+
+@pytest.mark.unit
+def test_deferred_is_built_once():
+    built = []
+    deferred = lazy.Deferred(lambda: built.append(object()) or {'built': len(built)})
+    assert built == []
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert set(executor.map(lambda _: deferred.get('built'), range(32))) == {1}
+    assert len(built) == 1
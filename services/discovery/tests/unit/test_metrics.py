@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import json
+import time
+
+import pytest
+
+from src import metrics
+
+
+def slow(world):
+    time.sleep(0.01)
+    return world
+
+
+@pytest.mark.unit
+def test_timed_pipe_records_every_stage_in_order():
+    world = metrics.timed_pipe({'a': 1}, slow, metrics.named('SCHEMA', dict))
+    assert world['a'] == 1
+    assert list(world['timings']['stages']) == ['slow', 'SCHEMA', 'total']
+    assert world['timings']['stages']['slow'] >= 10
+    assert world['timings']['stages']['total'] >= world['timings']['stages']['slow']
+
+
+@pytest.mark.unit
+def test_timed_pipe_keeps_timings_recorded_by_stages():
+    world = metrics.timed_pipe({}, lambda w: metrics.record(w, 'coeffects', 's3', 1.5))
+    assert world['timings']['coeffects'] == {'s3': 1.5}
+
+
+@pytest.mark.unit
+def test_a_failing_stage_leaves_the_timings_so_far_on_its_exception():
+    def fails(world):
+        raise ValueError('boom')
+    with pytest.raises(ValueError) as raised:
+        metrics.timed_pipe({}, lambda w: metrics.record(w, 'coeffects', 's3', 1.5), slow, fails, dict)
+    timings = metrics.partial_timings(raised.value)
+    assert list(timings['stages']) == ['<lambda>', 'slow', 'fails', 'total']
+    assert timings['coeffects'] == {'s3': 1.5}
+
+
+@pytest.mark.unit
+def test_exceptions_from_elsewhere_have_no_timings():
+    assert metrics.partial_timings(ValueError('boom')) is None
+
+
+@pytest.mark.unit
+def test_emitted_lines_are_embedded_metric_format(capsys):
+    metrics.emit('svc', {'stages': {'total': 12.5}, 'effects': {'reactor': 3.0}})
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(line['Stage'], line['Duration']) for line in lines] == [('stages.total', 12.5), ('effects.reactor', 3.0)]
+    for line in lines:
+        [directive] = line['_aws']['CloudWatchMetrics']
+        assert directive['Namespace'] == metrics.NAMESPACE
+        assert all(dimension in line for dimension in directive['Dimensions'][0])
+        assert all(metric['Name'] in line for metric in directive['Metrics'])
+        assert isinstance(line['_aws']['Timestamp'], int)
+
+
+@pytest.mark.unit
+def test_nothing_is_emitted_without_timings(capsys):
+    metrics.emit('svc', None)
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import time
+from types import SimpleNamespace
+
+import pytest
+import urllib3
+
+from src import retries
+
+
+class FakeHttp:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(kwargs)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(status=outcome, data=b'')
+
+
+def later(seconds=30):
+    return time.monotonic() + seconds
+
+
+@pytest.mark.unit
+def test_retries_throttling_server_errors_and_connection_errors():
+    http = FakeHttp(429, urllib3.exceptions.NewConnectionError(None, 'refused'), 503, 200)
+    sleeps = []
+    response, attempts = retries.request(http, 'POST', 'url', later(), sleep=sleeps.append, body=b'{}')
+    assert response.status == 200
+    assert [a.get('status') for a in attempts] == [429, None, 503, 200]
+    assert 'NewConnectionError' in attempts[1]['error']
+    assert len(sleeps) == 3
+    assert all(call['retries'] is False and call['body'] == b'{}' for call in http.calls)
+
+
+@pytest.mark.unit
+def test_client_errors_are_not_retried():
+    response, attempts = retries.request(FakeHttp(400), 'POST', 'url', later(), sleep=lambda _: None)
+    assert response.status == 400
+    assert len(attempts) == 1
+
+
+@pytest.mark.unit
+def test_gives_up_after_max_attempts():
+    http = FakeHttp(*[500] * retries.MAX_ATTEMPTS)
+    response, attempts = retries.request(http, 'POST', 'url', later(), sleep=lambda _: None)
+    assert response.status == 500
+    assert len(attempts) == retries.MAX_ATTEMPTS
+
+
+@pytest.mark.unit
+def test_timeouts_and_retries_stay_within_the_deadline():
+    http = FakeHttp(503, 503, 503)
+    deadline_at = later(0.1)
+    response, attempts = retries.request(http, 'POST', 'url', deadline_at, sleep=time.sleep)
+    assert time.monotonic() <= deadline_at + 0.05
+    assert http.calls[0]['timeout'].total <= 0.1
+    assert http.calls[0]['timeout'].connect_timeout <= 0.1
+    assert http.calls[0]['timeout'].read_timeout <= 0.1
+
+
+@pytest.mark.unit
+def test_no_attempt_once_the_deadline_has_passed():
+    assert retries.request(FakeHttp(), 'POST', 'url', time.monotonic() - 1) == (None, [])
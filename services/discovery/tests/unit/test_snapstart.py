@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import json
+import os
+
+from botocore.loaders import JSONFileLoader
+from botocore.stub import Stubber
+import pytest
+import urllib3
+
+from src import app, lazy, snapstart
+from src.clients import ClientRegistry
+
+# An operation of each preloaded client that takes no parameters
+OPERATIONS = {
+    'bcm-data-exports': 'list_exports',
+    'cloudformation': 'describe_stacks',
+    'cloudtrail': 'describe_trails',
+    'cur': 'describe_report_definitions',
+    'ec2': 'describe_regions',
+    'organizations': 'describe_organization',
+    's3': 'list_buckets',
+}
+
+
+@pytest.fixture
+def snapshot_environment(monkeypatch):
+    for key in [k for k in os.environ if k.startswith('AWS_')]:
+        monkeypatch.delenv(key)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'snapshot')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'snapshot')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_EC2_METADATA_DISABLED', 'true')
+    monkeypatch.setenv('AWS_LAMBDA_INITIALIZATION_TYPE', 'snap-start')
+
+
+@pytest.fixture
+def hooks(monkeypatch):
+    registered = {'before': [], 'after': []}
+    monkeypatch.setattr(snapstart, 'register_before_snapshot', lambda f, *args: registered['before'].append((f, args)))
+    monkeypatch.setattr(snapstart, 'register_after_restore', lambda f, *args: registered['after'].append((f, args)))
+    return registered
+
+
+@pytest.fixture
+def model_loads(monkeypatch):
+    loads = []
+    load_file = JSONFileLoader.load_file
+    monkeypatch.setattr(JSONFileLoader, 'load_file', lambda self, path: loads.append(path) or load_file(self, path))
+    return loads
+
+
+def run(hooks):
+    for f, args in hooks:
+        f(*args)
+
+
+def restored(f):
+    """f(), JSON-encoded, as run by an execution environment restored from a snapshot of this process now"""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        try:
+            result = f()
+        except BaseException as e:
+            result = {'error': repr(e)}
+        os.write(write, json.dumps(result).encode('utf-8'))
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as r:
+        result = json.loads(r.read() or 'null')
+    os.waitpid(pid, 0)
+    return result
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='restores are simulated by forking')
+def test_restored_invocations_load_no_service_models(snapshot_environment, hooks, model_loads):
+    registry = ClientRegistry()
+    pool = lazy.Deferred(lambda: urllib3.PoolManager())
+    snapstart.init(registry, app.PRELOADED_CLIENTS, pools=[pool])
+    assert model_loads
+    run(hooks['before'])
+    assert pool.reset() is None
+
+    def invoke():
+        os.environ['AWS_ACCESS_KEY_ID'] = 'restored'
+        run(hooks['after'])
+        model_loads.clear()
+        for service_name, region_name in app.PRELOADED_CLIENTS:
+            client = registry.client(service_name, region_name=region_name)
+            with Stubber(client) as stubber:
+                stubber.add_response(OPERATIONS[service_name], {})
+                getattr(client, OPERATIONS[service_name])()
+        return {'loads': model_loads, 'access_key': registry.session.get_credentials().access_key}
+
+    assert restored(invoke) == {'loads': [], 'access_key': 'restored'}
+
+
+@pytest.mark.unit
+def test_nothing_is_preloaded_on_demand(monkeypatch, hooks):
+    monkeypatch.delenv('AWS_LAMBDA_INITIALIZATION_TYPE', raising=False)
+    sessions = []
+    registry = ClientRegistry(session_factory=lambda: sessions.append(object()))
+    snapstart.init(registry, app.PRELOADED_CLIENTS)
+    assert sessions == []
+    assert [len(hooks['before']), len(hooks['after'])] == [1, 1]
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+
+from botocore.stub import Stubber
+import pytest
+
+import src.app as app
+from src import throttling
+from src.clients import ClientRegistry
+
+ORGANIZATION = {'Organization': {'Id': 'o-example', 'MasterAccountId': '111111111111'}}
+
+
+def error(code):
+    return 400, {'__type': code, 'message': code}
+
+
+THROTTLED = error('TooManyRequestsException')
+
+
+class Stub(BaseHTTPRequestHandler):
+    """Answers each AWS JSON API call with the next of `server.responses`, repeating the last one"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with self.server.lock:
+            self.server.calls += 1
+            status, body = self.server.responses[min(self.server.calls, len(self.server.responses)) - 1]
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def organizations(monkeypatch):
+    """Sets the responses of a local Organizations endpoint; returns the server, counting its calls"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    server.lock, server.calls, server.responses = threading.Lock(), 0, [(200, ORGANIZATION)]
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    for key in [k for k in os.environ if k.startswith('AWS_')]:
+        monkeypatch.delenv(key)
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ENDPOINT_URL', f'http://127.0.0.1:{server.server_address[1]}')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    # Both botocore's retries and `retrying` sleep through time.sleep; the client-side rate limiter of the
+    # adaptive mode waits on a condition instead, so the standard mode stands in for it here
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(throttling, 'RETRY_MODE', 'standard')
+
+
+def discover_organization(seconds=10.0):
+    return app.coeffects_organizations({'clients': ClientRegistry(), 'deadline': time.monotonic() + seconds})
+
+
+@pytest.mark.unit
+def test_throttled_calls_are_retried_within_the_deadline(organizations, no_backoff):
+    organizations.responses = [THROTTLED] * 4 + [(200, ORGANIZATION)]
+    world = discover_organization()
+    assert world['coeffects']['organizations'] == ORGANIZATION
+    assert 'coeffects_failed' not in world
+    assert organizations.calls == 5  # botocore's attempts, then those of `retrying`
+
+
+@pytest.mark.unit
+def test_calls_still_throttled_at_the_deadline_fail_instead_of_passing_for_no_organization(organizations,
+                                                                                           no_backoff):
+    organizations.responses = [THROTTLED]
+    world = discover_organization(seconds=0.0)
+    assert world['coeffects_failed'] == ['organizations']
+    assert organizations.calls == throttling.BOTOCORE_MAX_ATTEMPTS
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('code,failed', [
+    ('AWSOrganizationsNotInUseException', False),
+    ('AccessDeniedException', True),
+])
+def test_only_not_in_use_means_outside_any_organization(organizations, code, failed):
+    organizations.responses = [error(code)]
+    world = discover_organization()
+    assert world['coeffects']['organizations'] == app.NOT_IN_ORGANIZATION_RESPONSE
+    assert ('organizations' in world.get('coeffects_failed', [])) is failed
+    assert organizations.calls == 1
+
+
+@pytest.mark.unit
+def test_clients_take_a_token_from_their_services_bucket_before_every_call(organizations):
+    waits = []
+    bucket = throttling.TokenBucket(1.0, capacity=2, clock=lambda: 0.0, sleep=waits.append)
+    client = throttling.limit(ClientRegistry().client('organizations'), 'organizations',
+                              buckets={'organizations': bucket})
+    with Stubber(client) as stubber:
+        for _ in range(3):
+            stubber.add_response('describe_organization', ORGANIZATION)
+            client.describe_organization()
+    assert waits == [1.0]
+
+
+@pytest.mark.unit
+def test_calls_give_up_on_a_token_they_would_wait_for_past_their_deadline(organizations):
+    waits = []
+    bucket = throttling.TokenBucket(1.0, capacity=1, clock=lambda: 0.0, sleep=waits.append)
+    client = throttling.limit(ClientRegistry().client('organizations'), 'organizations',
+                              buckets={'organizations': bucket})
+    describe = throttling.retrying(client.describe_organization, time.monotonic() + 0.5)
+    with Stubber(client) as stubber:
+        for _ in range(2):
+            stubber.add_response('describe_organization', ORGANIZATION)
+        assert describe() == ORGANIZATION
+        with pytest.raises(throttling.DeadlineExceeded):
+            describe()
+    assert waits == []
+    assert bucket.acquire() == 1.0  # the refused call left its token
@@ -4,57 +4,81 @@
 
 import logging
 import json
+import os
+import time
 
-import boto3
-import urllib3
 from toolz.curried import assoc_in, get_in, keyfilter, merge, pipe, update_in
-from voluptuous import Any, Invalid, Match, Schema, ALLOW_EXTRA, REMOVE_EXTRA
+from voluptuous import Any, Invalid, Match, Optional, Schema, ALLOW_EXTRA, REMOVE_EXTRA
 
-from src import cfnresponse
+from src import cfnresponse, lazy, logs, metrics, outbox, profiling, retries, snapstart, throttling
+from src.fieldmap import (Field, Kind, Output, compile_fields, data_validators, default_outputs, nest, null_to_none,
+                          outputs_schema, string_to_bool, string_to_list)
+from src.clients import registry
+from src.concurrency import deadline, run_concurrently
+from src.validation import compiled
 
-cfn = boto3.resource('cloudformation')
-http = urllib3.PoolManager()
+urllib3 = lazy.module('urllib3')
+http = lazy.Deferred(lambda: urllib3.PoolManager())
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
+logs.configure(logger)
 
 
-DEFAULT_CFN_COEFFECT = {
-    'AuditAccount': {
-        'RoleArn': 'null',
-    },
-    'CloudTrailOwnerAccount': {
-        'SQSQueueArn': 'null',
-        'SQSQueuePolicyName': 'null'
-    },
-    'Discovery': {
-        'AuditCloudTrailBucketName': 'null',
-        'AuditCloudTrailBucketPrefix': 'null',
-        'CloudTrailSNSTopicArn': 'null',
-        'CloudTrailTrailArn': 'null',
-        'VisibleCloudTrailArns': 'null',
-        'IsAuditAccount': 'false',
-        'IsCloudTrailOwnerAccount': 'false',
-        'IsMasterPayerAccount': 'false',
-        'IsOrganizationMasterAccount': 'false',
-        'IsOrganizationTrail': 'null',
-        'IsResourceOwnerAccount': 'false',
-        'MasterPayerBillingBucketName': 'null',
-        'MasterPayerBillingBucketPath': 'null',
-        'BillingReportFormat': 'aws',
-        'RemoteCloudTrailBucket': 'true',
-    },
-    'MasterPayerAccount': {
-        'RoleArn': 'null',
-        'ReportS3Bucket': 'null',
-        'ReportS3Prefix': 'null',
-    },
-    'ResourceOwnerAccount': {
-        'RoleArn': 'null'
-    },
-    'LegacyAccount': {
-        'RoleArn': 'null'
-    }
-}
+def cfn():
+    return registry.client('cloudformation')
+
+
+# Preloaded when Lambda initializes ahead of requests, e.g. for a SnapStart snapshot
+PRELOADED_CLIENTS = [('cloudformation', None)]
+snapstart.init(registry, PRELOADED_CLIENTS, pools=[http, cfnresponse.http])
+
+
+ARN = Schema(Match(r'^arn:(?:aws|aws-cn|aws-us-gov):([a-z0-9-]+):'
+                   r'((?:[a-z0-9-]*)|global):(\d{12}|aws)*:(.+$)$'))
+STRING = Kind(str, null_to_none, str)
+ARN_STRING = Kind(ARN, null_to_none, ARN)
+BOOLEAN = Kind(Any('true', 'false'), string_to_bool, bool)
+LIST = Kind(str, string_to_list, list)  # not element by element: the lists can hold thousands of ARNs
+
+# The reactor callback's data, field by field, from the stack outputs; a new discovery field is one line here.
+FIELDS = [
+    Field(('metadata', 'billing_report_format'), [Output('Discovery', 'BillingReportFormat', 'aws')], STRING,
+          otherwise='aws'),
+    Field(('links', 'audit', 'role_arn'), [Output('AuditAccount', 'RoleArn')], ARN_STRING),
+    Field(('links', 'cloudtrail_owner', 'sqs_queue_arn'), [Output('CloudTrailOwnerAccount', 'SQSQueueArn')], ARN_STRING),
+    Field(('links', 'cloudtrail_owner', 'sqs_queue_policy_name'),
+          [Output('CloudTrailOwnerAccount', 'SQSQueuePolicyName')], STRING),
+    Field(('links', 'master_payer', 'role_arn'), [Output('MasterPayerAccount', 'RoleArn')], ARN_STRING),
+    Field(('links', 'resource_owner', 'role_arn'), [Output('ResourceOwnerAccount', 'RoleArn')], ARN_STRING),
+    Field(('links', 'legacy', 'role_arn'), [Output('LegacyAccount', 'RoleArn')], ARN_STRING),
+    Field(('discovery', 'audit_cloudtrail_bucket_name'), [Output('Discovery', 'AuditCloudTrailBucketName')], STRING),
+    Field(('discovery', 'audit_cloudtrail_bucket_prefix'), [Output('Discovery', 'AuditCloudTrailBucketPrefix')], STRING),
+    Field(('discovery', 'cloudtrail_sns_topic_arn'), [Output('Discovery', 'CloudTrailSNSTopicArn')], ARN_STRING),
+    Field(('discovery', 'cloudtrail_trail_arn'), [Output('Discovery', 'CloudTrailTrailArn')], ARN_STRING),
+    Field(('discovery', 'is_audit_account'), [Output('Discovery', 'IsAuditAccount', 'false')], BOOLEAN, nullable=False),
+    Field(('discovery', 'is_cloudtrail_owner_account'), [Output('Discovery', 'IsCloudTrailOwnerAccount', 'false')],
+          BOOLEAN, nullable=False),
+    Field(('discovery', 'is_master_payer_account'), [Output('Discovery', 'IsMasterPayerAccount', 'false')],
+          BOOLEAN, nullable=False),
+    Field(('discovery', 'is_organization_master_account'),
+          [Output('Discovery', 'IsOrganizationMasterAccount', 'false')], BOOLEAN, nullable=False),
+    Field(('discovery', 'is_organization_trail'), [Output('Discovery', 'IsOrganizationTrail')], BOOLEAN),
+    Field(('discovery', 'is_resource_owner_account'), [Output('Discovery', 'IsResourceOwnerAccount', 'false')],
+          BOOLEAN, nullable=False),
+    Field(('discovery', 'master_payer_billing_bucket_name'),
+          [Output('Discovery', 'MasterPayerBillingBucketName'), Output('MasterPayerAccount', 'ReportS3Bucket')], STRING),
+    Field(('discovery', 'master_payer_billing_bucket_path'),
+          [Output('Discovery', 'MasterPayerBillingBucketPath'), Output('MasterPayerAccount', 'ReportS3Prefix')], STRING),
+    Field(('discovery', 'remote_cloudtrail_bucket'), [Output('Discovery', 'RemoteCloudTrailBucket', 'true')],
+          BOOLEAN, nullable=False),
+    Field(('discovery', 'visible_cloudtrail_arns'), [Output('Discovery', 'VisibleCloudTrailArns')], LIST),
+]
+DEFAULT_CFN_COEFFECT = default_outputs(FIELDS)
+callback_data = compile_fields(FIELDS)
+
+# Nothing reads the attributes of the Notification resource: its Data echoes the reactor callback, which carried
+# these lists whole, so they may be cut to fit the CloudFormation response.
+ECHOED_FIELDS = frozenset(['data.discovery.visible_cloudtrail_arns'])
 
 
 #####################
@@ -62,7 +86,7 @@ DEFAULT_CFN_COEFFECT = {
 # Boundary Validation
 #
 #####################
-INPUT_SCHEMA = Schema({
+INPUT_SCHEMA = compiled(Schema({
     'event': {
         'RequestType': Any('Create', 'Delete', 'Update'),
         'ResourceProperties': {
@@ -79,110 +103,45 @@ INPUT_SCHEMA = Schema({
                 'AuditAccount': str,
                 'MasterPayerAccount': str,
                 'LegacyAccount': str,
-            }
+            },
+            # Stack outputs passed directly by the template; a stack missing here is read from its Stacks entry
+            Optional('Outputs'): {
+                Optional(key): {str: str} for key in DEFAULT_CFN_COEFFECT
+            },
         },
         'ResponseURL': str,
-        'StackId': str
-    }
-}, required=True, extra=REMOVE_EXTRA)
-
-BOOLEAN_STRING = Schema(Any('null', 'true', 'false'))
-ARN = Schema(Match(r'^arn:(?:aws|aws-cn|aws-us-gov):([a-z0-9-]+):'
-                   r'((?:[a-z0-9-]*)|global):(\d{12}|aws)*:(.+$)$'))
-NULLABLE_ARN = Schema(Any('null', ARN))
-NULLABLE_STRING = Schema(Any('null', str))
-
-CFN_COEFFECT_SCHEMA = Schema({
-    'AuditAccount': {
-        'RoleArn': NULLABLE_ARN
-    },
-    'CloudTrailOwnerAccount': {
-        'SQSQueueArn': NULLABLE_ARN,
-        'SQSQueuePolicyName': NULLABLE_STRING,
-    },
-    'Discovery': {
-        'AuditCloudTrailBucketName': NULLABLE_STRING,
-        'AuditCloudTrailBucketPrefix': NULLABLE_STRING,
-        'CloudTrailSNSTopicArn': NULLABLE_ARN,
-        'CloudTrailTrailArn': NULLABLE_ARN,
-        'VisibleCloudTrailArns': NULLABLE_STRING,
-        'IsAuditAccount': BOOLEAN_STRING,
-        'IsCloudTrailOwnerAccount': BOOLEAN_STRING,
-        'IsMasterPayerAccount': BOOLEAN_STRING,
-        'IsOrganizationMasterAccount': BOOLEAN_STRING,
-        'IsOrganizationTrail': BOOLEAN_STRING,
-        'IsResourceOwnerAccount': BOOLEAN_STRING,
-        'MasterPayerBillingBucketName': NULLABLE_STRING,
-        'MasterPayerBillingBucketPath': NULLABLE_STRING,
-        'BillingReportFormat': NULLABLE_STRING,
-        'RemoteCloudTrailBucket': BOOLEAN_STRING,
-    },
-    'MasterPayerAccount': {
-        'RoleArn': NULLABLE_ARN,
-        'ReportS3Bucket': NULLABLE_STRING,
-        'ReportS3Prefix': NULLABLE_STRING,
-    },
-    'ResourceOwnerAccount': {
-        'RoleArn': NULLABLE_ARN,
+        'StackId': str,
+        Optional('RequestId'): str,
     },
-    'LegacyAccount': {
-        'RoleArn': NULLABLE_ARN,
-    }
-}, required=True, extra=ALLOW_EXTRA)
+    Optional('deadline'): float,
+}, required=True, extra=REMOVE_EXTRA))
+
+CFN_COEFFECT_SCHEMA = compiled(outputs_schema(FIELDS))
 
 
-NONEABLE_ARN = Schema(Any(None, ARN))
-NONEABLE_BOOL = Schema(Any(None, bool))
-NONEABLE_STRING = Schema(Any(None, str))
-LINK_ROLE = Schema({'role_arn': NONEABLE_ARN})
 ACCOUNT_LINK_PROVISIONED = Schema({
-    'data': {
-        'metadata': {
-            'cloud_region': str,
-            'external_id': str,
-            'cloud_account_id': str,
-            'cz_account_name': str,
-            'reactor_id': str,
-            'reactor_callback_url': str,
-            'billing_report_format': NONEABLE_STRING,
-        },
-        'links': {
-            'audit': LINK_ROLE,
-            'cloudtrail_owner': {
-                'sqs_queue_arn': NONEABLE_ARN,
-                'sqs_queue_policy_name': NONEABLE_STRING,
-            },
-            'master_payer': LINK_ROLE,
-            'resource_owner': LINK_ROLE,
-            'legacy': LINK_ROLE,
-        },
-        'discovery': {
-            'audit_cloudtrail_bucket_name': NONEABLE_STRING,
-            'audit_cloudtrail_bucket_prefix': NONEABLE_STRING,
-            'cloudtrail_sns_topic_arn': NONEABLE_ARN,
-            'cloudtrail_trail_arn': NONEABLE_ARN,
-            'is_audit_account': bool,
-            'is_cloudtrail_owner_account': bool,
-            'is_organization_trail': NONEABLE_BOOL,
-            'is_organization_master_account': bool,
-            'is_master_payer_account': bool,
-            'is_resource_owner_account': bool,
-            'master_payer_billing_bucket_name': NONEABLE_STRING,
-            'master_payer_billing_bucket_path': NONEABLE_STRING,
-            'remote_cloudtrail_bucket': bool,
-        }
-    }
+    'data': nest([
+        (('metadata', 'cloud_region'), str),
+        (('metadata', 'external_id'), str),
+        (('metadata', 'cloud_account_id'), str),
+        (('metadata', 'cz_account_name'), str),
+        (('metadata', 'reactor_id'), str),
+        (('metadata', 'reactor_callback_url'), str),
+        *data_validators(FIELDS),
+    ]),
 }, required=True, extra=ALLOW_EXTRA)
 
-OUTPUT_SCHEMA = Schema({
+OUTPUT_SCHEMA = compiled(Schema({
     'output': ACCOUNT_LINK_PROVISIONED,
-}, required=True, extra=ALLOW_EXTRA)
+}, required=True, extra=ALLOW_EXTRA))
 
 
 request_type = get_in(['event', 'RequestType'])
 properties = get_in(['event', 'ResourceProperties'])
 stacks = get_in(['event', 'ResourceProperties', 'Stacks'])
+provided_outputs = get_in(['event', 'ResourceProperties', 'Outputs'], default={})
 reactor_callback_url = get_in(['event', 'ResourceProperties', 'ReactorCallbackUrl'])
+world_deadline = get_in(['deadline'])
 supported_metadata = {'Region', 'ExternalId', 'AccountId', 'AccountName', 'ReactorId', 'ReactorCallbackUrl'}
 callback_metadata = keyfilter(lambda x: x in supported_metadata)
 default_metadata = {
@@ -205,10 +164,12 @@ def coeffect(name):
     def d(f):
         def w(world):
             data = {}
+            started = time.perf_counter()
             try:
                 data = f(world)
             except Exception:
                 logger.warning(f'Failed to get {name} information.', exc_info=True)
+            world = metrics.record(world, 'coeffects', name, metrics.elapsed_ms(started))
             return assoc_in(world, ['coeffects', name], data)
         return w
     return d
@@ -221,12 +182,34 @@ def outputs_to_dict(outputs):
     }
 
 
+# Bounds the DescribeStacks fan-out; one worker per stack in the Stacks property.
+MAX_STACK_WORKERS = 6
+
+
+def describe_stack_outputs(key, name, deadline_at):
+    try:
+        response = throttling.retrying(cfn().describe_stacks, deadline_at)(StackName=name)
+        return outputs_to_dict(response['Stacks'][0].get('Outputs'))
+    except Exception:
+        logger.warning(f'Failed to get {key} stack outputs.', extra=logs.fields(stack=name), exc_info=True)
+        return None
+
+
 @coeffect('cloudformation')
 def coeffects_cfn(world):
-    return {
-        key: outputs_to_dict(cfn.Stack(name).outputs)
-        for key, name in stacks(world, default={}).items()
-    }
+    # Outputs passed in the resource properties are used as they are. Every other stack is fetched independently
+    # and concurrently, keeping only its Outputs; a stack that fails or is still being described at the deadline
+    # gets its defaults without invalidating the others.
+    provided = provided_outputs(world)
+    names = {key: name for key, name in stacks(world, default={}).items() if key not in provided}
+    logger.info('Reading stack outputs', extra=logs.fields(provided=sorted(provided), describing=sorted(names)))
+    deadline_at = world_deadline(world) or deadline(None)
+    calls = [(key, lambda key=key, name=name: describe_stack_outputs(key, name, deadline_at))
+             for key, name in names.items()]
+    results, timed_out = run_concurrently(calls, deadline_at, max_workers=MAX_STACK_WORKERS)
+    fetched = {key: outputs for key, outputs in results.items() if outputs is not None}
+    defaults = {key: DEFAULT_CFN_COEFFECT.get(key, {}) for key in names if key not in fetched}
+    return merge(defaults, fetched, provided)
 
 
 #####################
@@ -246,58 +229,22 @@ def validate_cfn_coeffect(world):
         return update_in(world, ['valid_cfn'],
                          lambda x: merge(x or {}, CFN_COEFFECT_SCHEMA(cfn_coeffect)))
     except Invalid:
-        logger.warning(cfn_coeffect)
-        logger.warning('CloudFormation Coeffects are not valid; using defaults', exc_info=True)
+        logger.warning('CloudFormation Coeffects are not valid; using defaults',
+                       extra=logs.fields(cfn_coeffect=cfn_coeffect), exc_info=True)
         return update_in(world, ['valid_cfn'],
                          lambda x: merge(x or {}, DEFAULT_CFN_COEFFECT))
 
 
-def null_to_none(s):
-    return None if s == 'null' else s
-
-
-def string_to_bool(s):
-    """
-    Convert String to Bool
-
-    >>> string_to_bool('True')
-    True
-
-    >>> string_to_bool('true')
-    True
-
-    >>> string_to_bool('False')
-    False
-
-    >>> string_to_bool('false')
-    False
-
-    >>> string_to_bool('null')
-
-    >>> string_to_bool(None)
-
-    >>> string_to_bool('')
-
-    """
-    if not s:
-        return None
-    return None if s.lower() == 'null' else s.lower() == 'true'
-
-
 def prepare_output(world):
     valid_cfn = get_in(['valid_cfn'], world)
     metadata = callback_metadata(properties(world))
     message_type = 'account-link-provisioned' if request_type(world) in {'Create', 'Update'} else 'account-link-deprovisioned'
-    visible_cloudtrail_arns_string = null_to_none(get_in(['Discovery', 'VisibleCloudTrailArns'], valid_cfn))
-    visible_cloudtrail_arns = visible_cloudtrail_arns_string.split(',') if visible_cloudtrail_arns_string else None
-    master_payer_billing_bucket_name = (null_to_none(get_in(['Discovery', 'MasterPayerBillingBucketName'], valid_cfn)) or
-                                        null_to_none(get_in(['MasterPayerAccount', 'ReportS3Bucket'], valid_cfn)))
-    master_payer_billing_bucket_path = (null_to_none(get_in(['Discovery', 'MasterPayerBillingBucketPath'], valid_cfn)) or
-                                        null_to_none(get_in(['MasterPayerAccount', 'ReportS3Prefix'], valid_cfn)))
+    data = callback_data(valid_cfn)
     output = {
         **default_metadata,
         'message_type': message_type,
         'data': {
+            **data,
             'metadata': {
                 'cloud_region': metadata['Region'],
                 'external_id': metadata['ExternalId'],
@@ -305,35 +252,8 @@ def prepare_output(world):
                 'cz_account_name': metadata['AccountName'],
                 'reactor_id': metadata['ReactorId'],
                 'reactor_callback_url': metadata['ReactorCallbackUrl'],
-                'billing_report_format': null_to_none(get_in(['Discovery', 'BillingReportFormat'], valid_cfn)) or 'aws',
+                **data['metadata'],
             },
-            'links': {
-                'audit': {'role_arn': null_to_none(get_in(['AuditAccount', 'RoleArn'], valid_cfn))},
-                'cloudtrail_owner': {
-                    'sqs_queue_arn': null_to_none(get_in(['CloudTrailOwnerAccount', 'SQSQueueArn'], valid_cfn)),
-                    'sqs_queue_policy_name': null_to_none(get_in(['CloudTrailOwnerAccount', 'SQSQueuePolicyName'], valid_cfn)),
-                },
-                'master_payer': {'role_arn': null_to_none(get_in(['MasterPayerAccount', 'RoleArn'], valid_cfn))},
-                'resource_owner': {'role_arn': null_to_none(get_in(['ResourceOwnerAccount', 'RoleArn'], valid_cfn))},
-                'legacy': {'role_arn': null_to_none(get_in(['LegacyAccount', 'RoleArn'], valid_cfn))},
-            },
-            'discovery': {
-                'audit_cloudtrail_bucket_name': null_to_none(get_in(['Discovery', 'AuditCloudTrailBucketName'], valid_cfn)),
-                'audit_cloudtrail_bucket_prefix': null_to_none(get_in(['Discovery', 'AuditCloudTrailBucketPrefix'], valid_cfn)),
-                'cloudtrail_sns_topic_arn': null_to_none(get_in(['Discovery', 'CloudTrailSNSTopicArn'], valid_cfn)),
-                'cloudtrail_trail_arn': null_to_none(get_in(['Discovery', 'CloudTrailTrailArn'], valid_cfn)),
-
-                'is_audit_account': string_to_bool(get_in(['Discovery', 'IsAuditAccount'], valid_cfn)),
-                'is_cloudtrail_owner_account': string_to_bool(get_in(['Discovery', 'IsCloudTrailOwnerAccount'], valid_cfn)),
-                'is_master_payer_account': string_to_bool(get_in(['Discovery', 'IsMasterPayerAccount'], valid_cfn)),
-                'is_organization_master_account': string_to_bool(get_in(['Discovery', 'IsOrganizationMasterAccount'], valid_cfn)),
-                'is_organization_trail': string_to_bool(get_in(['Discovery', 'IsOrganizationTrail'], valid_cfn)),
-                'is_resource_owner_account': string_to_bool(get_in(['Discovery', 'IsResourceOwnerAccount'], valid_cfn)),
-                'master_payer_billing_bucket_name': master_payer_billing_bucket_name,
-                'master_payer_billing_bucket_path': master_payer_billing_bucket_path,
-                'remote_cloudtrail_bucket': string_to_bool(get_in(['Discovery', 'RemoteCloudTrailBucket'], valid_cfn)),
-                'visible_cloudtrail_arns': visible_cloudtrail_arns,
-            }
         }
     }
     return update_in(world, ['output'], lambda x: merge(x or {}, output))
@@ -344,35 +264,65 @@ def prepare_output(world):
 # Effects, i.e. changes to the outside world
 #
 #####################
+def callback_outbox():
+    return outbox.outbox_from_uri(os.environ.get('OUTBOX', ''))
+
+
 def effects(world):
-    return pipe(world,
-                effects_reactor_callback)
+    # With an outbox the callback is only queued, for src.drainer to deliver; if it cannot be queued,
+    # it is sent directly as without one.
+    if callback_outbox() is None:
+        return effects_reactor_callback(world)
+    world = effects_outbox(world)
+    if get_in(['effects', 'outbox', 'queued'], world):
+        return world
+    return effects_reactor_callback(world)
 
 
 def effect(name):
     def d(f):
         def w(world):
             data = {}
+            started = time.perf_counter()
             try:
                 data = f(world)
             except Exception:
                 logger.warning(f'Failed to effect {name} change.', exc_info=True)
+            world = metrics.record(world, 'effects', name, metrics.elapsed_ms(started))
             return assoc_in(world, ['effects', name], data)
         return w
     return d
 
 
+@effect('outbox')
+def effects_outbox(world):
+    message = outbox.message(reactor_callback_url(world), get_in(['output'], world),
+                             get_in(['event', 'StackId'], world), get_in(['event', 'RequestId'], world),
+                             group=get_in(['event', 'ResourceProperties', 'AccountId'], world))
+    callback_outbox().put(message)
+    logger.info('Queued reactor callback', extra=logs.fields(id=message['id']))
+    return {'queued': True, 'id': message['id']}
+
+
 @effect('reactor')
 def effects_reactor_callback(world):
+    # Retries stop at the invocation deadline, which already keeps back the time cfnresponse.send needs.
     url = reactor_callback_url(world)
     data = get_in(['output'], world)
     data_string = json.dumps(data)
-    logger.info(f'Posting to {url} this data: {data_string}')
-    response = http.request('POST', url, body=data_string.encode('utf-8'))
-    response_text = response.data.decode('utf-8')
-    logger.info(f'response {response.status}; text {response_text}')
-    assert response.status == 200
-    return response_text
+    logger.info(f'Posting to {url}', extra=logs.verbose(data=data))
+    response, attempts = retries.request(http, 'POST', url, world_deadline(world) or deadline(None),
+                                         body=data_string.encode('utf-8'))
+    result = {
+        'status': response.status if response is not None else None,
+        'text': response.data.decode('utf-8') if response is not None else None,
+        'attempts': attempts,
+        'seconds': round(sum(a['seconds'] for a in attempts), 3),
+    }
+    result['delivered'] = result['status'] == 200
+    log = logger.info if result['delivered'] else logger.warning
+    log(f'response {result["status"]}', extra=logs.fields(**result))
+    return result
 
 
 #####################
@@ -384,16 +334,22 @@ def handler(event, context, **kwargs):
     status = cfnresponse.SUCCESS
     world = {}
     try:
-        logger.info(f'Processing event {json.dumps(event)}')
-        world = pipe({'event': event, 'kwargs': kwargs},
-                     INPUT_SCHEMA,
-                     coeffects,
-                     notify_cloudzero,
-                     effects,
-                     OUTPUT_SCHEMA)
+        logger.info('Processing event', extra=logs.fields(event=logs.event_fields(event)))
+        world = metrics.timed_pipe({'event': event, 'kwargs': kwargs, 'deadline': deadline(context)},
+                                   metrics.named('INPUT_SCHEMA', INPUT_SCHEMA),
+                                   coeffects,
+                                   notify_cloudzero,
+                                   effects,
+                                   metrics.named('OUTPUT_SCHEMA', OUTPUT_SCHEMA))
     except Exception as err:
         logger.exception(err)
+        world = assoc_in(world, ['timings'], metrics.partial_timings(err))
     finally:
+        metrics.emit('notification', world.get('timings'))
+        logger.info('Timings', extra=logs.fields(timings=world.get('timings')))
+        world = profiling.summarize(world, registry)
+        if 'aws_calls' in world:
+            logger.info('AWS calls', extra=logs.fields(aws_calls=world['aws_calls']))
         output = world.get('output')
-        logger.info(f'Sending output {output}')
-        cfnresponse.send(event, context, status, output, event.get('PhysicalResourceId'))
+        logger.info('Sending output', extra=logs.fields(output=output))
+        cfnresponse.send(event, context, status, output, event.get('PhysicalResourceId'), truncatable=ECHOED_FIELDS)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import logging
+import time
+
+logger = logging.getLogger()
+
+# Used when there is no Lambda context, e.g. unit tests or local runs.
+DEFAULT_BUDGET_SECONDS = 25.0
+# Time kept back from the Lambda deadline so cfnresponse.send can always run.
+RESERVED_SECONDS = 3.0
+# Time kept back from a wait's deadline by the work nested in it, so that it returns before the wait gives up.
+INNER_MARGIN_SECONDS = 1.0
+
+
+def deadline(context, reserved=RESERVED_SECONDS):
+    """
+    Absolute `time.monotonic()` deadline for work done on behalf of this invocation
+
+    >>> deadline(None) - time.monotonic() <= DEFAULT_BUDGET_SECONDS
+    True
+    """
+    if context is None:
+        budget = DEFAULT_BUDGET_SECONDS
+    else:
+        budget = context.get_remaining_time_in_millis() / 1000.0 - reserved
+    return time.monotonic() + max(budget, 0.0)
+
+
+def remaining(deadline_at):
+    """
+    Seconds left before `deadline_at`, never negative
+
+    >>> remaining(time.monotonic() - 1)
+    0.0
+    """
+    return max(deadline_at - time.monotonic(), 0.0)
+
+
+def inner_deadline(deadline_at, margin=INNER_MARGIN_SECONDS):
+    """
+    The deadline of work nested in a wait on `deadline_at`, like a coeffect's own fan-out: `margin` seconds
+    earlier, or a quarter of the time left when that is less, so that the work returns its partial result
+    before the outer wait gives up on it
+
+    >>> outer = time.monotonic() + 10
+    >>> round(outer - inner_deadline(outer), 6)
+    1.0
+    >>> soon = time.monotonic() + 1
+    >>> 0.2 < soon - inner_deadline(soon) <= 0.25
+    True
+    """
+    return deadline_at - min(margin, remaining(deadline_at) / 4)
+
+
+def run_concurrently(calls, deadline_at, max_workers=None):
+    """
+    Run each `(name, thunk)` pair on its own thread and wait for all of them until `deadline_at`.
+
+    Returns `(results, timed_out)`, where `results` maps each finished name to its value and
+    `timed_out` lists the names still running at the deadline. Stragglers are abandoned, not
+    joined, so a slow call can never push the caller past its deadline.
+    """
+    calls = list(calls)
+    if not calls:
+        return {}, []
+    pool = ThreadPoolExecutor(max_workers=max_workers or len(calls))
+    try:
+        futures = {pool.submit(thunk): name for name, thunk in calls}
+        done, not_done = wait(futures, timeout=remaining(deadline_at))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    timed_out = sorted(futures[f] for f in not_done)
+    if timed_out:
+        logger.warning(f'Timed out waiting for {timed_out}')
+    return {futures[f]: f.result() for f in done}, timed_out
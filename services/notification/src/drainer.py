@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Delivers the reactor callbacks queued in the outbox by `src.app.effects_outbox`.
+
+Runs as the handler of the outbox queue's event source, reporting undelivered messages as batch item
+failures so SQS retries only those (and dead-letters them after the queue's maxReceiveCount), or locally
+over a FileOutbox with `drain`.
+
+The queue is FIFO with a message group per account, so that the reactor learns of an account's Create before
+its Delete: each group is delivered in order, and its first undelivered record is reported together with
+every later record of the group, as SQS requires of FIFO batches. Groups are delivered concurrently.
+
+Delivery is at least once. A message is redelivered when it failed, or when its invocation failed after
+delivering it; the container only remembers what it delivered itself, so that memory is a best-effort
+shortcut, not exactly-once delivery.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import threading
+
+from src import lazy, logs, retries
+from src.concurrency import deadline, remaining, run_concurrently
+
+urllib3 = lazy.module('urllib3')
+http = lazy.Deferred(lambda: urllib3.PoolManager())
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+logs.configure(logger)
+
+MAX_DELIVERY_WORKERS = 10
+# IDs of messages this container already delivered, best effort: SQS delivers at least once, so a message can
+# return, but possibly to another container.
+MAX_REMEMBERED_DELIVERIES = 4096
+_delivered = OrderedDict()
+_delivered_lock = threading.Lock()
+
+
+def remember(message_id):
+    with _delivered_lock:
+        _delivered[message_id] = True
+        _delivered.move_to_end(message_id)
+        while len(_delivered) > MAX_REMEMBERED_DELIVERIES:
+            _delivered.popitem(last=False)
+
+
+def already_delivered(message_id):
+    with _delivered_lock:
+        return message_id in _delivered
+
+
+def deliver(message, deadline_at):
+    response, attempts = retries.request(http, 'POST', message['url'], deadline_at,
+                                         body=json.dumps(message['output']).encode('utf-8'))
+    delivered = response is not None and response.status == 200
+    log = logger.info if delivered else logger.warning
+    log('Delivered queued callback' if delivered else 'Failed to deliver queued callback',
+        extra=logs.fields(id=message['id'], url=message['url'], attempts=attempts))
+    if delivered:
+        remember(message['id'])
+    return delivered
+
+
+def group_of(record, message):
+    """The FIFO message group of `record`; every record of a standard queue is its own group"""
+    group = record.get('attributes', {}).get('MessageGroupId')
+    if group is None and message is not None:
+        group = message.get('group')
+    return group if group is not None else f"record:{record['messageId']}"
+
+
+def deliver_group(entries, delivered, deadline_at):
+    """
+    Delivers the `(message, messageId)` entries of one group in order, adding the messageId of each delivered
+    (or already delivered) one to `delivered`, and stops at the first one that fails, is unreadable (None),
+    or has no time left
+    """
+    for message, message_id in entries:
+        if message is None or remaining(deadline_at) <= 0:
+            return
+        if not (already_delivered(message['id']) or deliver(message, deadline_at)):
+            return
+        delivered.append(message_id)
+
+
+def deliver_records(records, deadline_at):
+    """
+    messageIds of the `records` that were not delivered: in each group, the first one that failed or timed out,
+    and every later one
+    """
+    groups = OrderedDict()
+    for record in records:
+        try:
+            message = json.loads(record['body'])
+            if 'id' not in message:
+                raise KeyError('id')
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Unreadable outbox message', extra=logs.fields(record=record), exc_info=True)
+            message = None
+        groups.setdefault(group_of(record, message), []).append((message, record['messageId']))
+    delivered = {group: [] for group in groups}
+    _, timed_out = run_concurrently([(group, lambda entries=entries, done=delivered[group]:
+                                      deliver_group(entries, done, deadline_at))
+                                     for group, entries in groups.items()],
+                                    deadline_at, max_workers=MAX_DELIVERY_WORKERS)
+    # A group's delivered records are a prefix of it, so everything after that prefix is failed
+    failed = [message_id for group, entries in groups.items()
+              for _, message_id in entries[len(delivered[group]):]]
+    logger.info('Drained outbox batch', extra=logs.fields(records=len(records), groups=len(groups),
+                                                          timed_out=len(timed_out), failed=len(failed)))
+    return failed
+
+
+def drain(outbox, deadline_at=None, max_messages=10):
+    """Deliver up to `max_messages` from a FileOutbox, deleting the delivered ones; returns the undelivered IDs"""
+    records = outbox.receive(max_messages)
+    failed = deliver_records(records, deadline_at or deadline(None))
+    for record in records:
+        if record['messageId'] not in failed:
+            outbox.delete(record['messageId'])
+    return failed
+
+
+def handler(event, context, **kwargs):
+    failed = deliver_records(event.get('Records', []), deadline(context))
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Declarative map from the stack outputs to the data of the reactor callback.
+
+Each Field names where a value goes in the callback's data, the stack outputs it is read from and the
+Kind of value it is. Everything that used to repeat the field list is compiled from the one table, once,
+at import: the default outputs, the schema of the outputs, the schema of the data and the function that
+builds the data.
+"""
+
+from collections import namedtuple
+
+from voluptuous import Any, Schema, ALLOW_EXTRA
+
+# A stack output: CloudFormation hands every output over as a string, 'null' standing for no value
+Output = namedtuple('Output', ['stack', 'key', 'default'], defaults=['null'])
+# How an output's string is checked, converted, and what the converted value must then be
+Kind = namedtuple('Kind', ['valid', 'convert', 'converted'])
+# One value of the callback's data, taken from the first of its `sources` that has one, else `otherwise`
+Field = namedtuple('Field', ['path', 'sources', 'kind', 'nullable', 'otherwise'], defaults=[True, None])
+
+
+def null_to_none(s):
+    return None if s == 'null' else s
+
+
+def string_to_bool(s):
+    """
+    Convert String to Bool
+
+    >>> string_to_bool('True')
+    True
+
+    >>> string_to_bool('true')
+    True
+
+    >>> string_to_bool('False')
+    False
+
+    >>> string_to_bool('false')
+    False
+
+    >>> string_to_bool('null')
+
+    >>> string_to_bool(None)
+
+    >>> string_to_bool('')
+
+    """
+    if not s:
+        return None
+    return None if s.lower() == 'null' else s.lower() == 'true'
+
+
+def string_to_list(s):
+    """
+    >>> string_to_list('a,b'), string_to_list('null'), string_to_list('')
+    (['a', 'b'], None, None)
+    """
+    s = null_to_none(s)
+    return s.split(',') if s else None
+
+
+def nest(pairs):
+    """
+    Nested dicts from `(path, value)` pairs
+
+    >>> nest([(('a', 'b'), 1), (('a', 'c'), 2), (('d',), 3)])
+    {'a': {'b': 1, 'c': 2}, 'd': 3}
+    """
+    nested = {}
+    for path, value in pairs:
+        level = nested
+        for key in path[:-1]:
+            level = level.setdefault(key, {})
+        level[path[-1]] = value
+    return nested
+
+
+def outputs(fields):
+    """Every stack output read by `fields`, once each, in order"""
+    return list({(o.stack, o.key): o for field in fields for o in field.sources}.values())
+
+
+def default_outputs(fields):
+    """
+    The stack outputs of a stack that could not be read
+
+    >>> default_outputs([Field(('a',), [Output('Stack', 'A'), Output('Stack', 'B', 'false')], None)])
+    {'Stack': {'A': 'null', 'B': 'false'}}
+    """
+    return nest(((o.stack, o.key), o.default) for o in outputs(fields))
+
+
+def outputs_schema(fields):
+    kinds = {(o.stack, o.key): field.kind for field in fields for o in field.sources}
+    return Schema(nest((key, Schema(Any('null', kind.valid))) for key, kind in kinds.items()),
+                  required=True, extra=ALLOW_EXTRA)
+
+
+def data_validators(fields):
+    """`(path, validator)` of the converted value of each of `fields`, for a schema of the callback's data"""
+    return [(field.path, Any(None, field.kind.converted) if field.nullable else field.kind.converted)
+            for field in fields]
+
+
+def _accessor(field):
+    # Resolved once, here, rather than on every call: the (stack, key, convert) of each source and the fallback
+    sources = [(o.stack, o.key, field.kind.convert) for o in field.sources]
+    if field.otherwise is not None:
+        sources.append((None, None, lambda _: field.otherwise))
+    *alternatives, (last_stack, last_key, last_convert) = sources
+
+    def value(outputs):
+        # `a or b or ...`: the first truthy value, else the last one as it is
+        for stack, key, convert in alternatives:
+            converted = convert(outputs.get(stack, {}).get(key))
+            if converted:
+                return converted
+        return last_convert(outputs.get(last_stack, {}).get(last_key))
+    return value
+
+
+def _builder(tree):
+    children = [(key, _builder(child) if isinstance(child, dict) else child) for key, child in tree.items()]
+
+    def build(outputs):
+        return {key: child(outputs) for key, child in children}
+    return build
+
+
+def compile_fields(fields):
+    """
+    A function from the validated stack outputs to the callback's data
+
+    >>> STRING = Kind(str, null_to_none, str)
+    >>> data = compile_fields([Field(('links', 'name'), [Output('A', 'Name'), Output('B', 'Name')], STRING),
+    ...                        Field(('format',), [Output('A', 'Format')], STRING, otherwise='aws')])
+    >>> data({'A': {'Name': 'null', 'Format': 'null'}, 'B': {'Name': 'b'}})
+    {'links': {'name': 'b'}, 'format': 'aws'}
+    """
+    return _builder(nest((field.path, _accessor(field)) for field in fields))
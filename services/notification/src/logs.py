@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import json
+import logging
+import os
+import random
+from urllib.parse import urlsplit
+
+# Longest serialized value kept for a single field; longer values are replaced by a truncated preview.
+MAX_FIELD_CHARS = int(os.environ.get('LOG_MAX_FIELD_CHARS', '2048'))
+# Fraction of verbose records (see `verbose`) that are emitted.
+VERBOSE_SAMPLE_RATE = float(os.environ.get('LOG_VERBOSE_SAMPLE_RATE', '1.0'))
+
+
+def fields(**kwargs):
+    """`extra=` for a structured record; values are serialized only if the record is emitted"""
+    return {'fields': kwargs}
+
+
+def without_query(url):
+    """
+    `url` without its query string, which holds the signature of a pre-signed URL
+
+    >>> without_query('https://cfn.amazonaws.com/arn%3Aaws/request?X-Amz-Signature=secret')
+    'https://cfn.amazonaws.com/arn%3Aaws/request'
+    """
+    return urlsplit(url)._replace(query='', fragment='').geturl()
+
+
+def event_fields(event):
+    """`event` as it may be logged: only the host and path of a custom resource's pre-signed ResponseURL"""
+    if isinstance(event, dict) and isinstance(event.get('ResponseURL'), str):
+        return {**event, 'ResponseURL': without_query(event['ResponseURL'])}
+    return event
+
+
+def verbose(**kwargs):
+    """`extra=` for a structured record that is subject to sampling"""
+    return {'fields': kwargs, 'verbose': True}
+
+
+def cap(value, limit=None):
+    """
+    Value as it should appear in a JSON log line, truncated when its serialized form exceeds `limit` characters
+
+    >>> cap(['a', 'b'])
+    ['a', 'b']
+    >>> cap('x' * 10, limit=4)
+    {'truncated': True, 'length': 12, 'preview': '"xxx'}
+    """
+    limit = MAX_FIELD_CHARS if limit is None else limit
+    encoded = json.dumps(value, default=str)
+    if len(encoded) <= limit:
+        return json.loads(encoded)
+    return {'truncated': True, 'length': len(encoded), 'preview': encoded[:limit]}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        document = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+        }
+        request_id = getattr(record, 'aws_request_id', None)
+        if request_id:
+            document['aws_request_id'] = request_id
+        for key, value in getattr(record, 'fields', {}).items():
+            document[key] = cap(value)
+        if record.exc_info:
+            document['exception'] = cap(self.formatException(record.exc_info))
+        return json.dumps(document, default=str)
+
+
+class VerboseSampler(logging.Filter):
+    def __init__(self, rate=None):
+        super().__init__()
+        self.rate = VERBOSE_SAMPLE_RATE if rate is None else rate
+
+    def filter(self, record):
+        return not getattr(record, 'verbose', False) or random.random() < self.rate
+
+
+def configure(logger):
+    """Install the JSON formatter and sampler on the handlers of `logger` (in Lambda, the runtime's handler)"""
+    for handler in logger.handlers:
+        handler.setFormatter(JsonFormatter())
+        if not any(isinstance(f, VerboseSampler) for f in handler.filters):
+            handler.addFilter(VerboseSampler())
+    return logger
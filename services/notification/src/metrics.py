@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import json
+import os
+import time
+
+from toolz.curried import assoc_in, get_in, merge
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CloudZero/ProvisionAccount')
+
+
+def elapsed_ms(started):
+    """Milliseconds since `started`, a `time.perf_counter()` reading"""
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def named(name, f):
+    """
+    `f` under the stage name `name`; for stages without a useful `__name__`, such as schemas
+
+    >>> stage_name(named('INPUT_SCHEMA', dict))
+    'INPUT_SCHEMA'
+    """
+    def stage(world):
+        return f(world)
+    stage.__name__ = name
+    return stage
+
+
+def stage_name(f):
+    return getattr(f, '__name__', None) or type(f).__name__
+
+
+def record(world, kind, name, ms):
+    """`world` with `ms` recorded as the duration of the `kind` (stages, coeffects, effects) called `name`"""
+    return assoc_in(world, ['timings', kind, name], ms)
+
+
+def with_stages(world, timings):
+    return assoc_in(world, ['timings', 'stages'], merge(get_in(['timings', 'stages'], world, default={}), timings))
+
+
+def timed_pipe(world, *stages):
+    """
+    `pipe(world, *stages)` that records each stage's duration, and the total, in world['timings']
+
+    When a stage raises, the exception carries the timings recorded until then, the failing stage's included,
+    as `partial_timings(err)`.
+
+    >>> sorted(timed_pipe({}, named('a', dict), named('b', dict))['timings']['stages'])
+    ['a', 'b', 'total']
+    """
+    started = time.perf_counter()
+    timings = {}
+    try:
+        for f in stages:
+            stage_started = time.perf_counter()
+            try:
+                world = f(world)
+            finally:
+                timings[stage_name(f)] = elapsed_ms(stage_started)
+    except Exception as err:
+        timings['total'] = elapsed_ms(started)
+        err.timings = with_stages(world, timings)['timings']
+        raise
+    timings['total'] = elapsed_ms(started)
+    return with_stages(world, timings)
+
+
+def partial_timings(err):
+    """
+    The timings `timed_pipe` recorded before `err` was raised out of it, or None
+
+    >>> try:
+    ...     timed_pipe({}, named('fails', lambda world: 1 / 0))
+    ... except ZeroDivisionError as err:
+    ...     sorted(partial_timings(err)['stages'])
+    ['fails', 'total']
+    """
+    return getattr(err, 'timings', None)
+
+
+def emf_lines(service, timings, timestamp=None):
+    """
+    CloudWatch Embedded Metric Format documents, one per timed stage, coeffect or effect
+
+    >>> [line['Stage'] for line in emf_lines('discovery', {'stages': {'total': 1.0}, 'coeffects': {'s3': 2.0}})]
+    ['stages.total', 'coeffects.s3']
+    """
+    timestamp = int(time.time() * 1000) if timestamp is None else timestamp
+    lines = []
+    for kind, durations in timings.items():
+        for name, ms in durations.items():
+            lines.append({
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': [['Service', 'Stage']],
+                        'Metrics': [{'Name': 'Duration', 'Unit': 'Milliseconds'}],
+                    }],
+                },
+                'Service': service,
+                'Stage': f'{kind}.{name}',
+                'Duration': ms,
+            })
+    return lines
+
+
+def emit(service, timings, write=print):
+    """Write the EMF documents for `timings` to stdout, where the Lambda runtime hands them to CloudWatch"""
+    for line in emf_lines(service, timings or {}):
+        write(json.dumps(line))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import hashlib
+import json
+import os
+
+from src.clients import registry
+
+
+def message_id(stack_id, request_id, output):
+    """
+    Deduplication key of a callback; the same CloudFormation request always produces the same key
+
+    >>> message_id('stack', 'request', {}) == message_id('stack', 'request', {'a': 1})
+    True
+    """
+    source = f'{stack_id}:{request_id}' if request_id else json.dumps(output, sort_keys=True)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def message(url, output, stack_id, request_id=None, group=None):
+    return {
+        'id': message_id(stack_id, request_id, output),
+        'group': group or 'default',
+        'url': url,
+        'output': output,
+    }
+
+
+class FileOutbox:
+    """Messages as files in a local directory; the stand-in for SQS in tests and local runs"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, message_id):
+        return os.path.join(self.directory, f'{message_id}.json')
+
+    def put(self, message):
+        # Written under a temporary name and renamed, so a reader never sees a partial message;
+        # putting a message again replaces it, which deduplicates.
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self._path(message['id']) + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(json.dumps(message))
+        os.replace(temporary, self._path(message['id']))
+
+    def receive(self, max_messages=10):
+        """Pending messages, oldest first, shaped like the Records of an SQS event"""
+        names = [n for n in os.listdir(self.directory) if n.endswith('.json')] if os.path.isdir(self.directory) else []
+        names = sorted(names, key=lambda n: os.path.getmtime(os.path.join(self.directory, n)))[:max_messages]
+        records = []
+        for name in names:
+            with open(os.path.join(self.directory, name)) as f:
+                records.append({'messageId': name[:-len('.json')], 'body': f.read()})
+        return records
+
+    def delete(self, message_id):
+        try:
+            os.remove(self._path(message_id))
+        except FileNotFoundError:
+            pass
+
+
+class SqsOutbox:
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+
+    def put(self, message):
+        kwargs = {}
+        if self.queue_url.endswith('.fifo'):
+            # SQS drops a message whose deduplication ID was already sent in the last five minutes
+            kwargs = {'MessageGroupId': message['group'], 'MessageDeduplicationId': message['id']}
+        registry.client('sqs').send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message), **kwargs)
+
+
+def outbox_from_uri(uri):
+    """
+    Outbox for an SQS queue URL or `file:///directory`; None (callbacks are sent directly) when empty
+
+    >>> outbox_from_uri('https://sqs.us-east-1.amazonaws.com/123456789012/outbox.fifo').queue_url[-5:]
+    '.fifo'
+    >>> outbox_from_uri('') is None
+    True
+    """
+    if not uri:
+        return None
+    if uri.startswith('https://'):
+        return SqsOutbox(uri)
+    if uri.startswith('file://'):
+        return FileOutbox(uri[len('file://'):])
+    raise ValueError(f'Unsupported outbox {uri}')
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Init for Lambda SnapStart and provisioned concurrency.
+
+When Lambda initializes ahead of any request (AWS_LAMBDA_INITIALIZATION_TYPE is snap-start or
+provisioned-concurrency), `init` creates the clients the handler uses, which loads their service models,
+endpoint rulesets and partitions, and its connection pools, which imports urllib3 even in lazy-import
+mode. A SnapStart snapshot taken afterwards then contains all of it.
+
+What must not be shared between the execution environments restored from one snapshot is dropped around
+it: connection pools before the snapshot, and after each restore the clients' sessions, whose credentials
+are the snapshot's, and the random state the retry jitter draws from. The hooks are registered through
+the runtime's snapshot_restore_py, which does not exist outside Lambda.
+"""
+
+import logging
+import os
+import random
+import time
+
+from src.logs import fields
+
+try:
+    from snapshot_restore_py import register_after_restore, register_before_snapshot
+except ImportError:  # outside the Lambda runtime
+    register_after_restore = register_before_snapshot = None
+
+logger = logging.getLogger()
+AHEAD_OF_REQUESTS = frozenset(['snap-start', 'provisioned-concurrency'])
+
+
+def ahead_of_requests(environ=os.environ):
+    """
+    Whether this init happens before, rather than on behalf of, a request
+
+    >>> ahead_of_requests({'AWS_LAMBDA_INITIALIZATION_TYPE': 'snap-start'}), ahead_of_requests({})
+    (True, False)
+    """
+    return environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') in AHEAD_OF_REQUESTS
+
+
+def warm(registry, clients):
+    """Creates each `(service_name, region_name)` of `clients` in `registry`; returns how long it took"""
+    started = time.perf_counter()
+    for service_name, region_name in clients:
+        try:
+            registry.client(service_name, region_name=region_name)
+        except Exception:
+            logger.warning(f'Failed to preload {service_name}', exc_info=True)
+    seconds = time.perf_counter() - started
+    logger.info('Preloaded clients', extra=fields(clients=[name for name, _ in clients], seconds=seconds))
+    return seconds
+
+
+def close_pools(pools):
+    """Drops every lazy.Deferred connection pool of `pools`, closing its connections"""
+    for pool in pools:
+        closed = pool.reset()
+        if closed is not None:
+            closed.clear()
+
+
+def before_snapshot(pools):
+    close_pools(pools)
+
+
+def after_restore(registry, pools):
+    registry.reset()
+    close_pools(pools)
+    random.seed()
+
+
+def init(registry, clients, pools=()):
+    """
+    Warms `registry` with `clients` when initializing ahead of requests, and registers the snapshot hooks
+
+    `pools` are the lazy.Deferred connection pools of the handler's module.
+    """
+    if ahead_of_requests(os.environ):
+        warm(registry, clients)
+        for pool in pools:
+            pool.clear()  # builds it, and closes no connection since it has none yet
+    if register_before_snapshot is not None:
+        register_before_snapshot(before_snapshot, pools)
+        register_after_restore(after_restore, registry, pools)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Throttle-aware AWS API calls.
+
+Three layers keep a throttled call from turning into a wrong answer:
+
+- every client a ClientRegistry creates uses botocore's adaptive retry mode, which retries throttled
+  attempts and slows the client down to the rate it is allowed;
+- services with a rate in RATES_PER_SECOND (or API_RATE_LIMITS, e.g. `organizations=5,cur=2`) share one
+  client-side token bucket per process, across regions, clients and, in src.fleet, accounts, which adaptive
+  mode cannot do: it only slows down the one client that was throttled, after the fact. A call made through
+  `retrying` gives up with DeadlineExceeded rather than wait for a token past its deadline;
+- `retrying` retries a call botocore gave up on while it is throttled, for as long as the caller's
+  deadline allows, and then raises; any other error is raised at once.
+
+`throttled` tells a throttling error from a real one, so that callers only fall back on the latter.
+"""
+
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+
+from src.concurrency import remaining
+from src.logs import fields
+from src.retries import backoff
+
+logger = logging.getLogger()
+
+# Error codes botocore's retry handlers treat as throttling
+THROTTLING_CODES = frozenset([
+    'BandwidthLimitExceeded',
+    'EC2ThrottledException',
+    'LimitExceededException',
+    'PriorRequestNotComplete',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'SlowDown',
+    'ThrottledException',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'TransactionInProgressException',
+])
+RETRY_MODE = 'adaptive'
+# Attempts botocore makes of each call, the first included, before `retrying` takes over
+BOTOCORE_MAX_ATTEMPTS = 3
+# Conservative client-side rates, in calls per second, of the services that throttle when discovery runs
+# in many accounts at once
+RATES_PER_SECOND = {'organizations': 5.0, 'cur': 2.0}
+MAX_THROTTLED_ATTEMPTS = 8
+BASE_DELAY_SECONDS = 0.5
+MAX_DELAY_SECONDS = 8.0
+
+# The deadline of the `retrying` call in progress on each thread, for the token buckets its attempts wait on
+_deadline = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """Waiting for a token would take a call past its deadline"""
+
+
+def client_config():
+    """The botocore Config of every client: adaptive retries"""
+    # Imported here, when the first client is created, not to defeat the lazy import of botocore
+    from botocore.config import Config
+    return Config(retries={'mode': RETRY_MODE, 'total_max_attempts': BOTOCORE_MAX_ATTEMPTS})
+
+
+def events(client):
+    """The event emitter of a boto3 client or resource; None for anything else, like test doubles"""
+    meta = getattr(client, 'meta', None)
+    if hasattr(meta, 'events'):
+        return meta.events
+    if hasattr(getattr(meta, 'client', None), 'meta'):
+        return meta.client.meta.events
+    return None
+
+
+def error_code(err):
+    """The AWS error code of a botocore ClientError; None for any other exception"""
+    response = getattr(err, 'response', None)
+    return response.get('Error', {}).get('Code') if isinstance(response, dict) else None
+
+
+def throttled(err):
+    """
+    Whether `err` is AWS throttling the call rather than rejecting it
+
+    >>> class ClientError(Exception):
+    ...     def __init__(self, code, status=400):
+    ...         self.response = {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+    >>> throttled(ClientError('TooManyRequestsException')), throttled(ClientError('Unknown', 429))
+    (True, True)
+    >>> throttled(ClientError('AccessDeniedException')), throttled(ValueError())
+    (False, False)
+    """
+    code = error_code(err)
+    if code is None:
+        return False
+    return code in THROTTLING_CODES or err.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 429
+
+
+def rates(value):
+    """
+    `{service: calls per second}` of an API_RATE_LIMITS value, over RATES_PER_SECOND
+
+    >>> rates('organizations=1, sts=10')
+    {'organizations': 1.0, 'cur': 2.0, 'sts': 10.0}
+    """
+    configured = dict(pair.split('=', 1) for pair in value.replace(' ', '').split(',') if '=' in pair)
+    return {**RATES_PER_SECOND, **{service: float(rate) for service, rate in configured.items()}}
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average, in bursts of up to `capacity` calls
+
+    A caller without a token waits for the one it is due; callers queue up in the order they asked. A caller
+    whose wait would pass its deadline is refused instead, and leaves the token to the next one.
+
+    >>> waits = []
+    >>> bucket = TokenBucket(2.0, capacity=1, clock=lambda: 0.0, sleep=waits.append)
+    >>> bucket.acquire(), bucket.acquire(), bucket.acquire(), waits
+    (0.0, 0.5, 1.0, [0.5, 1.0])
+    >>> bucket.acquire(deadline_at=time.monotonic() + 1)
+    Traceback (most recent call last):
+    ...
+    src.throttling.DeadlineExceeded: a token is 1.5s away
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline_at=None):
+        """
+        Takes a token, waiting for it if need be; returns the seconds waited, or raises DeadlineExceeded, without
+        taking the token, if they would pass `deadline_at`
+        """
+        with self._lock:
+            now = self._clock()
+            tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate) - 1
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+            if wait and deadline_at is not None and wait >= remaining(deadline_at):
+                raise DeadlineExceeded(f'a token is {wait}s away')
+            self._tokens, self._updated = tokens, now
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+BUCKETS = {service: TokenBucket(rate) for service, rate in rates(os.environ.get('API_RATE_LIMITS', '')).items()}
+
+
+def limit(client, service_name, buckets=BUCKETS):
+    """
+    `client`, made to take a token from the bucket of `service_name`, if it has one, before every call, by the
+    deadline of the `retrying` call it is made from
+    """
+    bucket = buckets.get(service_name)
+    emitter = events(client)
+    if bucket is not None and emitter is not None:
+        def take_token(**kwargs):
+            bucket.acquire(getattr(_deadline, 'at', None))
+        # before-parameter-build is the first event of a call, before any handler can end it, like the Stubber's
+        emitter.register(f'before-parameter-build.{service_name}', take_token)
+    return client
+
+
+def retrying(operation, deadline_at, max_attempts=MAX_THROTTLED_ATTEMPTS, sleep=time.sleep, rand=random.random):
+    """
+    `operation`, retried with jittered exponential backoff while it is throttled, for at most `max_attempts`
+    attempts and as long as a retry's delay leaves time before `deadline_at`
+
+    >>> calls = []
+    >>> class Throttled(Exception):
+    ...     response = {'Error': {'Code': 'Throttling'}}
+    >>> def describe(**kwargs):
+    ...     calls.append(kwargs)
+    ...     if len(calls) < 3:
+    ...         raise Throttled()
+    ...     return {'ok': True}
+    >>> retrying(describe, time.monotonic() + 60, sleep=lambda _: None)(Name='x'), len(calls)
+    ({'ok': True}, 3)
+    """
+    def call(**kwargs):
+        outer, _deadline.at = getattr(_deadline, 'at', None), deadline_at
+        try:
+            for attempt in itertools.count():
+                try:
+                    return operation(**kwargs)
+                except Exception as err:
+                    if not throttled(err):
+                        raise
+                    delay = backoff(attempt, base=BASE_DELAY_SECONDS, cap=MAX_DELAY_SECONDS, rand=rand)
+                    if attempt + 1 >= max_attempts or delay >= remaining(deadline_at):
+                        raise
+                    logger.warning('Throttled; retrying',
+                                   extra=fields(operation=getattr(operation, '__name__', None),
+                                                attempt=attempt + 1, delay=delay))
+                    sleep(delay)
+        finally:
+            _deadline.at = outer
+    return call
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Time and peak-memory measurements compared against a stored baseline.
+
+    pytest tests/performance -m performance --no-cov               # measure and compare
+    BENCHMARK_UPDATE_BASELINE=1 pytest tests/performance --no-cov  # re-record baseline.json
+
+A measurement regresses when it exceeds its baseline by more than BENCHMARK_TOLERANCE (seconds) or
+BENCHMARK_MEMORY_TOLERANCE (peak bytes), both ratios. Timings are noisy across machines, so the time
+tolerance is generous; scaling is asserted separately with `per_item_growth`, which is machine independent.
+"""
+
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SCALES = (10, 100, 1_000, 10_000, 100_000)
+TOLERANCE = float(os.environ.get('BENCHMARK_TOLERANCE', '3.0'))
+MEMORY_TOLERANCE = float(os.environ.get('BENCHMARK_MEMORY_TOLERANCE', '1.5'))
+# Peaks below this many bytes are dominated by allocator noise and are not compared.
+MEMORY_FLOOR = 64 * 1024
+# Timings below this many seconds are dominated by timer noise and are not compared.
+TIME_FLOOR = 0.005
+
+
+def measure(f, *args, repeat=3):
+    """
+    Best-of-`repeat` wall time, and of one further call of `f(*args)` the tracemalloc peak and the bytes and
+    blocks still allocated while its result is alive, i.e. what the result did not share with `args`
+
+    >>> sorted(measure(sum, range(10)))
+    ['peak_bytes', 'retained_blocks', 'retained_bytes', 'seconds']
+    """
+    gc.collect()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        f(*args)
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        result = f(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()  # garbage cycles are not retained, just not yet collected
+        retained = tracemalloc.get_traced_memory()[0]
+        blocks = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'seconds': min(seconds), 'peak_bytes': peak, 'retained_bytes': retained, 'retained_blocks': blocks}
+
+
+def per_item_growth(results, name, small, large, key='seconds'):
+    """
+    How much the per-item cost of `name` grows from `small` to `large` items; about 1 when linear
+
+    >>> per_item_growth({'f@10': {'seconds': 1.0}, 'f@100': {'seconds': 10.0}}, 'f', 10, 100)
+    1.0
+    """
+    return (results[f'{name}@{large}'][key] / large) / (results[f'{name}@{small}'][key] / small)
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    rounded = {key: {**result, 'seconds': round(result['seconds'], 6)} for key, result in sorted(results.items())}
+    with open(path, 'w') as f:
+        json.dump(rounded, f, indent=2)
+        f.write('\n')
+
+
+def regressions(measured, baseline):
+    """
+    Descriptions of every way `measured` is worse than `baseline` beyond tolerance
+
+    >>> regressions({'seconds': 1.0, 'peak_bytes': 0}, {'seconds': 0.1, 'peak_bytes': 0})
+    ['seconds 1.0000 > 3.0 x baseline 0.1000']
+    >>> regressions({'seconds': 1.0, 'peak_bytes': 0}, None)
+    []
+    """
+    if not baseline:
+        return []
+    found = []
+    if measured['seconds'] > TIME_FLOOR and measured['seconds'] > TOLERANCE * baseline['seconds']:
+        found.append(f"seconds {measured['seconds']:.4f} > {TOLERANCE} x baseline {baseline['seconds']:.4f}")
+    if measured['peak_bytes'] > MEMORY_FLOOR and measured['peak_bytes'] > MEMORY_TOLERANCE * baseline['peak_bytes']:
+        found.append(f"peak_bytes {measured['peak_bytes']} > {MEMORY_TOLERANCE} x baseline {baseline['peak_bytes']}")
+    return found
+
+
+def report(results):
+    lines = [f"{'benchmark':<40} {'seconds':>10} {'peak KiB':>10} {'kept KiB':>10} {'kept blocks':>12}"]
+    for key, result in sorted(results.items(), key=lambda x: (x[0].split('@')[0], int(x[0].split('@')[1]))):
+        lines.append(f"{key:<40} {result['seconds']:>10.4f} {result['peak_bytes'] / 1024:>10.1f} "
+                     f"{result.get('retained_bytes', 0) / 1024:>10.1f} {result.get('retained_blocks', 0):>12}")
+    return '\n'.join(lines)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import os
+
+import pytest
+
+from tests.performance import benchmark, coldstart
+
+RESULTS = {}
+COLD_STARTS = {}
+
+
+@pytest.fixture(scope='session')
+def benchmarks():
+    """Measures `name` at `n` items, failing the test on a regression against the stored baseline"""
+    baseline = benchmark.load_baseline()
+
+    def run(name, n, f, *args):
+        key = f'{name}@{n}'
+        RESULTS[key] = benchmark.measure(f, *args, repeat=1 if n >= 100_000 else 3)
+        found = benchmark.regressions(RESULTS[key], baseline.get(key))
+        assert not found, f'{key} regressed: {found}'
+        return RESULTS[key]
+
+    run.results = RESULTS
+    return run
+
+
+@pytest.fixture(scope='session')
+def cold_starts():
+    """Measures, once per session, the cold start `name` of the handler with `event` in either import mode"""
+    def run(name, event, lazy=False, **kwargs):
+        key = f"{name} ({'lazy' if lazy else 'eager'})"
+        if key not in COLD_STARTS:
+            COLD_STARTS[key] = coldstart.measure(event, lazy=lazy, **kwargs)
+        return COLD_STARTS[key]
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter):
+    if COLD_STARTS:
+        terminalreporter.write_sep('=', 'cold starts')
+        terminalreporter.write_line(coldstart.report(COLD_STARTS))
+    if not RESULTS:
+        return
+    terminalreporter.write_sep('=', 'benchmarks')
+    terminalreporter.write_line(benchmark.report(RESULTS))
+    if os.environ.get('BENCHMARK_UPDATE_BASELINE'):
+        benchmark.save_baseline({**benchmark.load_baseline(), **RESULTS})
+        terminalreporter.write_line(f'Baseline written to {benchmark.BASELINE_PATH}')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import logging
+
+import pytest
+
+import src.app as app
+from src import metrics
+from tests.performance import benchmark, worlds
+
+# Largest tolerated growth of the per-item cost between 10,000 and 100,000 items; linear code stays near 1,
+# anything quadratic is ~10. Smaller scales are too dominated by fixed costs and allocator free lists to compare.
+MAX_PER_ITEM_GROWTH = 3.0
+
+pytestmark = [pytest.mark.performance, pytest.mark.slow]
+
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    # Record formatting would dominate the measurements.
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    yield
+    logger.setLevel(level)
+
+
+def notify(world):
+    return app.OUTPUT_SCHEMA(app.notify_cloudzero(world))
+
+
+BENCHMARKS = {
+    'notify_cloudzero': (notify, worlds.notification_world),
+    'validate_cfn_coeffect': (app.validate_cfn_coeffect, worlds.notification_world),
+    'prepare_output': (app.prepare_output, lambda n: app.validate_cfn_coeffect(worlds.notification_world(n))),
+}
+
+
+@pytest.mark.parametrize('name', sorted(BENCHMARKS))
+def test_scales_linearly(benchmarks, name):
+    f, world = BENCHMARKS[name]
+    for n in benchmark.SCALES:
+        benchmarks(name, n, f, world(n))
+    for key in ('seconds', 'peak_bytes'):
+        growth = benchmark.per_item_growth(benchmarks.results, name, 10_000, 100_000, key)
+        assert growth <= MAX_PER_ITEM_GROWTH, f'{name} {key} per item grew {growth:.1f}x from 10,000 to 100,000 items'
+
+
+def update_world(world):
+    # What each stage does to the world, without the stage's own work: merge into a branch, record a timing,
+    # validate. toolz copies only the dicts on the updated path and voluptuous passes the keys it allows through
+    # as they are, so none of this should depend on the number of visible trails.
+    world = app.update_in(world, ['effects'], lambda x: app.merge(x or {}, {'reactor_callback': {}}))
+    world = metrics.record(world, 'stages', 'effects', 0.0)
+    return app.OUTPUT_SCHEMA(world)
+
+
+def test_world_updates_share_the_output(benchmarks):
+    for n in benchmark.SCALES:
+        benchmarks('world_updates', n, update_world, notify(worlds.notification_world(n)))
+    smallest, largest = benchmarks.results['world_updates@10'], benchmarks.results['world_updates@100000']
+    # 10,000 times the items; anything copied per item would show as much more than allocator noise
+    for key in ('retained_blocks', 'retained_bytes', 'peak_bytes'):
+        assert largest[key] <= 2 * smallest[key], f'world updates {key} grew from {smallest[key]} to {largest[key]}'
+
+
+def test_synthetic_world_is_notified_like_a_real_one():
+    world = notify(worlds.notification_world(10))
+    assert len(world['output']['data']['discovery']['visible_cloudtrail_arns']) == 10
+    assert world['output']['data']['links']['audit']['role_arn'] == worlds.ROLE_ARN
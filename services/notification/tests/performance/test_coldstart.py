@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import pytest
+
+from src import app
+from tests.performance import coldstart
+
+pytestmark = [pytest.mark.performance, pytest.mark.slow]
+
+STACKS = ['Discovery', 'ResourceOwnerAccount', 'CloudTrailOwnerAccount', 'AuditAccount', 'MasterPayerAccount',
+          'LegacyAccount']
+# As connected_account.yaml sends it: every stack's outputs provided, so nothing is read from CloudFormation
+CREATE = {
+    'LogicalResourceId': 'Notification',
+    'PhysicalResourceId': 'physical_id',
+    'RequestId': 'request-id',
+    'RequestType': 'Create',
+    'ResourceProperties': {
+        'ExternalId': 'external-id',
+        'ReactorCallbackUrl': f'{coldstart.STUB}/callback',
+        'AccountName': 'account',
+        'ReactorId': 'reactor-id',
+        'AccountId': '123456789012',
+        'Region': 'us-east-1',
+        'Stacks': {stack: f'arn:aws:cloudformation:us-east-1:123456789012:stack/{stack}/id' for stack in STACKS},
+        'Outputs': app.DEFAULT_CFN_COEFFECT,
+    },
+    'ResponseURL': f'{coldstart.STUB}/response',
+    'StackId': 'stack-id',
+}
+PATHS = ('/response', '/callback')
+
+
+@pytest.mark.parametrize('lazy', [False, True], ids=['eager', 'lazy'])
+def test_cold_start_is_within_budget(cold_starts, lazy):
+    result = cold_starts('create', CREATE, lazy=lazy, paths=PATHS)
+    assert ('POST', '/callback') in result['requests']
+    assert ('PUT', '/response') in result['requests']
+    found = coldstart.over_budget(result)
+    assert not found, found
+
+
+def test_lazy_imports_never_import_boto3_with_the_outputs_provided(cold_starts):
+    modules = cold_starts('create', CREATE, lazy=True, paths=PATHS)['modules']
+    assert not {'boto3', 'botocore', 'urllib3'} & set(modules['init'])
+    assert 'boto3' not in modules['invoke']
+    assert 'urllib3' in modules['invoke']
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+"""
+Synthetic notification worlds whose Discovery outputs list `n` visible trails (the only output that grows)
+and `n` bucket ARNs.
+"""
+
+ACCOUNT_ID = '123456789012'
+ROLE_ARN = f'arn:aws:iam::{ACCOUNT_ID}:role/cloudzero'
+
+
+def trail_arns(n):
+    return ','.join(f'arn:aws:cloudtrail:us-east-1:{ACCOUNT_ID}:trail/trail-{i}' for i in range(n))
+
+
+def bucket_arns(n):
+    return ','.join(f'arn:aws:s3:::bucket-{i},arn:aws:s3:::bucket-{i}/*' for i in range(n))
+
+
+def cfn_coeffect(n):
+    return {
+        'AuditAccount': {'RoleArn': ROLE_ARN},
+        'CloudTrailOwnerAccount': {
+            'SQSQueueArn': f'arn:aws:sqs:us-east-1:{ACCOUNT_ID}:cloudzero',
+            'SQSQueuePolicyName': 'cloudzero',
+        },
+        'Discovery': {
+            'AuditCloudTrailBucketName': 'bucket-0',
+            'AuditCloudTrailBucketPrefix': 'trails',
+            'CloudTrailSNSTopicArn': f'arn:aws:sns:us-east-1:{ACCOUNT_ID}:topic',
+            'CloudTrailTrailArn': f'arn:aws:cloudtrail:us-east-1:{ACCOUNT_ID}:trail/trail-0',
+            'VisibleCloudTrailArns': trail_arns(n),
+            'IsAuditAccount': 'true',
+            'IsCloudTrailOwnerAccount': 'true',
+            'IsMasterPayerAccount': 'true',
+            'IsOrganizationMasterAccount': 'true',
+            'IsOrganizationTrail': 'true',
+            'IsResourceOwnerAccount': 'true',
+            'MasterPayerBillingBucketName': 'bucket-0',
+            'MasterPayerBillingBucketPath': 'cur/report',
+            'MasterPayerBillingBucketArns': bucket_arns(n),
+            'BillingReportFormat': 'aws',
+            'RemoteCloudTrailBucket': 'false',
+        },
+        'MasterPayerAccount': {'RoleArn': ROLE_ARN, 'ReportS3Bucket': 'bucket-0', 'ReportS3Prefix': 'cur'},
+        'ResourceOwnerAccount': {'RoleArn': ROLE_ARN},
+        'LegacyAccount': {'RoleArn': ROLE_ARN},
+    }
+
+
+def notification_world(n):
+    """The world as it is after the coeffects, ready for `notify_cloudzero`"""
+    return {
+        'event': {
+            'RequestType': 'Create',
+            'ResourceProperties': {
+                'AccountId': ACCOUNT_ID,
+                'Region': 'us-east-1',
+                'ExternalId': 'external-id',
+                'ReactorCallbackUrl': 'https://reactor.cloudzero.com/callback',
+                'AccountName': 'account',
+                'ReactorId': 'reactor',
+                'Stacks': {},
+            },
+            'ResponseURL': 'https://cfn.amazonaws.com/callback',
+            'StackId': 'stack-id',
+        },
+        'coeffects': {'cloudformation': cfn_coeffect(n)},
+    }
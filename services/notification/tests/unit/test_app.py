@@ -2,12 +2,17 @@
 # Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
 # Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
 
+import copy
 import os
 import random
+import threading
+import time
 from collections import namedtuple
+from types import SimpleNamespace
 
 import pytest
 import json
+from voluptuous import Invalid
 
 import src.app as app
 from src import cfnresponse
@@ -123,7 +128,7 @@ def context(mocker):
     context.prefix = app.__name__
     context.mock_cfnresponse_send = mocker.patch(f'{context.prefix}.cfnresponse.send', autospec=True)
     context.mock_http = mocker.patch(f'{context.prefix}.http')
-    context.mock_cfn = mocker.patch(f'{context.prefix}.cfn', autospec=True)
+    context.mock_cfn = mocker.patch(f'{context.prefix}.cfn', autospec=True).return_value
     yield context
     os.environ = orig_env
     mocker.stopall()
@@ -204,6 +209,7 @@ def test_prepare_output(context, cfn_event, cfn_coeffect):
 @pytest.mark.unit
 @pytest.mark.parametrize('raw_format,expected', [
     ('aws_parquet', 'aws_parquet'),
+    ('aws_cur2_parquet', 'aws_cur2_parquet'),
     ('null', 'aws'),
     ('aws', 'aws'),
 ])
@@ -215,3 +221,130 @@ def test_prepare_output_billing_format(context, cfn_event, cfn_coeffect, raw_for
     }
     new_world = app.prepare_output(world)
     assert new_world['output']['data']['metadata']['billing_report_format'] == expected
+
+
+def describe_stacks_response(outputs):
+    return {'Stacks': [{'StackName': 'stack', 'StackStatus': 'CREATE_COMPLETE', 'Parameters': [], 'Tags': [],
+                        'Outputs': [{'OutputKey': k, 'OutputValue': v} for k, v in outputs.items()]}]}
+
+
+def stacks_by_name(cfn_event, cfn_coeffect):
+    names = {key: f'{key}-stack' for key in cfn_event['ResourceProperties']['Stacks']}
+    cfn_event['ResourceProperties']['Stacks'] = names
+    return {name: cfn_coeffect[key] for key, name in names.items()}
+
+
+@pytest.mark.unit
+def test_coeffects_cfn_keeps_only_outputs_of_each_stack(context, cfn_event, cfn_coeffect):
+    outputs = stacks_by_name(cfn_event, cfn_coeffect)
+    context.mock_cfn.describe_stacks.side_effect = lambda StackName: describe_stacks_response(outputs[StackName])
+    world = app.coeffects_cfn(app.INPUT_SCHEMA({'event': cfn_event}))
+    assert world['coeffects']['cloudformation'] == cfn_coeffect
+    assert context.mock_cfn.describe_stacks.call_count == len(outputs)
+
+
+@pytest.mark.unit
+def test_coeffects_cfn_fetches_stacks_concurrently(context, cfn_event, cfn_coeffect):
+    outputs = stacks_by_name(cfn_event, cfn_coeffect)
+    gate = threading.Barrier(len(outputs), timeout=5)
+
+    def describe_stacks(StackName):
+        gate.wait()  # only passes once every stack is being described at the same time
+        return describe_stacks_response(outputs[StackName])
+
+    context.mock_cfn.describe_stacks.side_effect = describe_stacks
+    world = app.coeffects_cfn(app.INPUT_SCHEMA({'event': cfn_event}))
+    assert world['coeffects']['cloudformation'] == cfn_coeffect
+
+
+@pytest.mark.unit
+def test_slow_or_failed_stack_only_defaults_itself(context, cfn_event, cfn_coeffect):
+    cfn_coeffect['Discovery'] = {**app.DEFAULT_CFN_COEFFECT['Discovery'], 'IsAuditAccount': 'true'}
+    outputs = stacks_by_name(cfn_event, cfn_coeffect)
+    release = threading.Event()
+
+    def describe_stacks(StackName):
+        if StackName == 'AuditAccount-stack':
+            release.wait(5)
+        if StackName == 'LegacyAccount-stack':
+            raise ValueError('Stack is being deleted')
+        return describe_stacks_response(outputs[StackName])
+
+    context.mock_cfn.describe_stacks.side_effect = describe_stacks
+    started = time.monotonic()
+    world = app.coeffects_cfn(app.INPUT_SCHEMA({'event': cfn_event, 'deadline': time.monotonic() + 0.5}))
+    release.set()
+    assert time.monotonic() - started < 5
+    cfn = world['coeffects']['cloudformation']
+    assert cfn['AuditAccount'] == app.DEFAULT_CFN_COEFFECT['AuditAccount']
+    assert cfn['LegacyAccount'] == app.DEFAULT_CFN_COEFFECT['LegacyAccount']
+    assert cfn['Discovery'] == cfn_coeffect['Discovery']
+    assert app.validate_cfn_coeffect(world)['valid_cfn']['Discovery'] == cfn_coeffect['Discovery']
+
+
+def valid_cfn_coeffect():
+    return {**app.DEFAULT_CFN_COEFFECT,
+            'Discovery': {**app.DEFAULT_CFN_COEFFECT['Discovery'], 'IsAuditAccount': 'true'},
+            'AuditAccount': {'RoleArn': 'arn:aws:iam::123456789012:role/audit'}}
+
+
+@pytest.mark.unit
+def test_outputs_in_resource_properties_need_no_cloudformation_reads(context, cfn_event):
+    cfn_event['ResourceProperties']['Outputs'] = valid_cfn_coeffect()
+    world = app.notify_cloudzero(app.coeffects(app.INPUT_SCHEMA({'event': cfn_event})))
+    assert context.mock_cfn.describe_stacks.call_count == 0
+    assert world['valid_cfn'] == valid_cfn_coeffect()
+    assert world['output']['data']['links']['audit']['role_arn'] == 'arn:aws:iam::123456789012:role/audit'
+
+
+@pytest.mark.unit
+def test_only_stacks_missing_from_resource_properties_are_read(context, cfn_event):
+    expected = valid_cfn_coeffect()
+    cfn_event['ResourceProperties']['Outputs'] = {k: v for k, v in expected.items() if k != 'MasterPayerAccount'}
+    context.mock_cfn.describe_stacks.return_value = describe_stacks_response(expected['MasterPayerAccount'])
+    world = app.coeffects_cfn(app.INPUT_SCHEMA({'event': cfn_event}))
+    context.mock_cfn.describe_stacks.assert_called_once_with(StackName='stack-arn')
+    assert world['coeffects']['cloudformation'] == expected
+
+
+@pytest.mark.unit
+def test_resource_property_outputs_must_be_strings(cfn_event):
+    cfn_event['ResourceProperties']['Outputs'] = {'AuditAccount': {'RoleArn': None}}
+    with pytest.raises(Invalid):
+        app.INPUT_SCHEMA({'event': cfn_event})
+
+
+@pytest.mark.unit
+def test_reactor_callback_records_attempts_in_effects(context, cfn_event):
+    context.mock_http.request.side_effect = [SimpleNamespace(status=503, data=b'busy'), SimpleNamespace(status=200, data=b'ok')]
+    world = app.effects(app.INPUT_SCHEMA({'event': cfn_event}))
+    reactor = world['effects']['reactor']
+    assert reactor['delivered'] is True
+    assert [a['status'] for a in reactor['attempts']] == [503, 200]
+    assert reactor['text'] == 'ok'
+
+
+@pytest.mark.unit
+def test_handler_emits_stage_coeffect_and_effect_timings(context, cfn_event, capsys):
+    context.mock_http.request.return_value = SimpleNamespace(status=200, data=b'ok')
+    app.handler(cfn_event, None)
+    stages = {json.loads(line)['Stage'] for line in capsys.readouterr().out.splitlines() if '"_aws"' in line}
+    assert {'stages.INPUT_SCHEMA', 'stages.coeffects', 'stages.notify_cloudzero', 'stages.effects',
+            'stages.OUTPUT_SCHEMA', 'stages.total', 'coeffects.cloudformation', 'effects.reactor'} <= stages
+
+
+@pytest.mark.unit
+def test_handler_emits_the_timings_of_a_failed_invocation(context, capsys):
+    app.handler({}, None)
+    stages = {json.loads(line)['Stage'] for line in capsys.readouterr().out.splitlines() if '"_aws"' in line}
+    assert stages == {'stages.INPUT_SCHEMA', 'stages.total'}
+
+
+@pytest.mark.unit
+def test_stages_share_what_they_do_not_change(cfn_event):
+    world = {'event': cfn_event, 'coeffects': {'cloudformation': app.DEFAULT_CFN_COEFFECT}}
+    before = copy.deepcopy(world)
+    notified = app.OUTPUT_SCHEMA(app.notify_cloudzero(world))
+    assert world == before
+    assert notified['event'] is world['event']
+    assert notified['coeffects'] is world['coeffects']
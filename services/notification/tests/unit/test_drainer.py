@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import src.app as app
+from src import drainer, outbox
+
+URL = 'https://reactor.cloudzero.com/callback'
+
+
+@pytest.fixture()
+def cfn_event():
+    return {
+        'RequestType': 'Create',
+        'RequestId': 'request-id',
+        'ResourceProperties': {
+            'AccountId': '123456789012',
+            'Region': 'us-east-1',
+            'ExternalId': 'external-id',
+            'ReactorCallbackUrl': URL,
+            'AccountName': 'account',
+            'ReactorId': 'reactor',
+            'Stacks': {key: 'stack-arn' for key in app.DEFAULT_CFN_COEFFECT},
+        },
+        'ResponseURL': 'https://cfn.amazonaws.com/callback',
+        'StackId': 'stack-id',
+    }
+
+
+@pytest.fixture()
+def file_outbox(tmp_path, monkeypatch):
+    monkeypatch.setenv('OUTBOX', f'file://{tmp_path}')
+    return outbox.FileOutbox(str(tmp_path))
+
+
+@pytest.fixture()
+def reactor(mocker):
+    mocker.patch.object(drainer, '_delivered', drainer.OrderedDict())
+    mocker.patch.object(drainer.retries, 'backoff', return_value=0)
+    http = mocker.patch.object(drainer, 'http')
+    http.request.return_value = SimpleNamespace(status=200)
+    return http
+
+
+def queue(cfn_event):
+    world = app.INPUT_SCHEMA({'event': cfn_event})
+    return app.effects(app.prepare_output(app.validate_cfn_coeffect(world)))
+
+
+def sqs_event(*messages):
+    return {'Records': [{'messageId': f'm{i}', 'body': json.dumps(m)} for i, m in enumerate(messages)]}
+
+
+@pytest.mark.unit
+def test_outbox_mode_queues_instead_of_calling_back(file_outbox, cfn_event, mocker):
+    http = mocker.patch.object(app, 'http')
+    world = queue(cfn_event)
+    assert world['effects']['outbox']['queued'] is True
+    assert 'reactor' not in world['effects']
+    assert http.request.call_count == 0
+    [record] = file_outbox.receive()
+    assert json.loads(record['body'])['output'] == world['output']
+
+
+@pytest.mark.unit
+def test_callback_is_sent_directly_when_it_cannot_be_queued(file_outbox, cfn_event, mocker):
+    mocker.patch.object(outbox.FileOutbox, 'put', side_effect=OSError('disk full'))
+    http = mocker.patch.object(app, 'http')
+    http.request.return_value = SimpleNamespace(status=200, data=b'ok')
+    world = queue(cfn_event)
+    assert world['effects']['outbox'] == {}
+    assert world['effects']['reactor']['delivered'] is True
+
+
+@pytest.mark.unit
+def test_drain_delivers_and_deletes_deduplicated_messages(file_outbox, cfn_event, reactor):
+    queue(cfn_event)
+    queue(cfn_event)  # the same CloudFormation request again
+    assert len(file_outbox.receive()) == 1
+    assert drainer.drain(file_outbox) == []
+    assert reactor.request.call_count == 1
+    assert reactor.request.call_args.args == ('POST', URL)
+    assert file_outbox.receive() == []
+
+
+@pytest.mark.unit
+def test_handler_reports_only_undelivered_records(reactor):
+    delivered = outbox.message(URL, {'n': 1}, 'stack', 'request-1')
+    undelivered = outbox.message(URL + '/down', {'n': 2}, 'stack', 'request-2')
+    reactor.request.side_effect = lambda method, url, **kwargs: SimpleNamespace(status=200 if url == URL else 503)
+    response = drainer.handler(sqs_event(delivered, undelivered, undelivered), None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm1'}, {'itemIdentifier': 'm2'}]}
+    assert sum(1 for c in reactor.request.call_args_list if c.args[1] == URL) == 1
+
+
+@pytest.mark.unit
+def test_a_failed_create_holds_back_the_later_delete_of_its_group(reactor):
+    create = outbox.message(URL, {'RequestType': 'Create'}, 'stack', 'request-1', group='123456789012')
+    delete = outbox.message(URL, {'RequestType': 'Delete'}, 'stack', 'request-2', group='123456789012')
+    other = outbox.message(URL, {'RequestType': 'Update'}, 'stack', 'request-3', group='210987654321')
+    reactor.request.side_effect = lambda method, url, body, **kwargs: SimpleNamespace(
+        status=503 if body == json.dumps(create['output']).encode('utf-8') else 200)
+    response = drainer.handler(sqs_event(create, delete, other), None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm0'}, {'itemIdentifier': 'm1'}]}
+    sent = [json.loads(c.kwargs['body']) for c in reactor.request.call_args_list]
+    assert delete['output'] not in sent
+    assert other['output'] in sent
+
+
+@pytest.mark.unit
+def test_records_after_a_timed_out_one_are_failed_with_it(reactor, mocker):
+    first, second = (outbox.message(URL, {'n': n}, 'stack', f'request-{n}', group='123456789012') for n in (1, 2))
+    mocker.patch.object(drainer, 'remaining', side_effect=[1, 0])
+    response = drainer.handler(sqs_event(first, second), None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    assert reactor.request.call_count == 1
+
+
+@pytest.mark.unit
+def test_redelivered_messages_are_not_sent_twice(reactor):
+    message = outbox.message(URL, {'n': 1}, 'stack', 'request-1')
+    assert drainer.handler(sqs_event(message), None) == {'batchItemFailures': []}
+    assert drainer.handler(sqs_event(message), None) == {'batchItemFailures': []}
+    assert reactor.request.call_count == 1
+
+
+@pytest.mark.unit
+def test_unreadable_messages_are_failed(reactor):
+    response = drainer.handler({'Records': [{'messageId': 'm0', 'body': 'not json'}]}, None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'm0'}]}
+
+
+@pytest.mark.unit
+def test_fifo_queue_messages_carry_group_and_deduplication_ids(mocker):
+    sqs = mocker.patch.object(outbox.registry, 'client').return_value
+    message = outbox.message(URL, {}, 'stack', 'request', group='123456789012')
+    outbox.SqsOutbox('https://sqs.us-east-1.amazonaws.com/123456789012/outbox.fifo').put(message)
+    kwargs = sqs.send_message.call_args.kwargs
+    assert (kwargs['MessageGroupId'], kwargs['MessageDeduplicationId']) == ('123456789012', message['id'])
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import pytest
+from voluptuous import Invalid, Schema
+
+from src import app
+from src.fieldmap import Field, Output, compile_fields, data_validators, default_outputs, nest, outputs_schema
+
+
+@pytest.mark.unit
+def test_one_field_reaches_the_defaults_the_schemas_and_the_data():
+    fields = app.FIELDS + [Field(('discovery', 'is_new'), [Output('Discovery', 'IsNew', 'false')], app.BOOLEAN,
+                                 nullable=False)]
+    defaults = default_outputs(fields)
+    assert defaults['Discovery']['IsNew'] == 'false'
+
+    outputs = {**defaults, 'Discovery': {**defaults['Discovery'], 'IsNew': 'true'}}
+    assert outputs_schema(fields)(outputs) == outputs
+    with pytest.raises(Invalid):
+        outputs_schema(fields)({**defaults, 'Discovery': {**defaults['Discovery'], 'IsNew': 'maybe'}})
+
+    data = compile_fields(fields)(outputs)
+    assert data['discovery']['is_new'] is True
+    assert Schema(nest(data_validators(fields)))(data) == data
+
+
+@pytest.mark.unit
+def test_defaults_cover_every_stack():
+    assert set(app.DEFAULT_CFN_COEFFECT) == {'AuditAccount', 'CloudTrailOwnerAccount', 'Discovery',
+                                             'MasterPayerAccount', 'ResourceOwnerAccount', 'LegacyAccount'}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('discovery,master_payer,expected', [
+    ('discovered-bucket', 'report-bucket', 'discovered-bucket'),
+    ('null', 'report-bucket', 'report-bucket'),
+    ('null', 'null', None),
+])
+def test_later_sources_fill_in_for_null_ones(discovery, master_payer, expected):
+    outputs = {**app.DEFAULT_CFN_COEFFECT,
+               'Discovery': {**app.DEFAULT_CFN_COEFFECT['Discovery'], 'MasterPayerBillingBucketName': discovery},
+               'MasterPayerAccount': {**app.DEFAULT_CFN_COEFFECT['MasterPayerAccount'], 'ReportS3Bucket': master_payer}}
+    assert app.callback_data(outputs)['discovery']['master_payer_billing_bucket_name'] == expected
+
+
+@pytest.mark.unit
+def test_non_nullable_fields_reject_none():
+    validate = Schema(nest(data_validators(app.FIELDS)))
+    data = app.callback_data(app.DEFAULT_CFN_COEFFECT)
+    assert validate(data) == data
+    with pytest.raises(Invalid):
+        validate({**data, 'discovery': {**data['discovery'], 'is_audit_account': None}})
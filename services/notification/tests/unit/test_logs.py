@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import json
+import logging
+
+import pytest
+
+from src import logs
+
+
+def make_record(msg, level=logging.INFO, extra=None):
+    logger = logging.getLogger('test_logs')
+    return logger.makeRecord(logger.name, level, __file__, 1, msg, (), None, extra=extra)
+
+
+@pytest.mark.unit
+def test_json_formatter_emits_fields_and_caps_large_values(monkeypatch):
+    monkeypatch.setattr(logs, 'MAX_FIELD_CHARS', 50)
+    record = make_record('Found trails', extra=logs.fields(small={'a': 1}, large=['arn'] * 100))
+    document = json.loads(logs.JsonFormatter().format(record))
+    assert document['message'] == 'Found trails'
+    assert document['level'] == 'INFO'
+    assert document['small'] == {'a': 1}
+    assert document['large']['truncated'] is True
+    assert document['large']['length'] == len(json.dumps(['arn'] * 100))
+    assert len(document['large']['preview']) == 50
+
+
+@pytest.mark.unit
+def test_events_are_logged_without_the_response_url_signature():
+    url = 'https://cloudformation-custom-resource-response-useast1.s3.amazonaws.com/stack/request'
+    event = {'RequestType': 'Create', 'ResponseURL': f'{url}?X-Amz-Signature=secret'}
+    record = make_record('Processing event', extra=logs.fields(event=logs.event_fields(event)))
+    assert json.loads(logs.JsonFormatter().format(record))['event'] == {'RequestType': 'Create', 'ResponseURL': url}
+    assert logs.event_fields({}) == {}
+
+
+@pytest.mark.unit
+def test_verbose_records_are_sampled():
+    sampler = logs.VerboseSampler(rate=0.0)
+    assert sampler.filter(make_record('plain', extra=logs.fields(a=1)))
+    assert not sampler.filter(make_record('verbose', extra=logs.verbose(a=1)))
+    assert logs.VerboseSampler(rate=1.0).filter(make_record('verbose', extra=logs.verbose(a=1)))
+
+
+@pytest.mark.unit
+def test_configure_installs_formatter_and_sampler_once():
+    logger = logging.getLogger('test_logs.configure')
+    handler = logging.StreamHandler()
+    logger.addHandler(handler)
+    try:
+        logs.configure(logs.configure(logger))
+        assert isinstance(handler.formatter, logs.JsonFormatter)
+        assert len([f for f in handler.filters if isinstance(f, logs.VerboseSampler)]) == 1
+    finally:
+        logger.removeHandler(handler)
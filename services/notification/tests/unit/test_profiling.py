@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+
+from src import profiling
+from src.clients import ClientRegistry
+
+
+def session():
+    return boto3.session.Session(aws_access_key_id='testing', aws_secret_access_key='testing',
+                                 region_name='us-east-1')
+
+
+@pytest.fixture()
+def profiled():
+    profiler = profiling.CallProfiler()
+    return profiler, ClientRegistry(session_factory=session, profiler=profiler)
+
+
+@pytest.mark.unit
+def test_profiler_aggregates_calls_per_operation(profiled):
+    profiler, clients = profiled
+    s3 = clients.client('s3')
+    with Stubber(s3) as stubber:
+        for _ in range(3):
+            stubber.add_response('list_buckets', {'Buckets': [], 'ResponseMetadata': {'RetryAttempts': 2}})
+        stubber.add_client_error('get_bucket_location', service_error_code='ThrottlingException',
+                                 http_status_code=400)
+        for _ in range(3):
+            s3.list_buckets()
+        with pytest.raises(ClientError):
+            s3.get_bucket_location(Bucket='bucket')
+
+    summary = profiler.summary()
+    assert set(summary) == {'s3.ListBuckets', 's3.GetBucketLocation'}
+    assert summary['s3.ListBuckets']['calls'] == 3
+    assert summary['s3.ListBuckets']['retries'] == 6
+    assert summary['s3.ListBuckets']['errors'] == {}
+    assert summary['s3.ListBuckets']['p50_ms'] <= summary['s3.ListBuckets']['p99_ms'] <= \
+        summary['s3.ListBuckets']['max_ms']
+    assert summary['s3.GetBucketLocation']['errors'] == {'ThrottlingException': 1}
+    assert summary['s3.GetBucketLocation']['throttled'] == 1
+
+
+@pytest.mark.unit
+def test_profiler_counts_throttled_attempts_that_were_retried(profiled):
+    profiler, clients = profiled
+    events = clients.client('organizations').meta.events
+    context = {}
+    profiler._before_call(context=context)
+    for _ in range(2):
+        profiler._needs_retry(request_dict={'context': context},
+                              response=(None, {'Error': {'Code': 'TooManyRequestsException'}}), attempts=1)
+    http_response = type('Response', (), {'status_code': 200, 'headers': {'content-length': '120'}})()
+    events.emit('after-call.organizations.DescribeOrganization', http_response=http_response,
+                parsed={'ResponseMetadata': {'RetryAttempts': 2}}, model=None, context=context)
+
+    summary = profiler.drain()['organizations.DescribeOrganization']
+    assert summary['throttled'] == 2
+    assert summary['retries'] == 2
+    assert summary['bytes'] == 120
+    assert profiler.summary() == {}
+
+
+@pytest.mark.unit
+def test_profiler_records_calls_that_never_got_a_response(profiled):
+    profiler, clients = profiled
+    events = clients.client('cloudtrail').meta.events
+    context = {}
+    profiler._before_call(context=context)
+    context['retries'] = {'attempt': 5}
+    events.emit('after-call-error.cloudtrail.DescribeTrails', context=context,
+                exception=EndpointConnectionError(endpoint_url='https://cloudtrail.us-east-1.amazonaws.com'))
+
+    summary = profiler.summary()['cloudtrail.DescribeTrails']
+    assert summary['errors'] == {'EndpointConnectionError': 1}
+    assert summary['retries'] == 4
+    assert summary['max_ms'] is not None
+
+
+@pytest.mark.unit
+def test_profiler_is_shared_by_concurrent_calls(profiled):
+    profiler, clients = profiled
+    ec2 = clients.client('ec2')
+    with Stubber(ec2) as stubber:
+        for _ in range(20):
+            stubber.add_response('describe_regions', {'Regions': []})
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda _: ec2.describe_regions(), range(20)))
+    assert profiler.summary()['ec2.DescribeRegions']['calls'] == 20
+
+
+@pytest.mark.unit
+def test_summarize_only_when_profiling():
+    assert profiling.summarize({'a': 1}, ClientRegistry(session_factory=session)) == {'a': 1}
+    profiled = ClientRegistry(session_factory=session, profiler=profiling.CallProfiler())
+    assert profiling.summarize({'a': 1}, profiled) == {'a': 1, 'aws_calls': {}}
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016-present, CloudZero, Inc. All rights reserved.
+# Licensed under the BSD-style license. See LICENSE file in the project root for full license information.
+
+import pytest
+from voluptuous import (All, Any, ExactSequence, Invalid, Length, Marker, Match, Optional, Required, Schema,
+                        ALLOW_EXTRA, PREVENT_EXTRA, REMOVE_EXTRA)
+
+import src.app as app
+from src.clients import ClientRegistry
+from src.validation import Validator, compiled
+
+REPLACEMENTS = [None, 0, 1, True, False, 1.5, '', 'x', 'true', '123', [], ['x'], {}, {'x': 'y'}, ('x',)]
+STRINGS = ['arn:aws:iam::123456789012:role/name', '123', 'x', '']
+SAMPLES = {str: 'x', bool: True, int: 1, float: 1.5, dict: {}, list: [], ClientRegistry: ClientRegistry()}
+
+
+def examples(node):
+    """Values `node` accepts, or nearly does"""
+    if isinstance(node, (Schema, Validator)):
+        return examples(node.schema)
+    if isinstance(node, dict):
+        key = next(iter(node), None)
+        return [{example_key(k): examples(v)[0] for k, v in node.items()}] + ([{'x': examples(node[key])[0]}]
+                                                                              if isinstance(key, type) else [])
+    if isinstance(node, list):
+        return [[examples(v)[0] for v in node]]
+    if isinstance(node, Any):
+        return [e for v in node.validators for e in examples(v)]
+    if isinstance(node, Match):
+        return STRINGS
+    if isinstance(node, type):
+        return [SAMPLES[node]]
+    if callable(node):
+        return STRINGS
+    return [node]
+
+
+def example_key(key):
+    if isinstance(key, Marker):
+        return key.schema
+    return 'x' if key is str else key
+
+
+def mutations(node, value, depth=3):
+    """`value` and many ways of getting it wrong"""
+    yield value
+    yield from REPLACEMENTS
+    if isinstance(node, (Schema, Validator)):
+        node = node.schema
+    if depth and isinstance(value, dict) and isinstance(node, dict):
+        schema_by_key = {example_key(k): v for k, v in node.items()}
+        yield {**value, 'extra': 'value'}
+        for key in value:
+            yield {k: v for k, v in value.items() if k != key}
+            for mutated in mutations(schema_by_key.get(key), value[key], depth - 1):
+                yield {**value, key: mutated}
+    if depth and isinstance(value, list) and isinstance(node, list) and node:
+        for item in examples(node[0]):
+            yield value + [item]
+            for mutated in mutations(node[0], item, depth - 1):
+                yield [mutated]
+
+
+def outcome(validate, data):
+    try:
+        return 'accepted', validate(data)
+    except Invalid:
+        return 'rejected', None
+
+
+SYNTHETIC = [
+    Schema({'a': str, Optional('b'): int}, required=True, extra=PREVENT_EXTRA),
+    Schema({'a': str, Required('b'): Any(None, int)}, extra=REMOVE_EXTRA),
+    Schema({str: str}, required=True),
+    Schema({Optional('nested'): {str: {'v': bool}}}, required=True, extra=REMOVE_EXTRA),
+    Schema({'items': [{'name': str}, str]}, required=True),
+    Schema({'items': [Any({'name': str}, int)]}, required=True),
+    Schema({'items': []}),
+    Schema({'inner': Schema({'a': int}, extra=ALLOW_EXTRA), 'b': bool}, required=True, extra=PREVENT_EXTRA),
+    Schema({'arn': Any('null', Match(r'^arn:aws:[a-z]+:')), 'n': Any(int, Match(r'^\d+$'))}, required=True),
+    Schema({'seq': ExactSequence(['x']), 'len': All(str, Length(min=1))}, required=True),
+    Schema({Optional('a', default='d'): str, 'b': int}),
+    Schema(Any(None, {'a': float}), required=True),
+]
+VALIDATORS = [app.INPUT_SCHEMA, app.CFN_COEFFECT_SCHEMA, app.OUTPUT_SCHEMA] + [compiled(schema) for schema in SYNTHETIC]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('validate', VALIDATORS, ids=lambda v: repr(v.schema)[:60])
+def test_compiled_validator_agrees_with_voluptuous(validate):
+    checked = 0
+    for example in examples(validate.schema):
+        for data in mutations(validate.schema, example):
+            assert outcome(validate, data) == outcome(validate.schema, data), data
+            checked += 1
+    assert checked > len(REPLACEMENTS)
+
+
+@pytest.mark.unit
+def test_compiled_validator_raises_voluptuous_errors_with_a_path():
+    with pytest.raises(Invalid) as raised:
+        app.INPUT_SCHEMA({'event': {'RequestType': 'Create', 'ResourceProperties': {}, 'ResponseURL': '',
+                                    'StackId': ''}})
+    assert raised.value.path == ['event', 'ResourceProperties', 'ExternalId']